@@ -0,0 +1,116 @@
+import collections
+import torch
+import torch.utils.data as D
+from concurrent.futures import ThreadPoolExecutor
+from ExpandableModel import ExpandableModel
+from TaskPrefetcher import MaterializedLoader
+
+"""
+Tests models on all tasks trained so far in the background, so that training on the next task does not have to wait for
+testing on the current one to finish. Used for models whose test results do not decide whether the network is expanded
+(an accuracy threshold of 0), where testing only produces the accuracies written to the results file.
+
+When a model is submitted, the models used for testing (see ExpandableModel.generate_model_dictionary()) are generated
+from its current weights on the calling thread- these hold copies of the weights, so the model can go on training while
+they are tested on a single worker thread. On the GPU the worker runs in its own CUDA stream, so that testing can
+overlap with training rather than being queued behind it in the default stream.
+
+The test models' per-task state (the post-training weights and input permutations of each task) is copied as well, as
+the model may retrain a task, be expanded or permute its stored weights while the test is queued. The test sets are
+read unshuffled, drawing only from the evaluator's own generator- the order in which samples are tested has no effect on
+the results, and drawing from the global RNG (as a shuffling DataLoader does) from the worker thread would change the
+random numbers seen by training depending on the timing of the thread, so that runs would not be reproducible.
+
+A thread is used rather than a separate process because the test data (DataLoaders with lambda transforms, or test sets
+cached on the device- see TestSetCache) cannot be sent to another process.
+
+Results are returned in the order in which the models were submitted (see completed()), so that they are written to the
+results file in order.
+"""
+class AsyncEvaluator:
+
+    def __init__(self, device):
+
+        self.device = device
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.stream = torch.cuda.Stream(device=device) if device.type == 'cuda' else None
+
+        # generator for the (worker seeds of the) DataLoaders over the test sets- see unshuffled()
+        self.generator = torch.Generator()
+        self.generator.manual_seed(0)
+
+        # (key, future) for each submitted evaluation, in order of submission
+        self.pending = collections.deque()
+
+    # start testing model on all of the tasks in test_loaders- key identifies the results when they are returned
+    def submit(self, model, test_loaders, args, key):
+
+        models = model.generate_model_dictionary()
+
+        # the test models share the model's per-task state, which may change before they are tested
+        task_post_training_weights = {task: list(weights) for task, weights in model.task_post_training_weights.items()}
+        task_input_permutations = dict(model.task_input_permutations)
+
+        for test_model in models.values():
+            test_model.task_post_training_weights = task_post_training_weights
+            test_model.task_input_permutations = task_input_permutations
+
+        batch_size = model.evaluation_batch_size(args)
+
+        # the copies of the weights in the test models are made in the current stream- the worker's stream must wait
+        # for them to be complete before using them
+        ready = None
+
+        if self.stream is not None:
+            ready = torch.cuda.Event()
+            ready.record()
+
+        future = self.executor.submit(self.evaluate, models, [self.unshuffled(loader) for loader in test_loaders],
+                                      batch_size, ready)
+
+        self.pending.append((key, future))
+
+    # an iterable over the same test batches as test_loader that draws nothing from the global RNG
+    def unshuffled(self, test_loader):
+
+        if isinstance(test_loader, D.DataLoader):
+            return D.DataLoader(test_loader.dataset, batch_size=test_loader.batch_size, shuffle=False,
+                                num_workers=test_loader.num_workers, collate_fn=test_loader.collate_fn,
+                                pin_memory=test_loader.pin_memory, generator=self.generator)
+
+        if isinstance(test_loader, MaterializedLoader):
+            return MaterializedLoader(test_loader.dataset, test_loader.batch_size, shuffle=False)
+
+        # (e.g. a CachedTestSet, which is always read in order)
+        return test_loader
+
+    def evaluate(self, models, test_loaders, batch_size, ready):
+
+        if self.stream is None:
+            return ExpandableModel.evaluate_model_dictionary(models, test_loaders, 0, batch_size)
+
+        with torch.cuda.stream(self.stream):
+            self.stream.wait_event(ready)
+
+            return ExpandableModel.evaluate_model_dictionary(models, test_loaders, 0, batch_size)
+
+    # Return a list of (key, test accuracies) for the evaluations that have completed, in order of submission- an
+    # evaluation that has completed is only returned once all of those submitted before it have been. If block is
+    # True, wait for all pending evaluations to complete.
+    def completed(self, block=False):
+
+        results = []
+
+        while self.pending and (block or self.pending[0][1].done()):
+            key, future = self.pending.popleft()
+
+            results.append((key, future.result()))
+
+        return results
+
+    def close(self):
+
+        self.executor.shutdown(wait=True)
+
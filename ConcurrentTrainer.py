@@ -0,0 +1,80 @@
+import torch
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Trains the models of a run (see setup.py --nets) on each task at the same time, rather than one after another (see
+setup.py --concurrent-nets). The models only share the task's data, so a run of, e.g., EWCMLP and VanillaMLP side by
+side takes about as long as the slower of the two.
+
+Each model is trained and tested on a worker thread of its own. On the GPU every worker runs in its own CUDA stream, so
+that the models' kernels are not queued behind one another in the default stream. PyTorch releases the GIL while
+running operators, so the workers also overlap on the CPU (although they share its intra-op threads).
+
+Threads are used rather than separate processes for the same reason as in AsyncEvaluator: the task data (DataLoaders
+with lambda transforms, or test sets cached on the device- see TestSetCache) cannot be sent to another process. The
+workers read the same in-memory task data instead, so it is never copied.
+
+run() returns once every model has finished the task, with the results in the order of the models, so that main.py
+makes the same decisions about expanding and retraining the networks as when the models are trained one after another.
+main.py then consolidates the task (e.g. Fisher estimation) and records the metrics of each model in that order (see
+ExpandableModel.finish_task()), so that the metrics and EWC sums are those of a sequential run.
+NOTE: the global RNGs (used for shuffling and weight initialization) are drawn from by the workers in an unpredictable
+order, so runs are not exactly reproducible in this mode.
+"""
+class ConcurrentTrainer:
+
+    def __init__(self, device, workers):
+
+        self.device = device
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        self.streams = [torch.cuda.Stream(device=device) for worker in range(workers)] \
+            if device.type == 'cuda' else None
+
+    # call work(model) for every model in models at once, returning the results in the order of the models
+    def run(self, work, models):
+
+        # the task data may have been written to the device (e.g. by TestSetCache) in the current stream- the workers'
+        # streams must wait for it before using it
+        ready = None
+
+        if self.streams is not None:
+            ready = torch.cuda.Event()
+            ready.record()
+
+        futures = [self.executor.submit(self.train, work, model, self.streams[model_num] if self.streams else None, ready)
+                   for model_num, model in enumerate(models)]
+
+        results = []
+
+        for future in futures:
+            result, done = future.result()
+
+            # anything done with the models after this (e.g. resetting and expanding them) is done in the current
+            # stream, which must wait for the worker's kernels to complete first
+            if done is not None:
+                torch.cuda.current_stream().wait_event(done)
+
+            results.append(result)
+
+        return results
+
+    def train(self, work, model, stream, ready):
+
+        if stream is None:
+            return work(model), None
+
+        with torch.cuda.stream(stream):
+            stream.wait_event(ready)
+
+            result = work(model)
+
+            done = torch.cuda.Event()
+            done.record()
+
+        return result, done
+
+    def close(self):
+
+        self.executor.shutdown(wait=True)
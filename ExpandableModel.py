@@ -1,11 +1,28 @@
 import torch.nn as nn
 import torch
+import torch.nn.functional as F
+import torch.optim as optim
 from scipy import stats
 from copy import deepcopy
+from TrainingMonitor import TrainingMonitor
+from PhaseTimer import PhaseTimer
+from TaskProfiler import TaskProfiler
+import time
 
 class ExpandableModel(nn.Module):
 
-    def __init__(self, hidden_size, input_size, output_size, device):
+    # the name used to identify the type of model in training progress output
+    log_label = 'NoReg'
+
+    # names of the attributes holding per-task state that is handed over (not copied) from a model to the larger model
+    # replacing it when the network is expanded- see transfer_from()
+    transferred_attributes = ['size_dictionary', 'task_post_training_weights', 'task_input_permutations', 'storage_dtype',
+                              'replay_buffer', 'replay_weight', 'phase_timer', 'task_profiler']
+
+    # if max_hidden_size is given, the model is built in "elastic capacity" mode: its layers are allocated at the sizes
+    # they would have with a hidden size of max_hidden_size, and only the part of each layer corresponding to
+    # hidden_size is used. The model can then be expanded (up to max_hidden_size) in place- see expand_in_place().
+    def __init__(self, hidden_size, input_size, output_size, device, max_hidden_size=None):
 
         super().__init__()
 
@@ -17,23 +34,91 @@ class ExpandableModel(nn.Module):
         # {task number : list of learnable parameter weight values after model trained on task}
         self.task_post_training_weights = {}
 
+        # dictionary, format:
+        # {task number : permutation of the input folded into the network's weights for the task (None if the task's
+        #  data is fed to the network as-is)} - see begin_task()
+        self.task_input_permutations = {}
+
+        # dtype in which per-task state (post-training weights and, in EWC models, the Fisher diagonals of each task) is
+        # stored- see set_storage_dtype()
+        self.storage_dtype = torch.float32
+
+        # ReplayBuffer to which every training batch is offered (None if the model does not rehearse previous tasks), and
+        # the weight of the rehearsal term added to the loss- see set_replay_buffer()
+        self.replay_buffer = None
+        self.replay_weight = 0
+
+        # PhaseTimer accumulating the time spent in each phase of training per task- disabled unless one is set with
+        # set_phase_timer()
+        self.phase_timer = PhaseTimer()
+
+        # TaskProfiler recording the training steps and consolidation of the tasks selected for profiling- profiles
+        # nothing unless one is set with set_task_profiler()
+        self.task_profiler = TaskProfiler()
+
         # copy specified model hyperparameters into instance variables
         self.input_size = input_size
         self.hidden_size = hidden_size
         self.output_size = output_size
+        self.max_hidden_size = max_hidden_size
 
         self.device = device
 
+        # dictionary, format:
+        # {phase or hook name: (total seconds spent in it, number of calls)} for the most recent call to train_model()
+        self.step_profile = {}
+
+        # TrainingMonitor tracking the loss during the most recent call to train_model()
+        self.training_monitor = None
+
+        # loss and penalty of the final training iteration of the most recent call to train_model()- see finish_task()
+        self.final_loss = None
+        self.final_penalty = None
+
 
     def forward(self, x):
 
         raise NotImplementedError("forward() is not implemented in ExpandableModel\n")
 
+    # the architecture (MLP or CNN) of models of this class- the subclass of ExpandableModel from which the class is
+    # derived, whichever mixins (e.g. EWCMixin) come before it in the class's bases
+    @classmethod
+    def architecture(cls):
+
+        return next(base for base in cls.__mro__ if ExpandableModel in base.__bases__)
+
     @classmethod
     def from_existing_model(cls, m, new_hidden_size):
 
         raise NotImplementedError("from_existing_model() is not implemented in ExpandableModel\n")
 
+    # stored weights of parameter (e.g. from task_post_training_weights), in the layout of the network's current weights-
+    # see MLP.align_stored_weights()
+    def align_stored_weights(self, parameter, weights):
+
+        return weights
+
+    # True if the model was built with enough spare capacity to be expanded to new_hidden_size without being rebuilt
+    def can_expand_in_place(self, new_hidden_size):
+
+        return self.max_hidden_size is not None and new_hidden_size <= self.max_hidden_size
+
+    # expand an elastic capacity model to new_hidden_size by moving the boundary of the active part of each layer-
+    # nothing is reallocated or copied, and the EWC sums (allocated at the maximum size) need no padding
+    def expand_in_place(self, new_hidden_size):
+
+        if not self.can_expand_in_place(new_hidden_size):
+            raise ValueError("cannot expand model to hidden size {} in place (maximum hidden size: {})\n".format(
+                new_hidden_size, self.max_hidden_size))
+
+        self.set_active_hidden_size(new_hidden_size)
+
+        self.hidden_size = new_hidden_size
+
+    def set_active_hidden_size(self, hidden_size):
+
+        raise NotImplementedError("set_active_hidden_size() is not implemented in ExpandableModel\n")
+
     # initialize weights in the network in the same manner as in:
     # https://github.com/ariseff/overcoming-catastrophic/blob/afea2d3c9f926d4168cc51d56f1e9a92989d7af0/model.py#L7
     @staticmethod
@@ -68,14 +153,571 @@ class ExpandableModel(nn.Module):
             if m.bias is not None:
                 m.bias.data.fill_(0.1)
 
-    # kwargs contains validation_loader for EWC training (needed for Fisher estimation post-training)
-    def train_model(self, args, train_loader, task_number, **kwargs):
+    # Training loop shared by every expandable model. Anything that differs between model types is supplied through
+    # the hook methods below, which subclasses override as needed:
+    #
+    #   begin_task()          - called before training on the task starts
+    #   prepare_batch()       - reshape a (data, target) batch for the network and move it to the model's device
+    #   penalty()             - extra loss term added to the cross entropy loss (e.g. the EWC loss on previous tasks)
+    #   rehearsal_loss()      - loss on samples of previous tasks from the replay buffer (see set_replay_buffer())
+    #   transform_gradients() - modify parameter gradients after the backward pass, before the optimizer step
+    #   consolidate()         - post-task work once training has finished (e.g. Fisher estimation for EWC)
+    #   end_task()            - called once the task has been consolidated, before its metrics are recorded
+    #   record_metrics()      - post-task bookkeeping of metrics describing the training run
+    #
+    # The loss is accumulated on the device by a TrainingMonitor rather than being read back with loss.item() during
+    # training, and training on the task stops early if the monitor detects that the loss has diverged (become NaN,
+    # infinite or greater than args.divergence_threshold for args.divergence_patience consecutive checks).
+    #
+    # The time spent in each hook (and in the forward pass, backward pass and optimizer step) is accumulated in
+    # self.step_profile. NOTE: no device synchronization is performed when timing, so on the GPU these values measure
+    # the host-side cost of each phase (kernel launches) rather than the time the kernels themselves take to run.
+    #
+    # kwargs contains validation_loader for EWC training (needed for Fisher estimation post-training), and
+    # input_permutation (see begin_task()) for all models
+    #
+    # If defer is set, the task is not consolidated and neither its metrics nor the failure of the model are recorded
+    # until finish_task() is called- see main.py --concurrent-nets
+    def train_model(self, args, train_loader, task_number, defer=False, **kwargs):
+
+        self.step_profile = {}
+
+        # Set the module in "training mode"
+        # This is necessary because some network layers behave differently when training vs testing.
+        # Dropout, for example, is used to zero/mask certain weights during TRAINING to prevent overfitting.
+        # However, during TESTING (e.g. model.eval()) we do not want this to happen.
+        self.train()
+
+        self.reinitialize_output_weights()
+
+        self.begin_task(args, task_number, **kwargs)
+
+        # Set the optimization algorithm for the model- in this case, Stochastic Gradient Descent with/without
+        # momentum (depends on the value of args.momentum- default is 0.0, so no momentum by default).
+        #
+        # NOTE on params:
+        #   model.parameters() returns an iterator over a list of the model parameters in the same order in
+        #   which they appear in the network when traversed input -> output
+        optimizer = optim.SGD(self.parameters(), lr=args.lr, momentum=args.momentum)
+
+        loss = None
+        penalty = None
+
+        self.training_monitor = TrainingMonitor(self.device, args.divergence_threshold, args.divergence_check_interval,
+                                                args.divergence_patience)
+
+        self.task_profiler.start_training()
+
+        for epoch in range(1, args.epochs + 1):
+
+            # time spent in each epoch (summed over the epochs of the task)- see set_phase_timer()
+            with self.phase_timer.span('train_epoch'):
+
+                # The (data, target) pair returned by train_loader each iteration consists of a batch of image data
+                # samples and the associated ground truth class labels for those samples.
+                for batch_idx, (data, target) in enumerate(train_loader):
+
+                    data, target = self.profile_hook('prepare_batch', self.prepare_batch, data, target)
+
+                    # the replay buffer (if any) decides which of the training samples to keep for rehearsal on later tasks
+                    if self.replay_buffer is not None:
+                        self.profile_hook('replay', self.replay_buffer.add, task_number, data, target)
+
+                    # Gradients are automatically accumulated- therefore, they need to be zeroed out before the next
+                    # backward pass through the network so that they are replaced by newly computed gradients at later
+                    # training iterations, rather than SUMMED with those future gradients.
+                    optimizer.zero_grad()
+
+                    # forward pass: compute predicted output by passing data to the network
+                    output = self.profile_hook('forward', self, data)
+
+                    # Define the training loss function for the model to be cross entropy loss based on predicted values
+                    # and ground truth labels. This loss function only takes into account loss on the most recent task.
+                    loss = F.cross_entropy(output, target)
+
+                    # any model-specific loss term (e.g. the EWC loss on previous tasks) is added to the loss that will be
+                    # minimized by the optimizer
+                    with self.phase_timer.span('penalty', synchronize=False):
+                        penalty = self.profile_hook('penalty', self.penalty, task_number)
+
+                    if penalty is not None:
+                        loss += penalty
+
+                    # cross entropy loss on a batch of samples of previous tasks from the replay buffer, if rehearsing
+                    rehearsal = self.profile_hook('rehearsal', self.rehearsal_loss, args, task_number)
+
+                    if rehearsal is not None:
+                        loss += rehearsal
+
+                    # Backward pass: compute gradient of the loss with respect to model parameters
+                    self.profile_hook('backward', loss.backward)
+
+                    self.profile_hook('transform_gradients', self.transform_gradients, task_number)
+
+                    # update all model parameters according to their gradients and the optimizer's update rule
+                    self.profile_hook('step', optimizer.step)
+
+                    self.training_monitor.step(loss, penalty)
+
+                    self.task_profiler.step()
+
+                    # Each time the batch index is a multiple of the specified progress display interval (args.log_interval),
+                    # print a message indicating progress AND which network (model) is reporting values. The loss displayed
+                    # is the mean loss over the most recent window of iterations that the monitor has received from the
+                    # device, so printing it never forces the host to wait for the device.
+                    if batch_idx % args.log_interval == 0 and self.training_monitor.latest_loss is not None:
+                        print('{} Task: {} Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}'.format(
+                                                                                        self.log_label,
+                                                                                        task_number,
+                                                                                        epoch,
+                                                                                        batch_idx * len(data),
+                                                                                        args.train_dataset_size,
+                                                                                        100. * batch_idx / len(train_loader),
+                                                                                        self.training_monitor.latest_loss
+                                                                                        ))
+
+                    if self.training_monitor.diverged:
+                        break
+
+                if self.training_monitor.diverged:
+                    break
+
+        self.task_profiler.stop_training()
+
+        self.training_monitor.finish()
+
+        self.final_loss = loss
+        self.final_penalty = penalty
+
+        # (the final window of iterations, checked by finish(), may also have diverged)
+        #
+        # The weights of a diverged network may be NaN or infinite, so the task is neither saved nor consolidated- its
+        # Fisher would otherwise be folded into the EWC sums before the run is marked as failed
+        if not self.training_monitor.diverged:
+
+            # update the model size dictionary
+            self.update_size_dict(task_number)
+
+            self.save_theta_stars(task_number)
+
+            if not defer:
+                with self.task_profiler.capture('consolidate'):
+                    self.profile_hook('consolidate', self.consolidate, args, task_number, **kwargs)
+
+            self.end_task(args, task_number, **kwargs)
+
+        if not defer:
+            self.finish_task(args, task_number, **kwargs)
+
+    # Record the outcome of the model's latest attempt at task_number: the failure of the model if training diverged,
+    # and its metrics otherwise. If training was deferred (see train_model()), the task is consolidated here first.
+    def finish_task(self, args, task_number, deferred=False, **kwargs):
+
+        if self.training_monitor.diverged:
+            print('{} Task: {} TRAINING DIVERGED AT ITERATION {}- STOPPING TRAINING ON TASK'.format(
+                self.log_label, task_number, self.training_monitor.diverged_step))
+
+            self.record_failure(args, task_number, **kwargs)
+
+            return
+
+        if deferred:
+            with self.task_profiler.capture('consolidate'):
+                self.profile_hook('consolidate', self.consolidate_unpermuted, args, task_number, **kwargs)
+
+        self.profile_hook('record_metrics', self.record_metrics, args, task_number, self.final_loss,
+                          self.final_penalty, **kwargs)
+
+    # consolidate task_number after end_task() has returned the weights to the unpermuted frame (see MLP)
+    def consolidate_unpermuted(self, args, task_number, **kwargs):
+
+        self.consolidate(args, task_number, **kwargs)
+
+    # call hook with the given arguments, adding the time it took to the total for name in self.step_profile
+    def profile_hook(self, name, hook, *args, **kwargs):
+
+        start = time.perf_counter()
+
+        result = hook(*args, **kwargs)
+
+        total, calls = self.step_profile.get(name, (0.0, 0))
+        self.step_profile.update({name: (total + time.perf_counter() - start, calls + 1)})
 
-        raise NotImplementedError("train_model() is not implemented in ExpandableModel\n")
+        return result
+
+    # If kwargs contains an input_permutation (a LongTensor p such that the task's inputs are x[p], see
+    # utils.generate_new_mnist_permutation_task()), the task is trained on unpermuted data and the permutation is
+    # folded into the model's weights instead. Only supported by models overriding this method (see MLP).
+    def begin_task(self, args, task_number, **kwargs):
+
+        if kwargs.get('input_permutation') is not None:
+            raise NotImplementedError("{} does not support permutations of the input folded into its weights\n".format(
+                self.__class__.__name__))
+
+        self.task_input_permutations.update({task_number: None})
+
+    # called once training on a task has finished, after consolidate() (unless it was deferred- see train_model()) and
+    # before record_metrics()
+    def end_task(self, args, task_number, **kwargs):
+
+        pass
+
+    # move a batch of data and its labels to the model's device - non_blocking allows the copy to overlap with
+    # computation when the DataLoader has placed the batch in pinned memory (pin_memory=True, see setup.set_gpu_options())
+    def prepare_batch(self, data, target):
+
+        return data.to(self.device, non_blocking=True), target.to(self.device, non_blocking=True)
+
+    # loss term to be added to the cross entropy loss on the current task- None if the model has no such term
+    def penalty(self, task_number):
+
+        return None
+
+    # The weighted cross entropy loss on a batch (of args.batch_size samples) drawn from the replay buffer's samples of
+    # previous tasks- None if the model does not rehearse, or there are no samples of previous tasks yet.
+    #
+    # The output layer is re-initialized for each task, so each sample is classified with the output layer saved after
+    # training on its task (as when the model is tested on the task- see restore_output_weights()) rather than the
+    # current task's. Only the shared layers are trained by the rehearsal term.
+    def rehearsal_loss(self, args, task_number):
+
+        if self.replay_buffer is None or self.replay_weight == 0:
+            return None
+
+        batch = self.replay_buffer.sample(args.batch_size, task_number)
+
+        if batch is None:
+            return None
+
+        data, target, tasks = batch
+
+        features = self.output_layer_inputs(data)
+
+        loss = 0
+
+        for task in tasks.unique().tolist():
+            in_task = (tasks == task).to(self.device)
+
+            weight, bias = self.task_output_weights(task, features.size(1))
+
+            loss = loss + F.cross_entropy(F.linear(features[in_task], weight, bias), target[in_task], reduction='sum')
+
+        return self.replay_weight * loss / len(target)
+
+    # the input to the output layer (see output_layer_name()) when data is passed through the network
+    def output_layer_inputs(self, data):
+
+        inputs = []
+
+        hook = self.get_submodule(self.output_layer_name()).register_forward_hook(
+            lambda module, module_inputs, output: inputs.append(module_inputs[0]))
+
+        try:
+            self(data)
+        finally:
+            hook.remove()
+
+        return inputs[0]
+
+    # the output layer's weights and biases saved after training on task (see save_theta_stars()), for in_features
+    # inputs to the output layer: cut to its active part, or padded with zeros for the hidden units added by an
+    # expansion since the task was trained
+    def task_output_weights(self, task, in_features):
+
+        old_weights = self.task_post_training_weights.get(task)
+
+        weight = old_weights[-2][:self.output_size, :in_features]
+        bias = old_weights[-1][:self.output_size]
+
+        weight = F.pad(weight, (0, in_features - weight.size(1)))
+
+        return weight.float(), bias.float()
+
+    # called after the backward pass and before the optimizer step of each training iteration
+    def transform_gradients(self, task_number):
+
+        pass
+
+    # called once training on a task has finished, after the post-training weights have been saved
+    def consolidate(self, args, task_number, **kwargs):
+
+        pass
+
+    # called last in finish_task() with the loss and penalty from the final training iteration on the task
+    def record_metrics(self, args, task_number, loss, penalty, **kwargs):
+
+        pass
+
+    # Called by finish_task() (instead of consolidate(), end_task() and record_metrics()) if training on the task
+    # diverged. Marks the run as failed on the task by setting kwargs['failure'][0] to task_number- main() then ends
+    # the run.
+    def record_failure(self, args, task_number, **kwargs):
+
+        failure = kwargs.get('failure')
+
+        if failure is not None:
+            failure[0] = task_number
+
+    # re-initialize the weights of the output layer before training on a new task (no-op unless overridden)
+    def reinitialize_output_weights(self):
+
+        pass
 
     def test(self, test_loaders, threshold, args):
 
-        raise NotImplementedError("test() is not implemented in ExpandableModel\n")
+        # generate a dictionary mapping tasks to models of the sizes that the network was when those tasks were
+        # trained, containing subsets of the weights currently in the model (to mask new, post-expansion weights
+        # when testing on tasks for which the weights did not exist during training)
+        models = self.generate_model_dictionary()
+
+        # the number of samples evaluated at once- independent of the batch size of the test loaders (see
+        # evaluation_batch_size())
+        batch_size = self.evaluation_batch_size(args)
+
+        return self.evaluate_model_dictionary(models, test_loaders, threshold, batch_size)
+
+    # Test each model in a dictionary generated by generate_model_dictionary() on the tasks it corresponds to. The test
+    # models hold copies of the network's weights, so this only reads the network's per-task state (and can safely run
+    # while the network itself continues training- see AsyncEvaluator).
+    @staticmethod
+    def evaluate_model_dictionary(models, test_loaders, threshold, batch_size):
+
+        test_accuracies = [0]
+
+        # Test the model on ALL tasks, including that on which the model was most recently trained
+        for task_number, test_loader in enumerate(test_loaders):
+
+            # from a dictionary formatted as {task number: model to use when testing that task number}, generated by
+            # utils.generate_model_dictionary(), fetch the model to be used when testing this task (so as to mask
+            # weights which should not be taken into consideration)
+            model = models.get(task_number + 1)
+
+            model.restore_output_weights(task_number + 1)
+
+            # the permutation (if any) folded into the network's weights when training on the task- the test data
+            # for the task is unpermuted in this case, so the weights need to be permuted in the same way to test it
+            permutation = model.task_input_permutations.get(task_number + 1)
+
+            if permutation is not None:
+                model.permute_input_weights(torch.argsort(permutation))
+
+            # Set the module in "evaluation mode"
+            # This is necessary because some network layers behave differently when training vs testing.
+            # Dropout, for example, is used to zero/mask certain weights during TRAINING (e.g. model.train())
+            # to prevent overfitting. However, during TESTING/EVALUATION we do not want this to happen.
+            model.eval()
+
+            # total testing loss over all test batches for the given task_number's entire testset (sum)
+            test_loss = 0
+
+            # total number of correct predictions over the given task_number's entire testset (sum)
+            correct = 0
+
+            # total number of samples in the given task_number's entire testset- counted rather than computed from
+            # the number of batches, as the final batch may be smaller than the others
+            test_samples = 0
+
+            # Wrap in torch.no_grad() because weights have requires_grad=True (meaning pyTorch autograd knows to
+            # automatically track history of computed gradients for those weights) but we don't need to track testing
+            # in autograd - we are no longer training so gradients should no longer be altered/computed (only "used")
+            # and therefore we don't need to track this.
+            with torch.no_grad():
+
+                # Each step of the iterator below will return the following values:
+                #
+                # data: a tensor of dimensions (evaluation batch size, <dimensions of a single sample>), representing
+                # the data for each of the samples in a given evaluation batch
+                #
+                # target: a 1D tensor of dimension <evaluation batch size> containing ground truth labels for each of
+                # the samples in the corresponding evaluation batch in order
+                for data, target in ExpandableModel.evaluation_batches(test_loader, batch_size):
+
+                    # reshape the data for the network (if needed) and move it, along with the labels, to the device
+                    data, target = model.prepare_batch(data, target)
+
+                    test_samples += len(target)
+
+                    # Forward pass: compute predicted output by passing data to the model. Module objects
+                    # override the __call__ operator so you can call them like functions. When
+                    # doing so you pass a Tensor of input data to the Module and it produces
+                    # a Tensor of output data. We have overriden forward() above, so our forward() method will be called here.
+                    output = model(data)
+
+                    # Define the testing loss to be cross entropy loss based on predicted values (output)
+                    # and ground truth labels (target), calculate the testing batch loss, and sum it with the total testing
+                    # loss over all batches in the given task_number's entire testset (contained within test_loss).
+                    #
+                    # NOTE: size_average = False:
+                    # By default, the losses are averaged over observations for each minibatch.
+                    # If size_average is False, the losses are summed for each minibatch. Default: True
+                    #
+                    # Here we use size_average = False because we want to SUM all testing batch losses and average those
+                    # at the end of testing on the current task (by dividing by total number of testing SAMPLES (not batches) to obtain an
+                    # average loss over all testing batches). Otherwise, if size_average == True, we would be getting average
+                    # loss for each testing batch and then would average those at the end of testing on the current task
+                    # to obtain average testing loss, which could theoretically result in some comparative loss of accuracy
+                    # in the calculation of the final testing loss value for this task.
+                    #
+                    # NOTE:
+                    # <some loss function>.item() gets the a scalar value held in the loss
+                    criterion = nn.CrossEntropyLoss(size_average=False)
+                    test_loss += criterion(output, target).item()
+
+                    # Get the index of the max log-probability for each of the samples in the testing batch.
+                    #
+                    # output is a 2D tensor of dimensions (test batch size, 10) containing network-predicted probabilities
+                    # that the testing input is an image of each class (digits 0-9, signified by the index of each probability
+                    # in the output tensor for a given test image). That is to say that in the second dimension of output
+                    # the classification probabilities might look like the following for a given image:
+                    #       [0.1, 0.1, 0.05, 0.05, 0.2, 0.4, 0.1, 0.0, 0.0, 0.0]
+                    # Because the sixth entry (index 5) contains the maximum value relative to all other indices, the network's
+                    # prediction is that this image belongs to the sixth class- and is therefore the digit 5.
+                    #
+                    # NOTE: torch.max() Returns the maximum value of EACH ROW of the input tensor in the given dimension dim.
+                    # The second return value is the index location of each maximum value found (argmax). This is why we use
+                    # the second return value as the value of the variable pred, because we want the index of the maximum
+                    # probability (not its value)- hence the [1] indexing at the end of the statement.
+                    #
+                    # ARGUMENTS:
+                    #
+                    # Using dimension 1 as the first argument allows us to get the index of the highest valued
+                    # column in each row of output, which practically translates to getting the maximum predicted class
+                    # probability for each sample.
+                    #
+                    # If keepdim is True, the output tensors are of the same size as input except in the dimension dim
+                    # (first argument- in this case 1) where they are of size 1 (because we calculated ONE maximum value per
+                    # row). Otherwise, dim is squeezed (see torch.squeeze()), resulting in the output tensors having 1
+                    # fewer dimension than input.
+                    pred = output.max(1, keepdim=True)[1]
+
+                    # Check if predictions are correct, and if so add one to the total number of correct predictions across the
+                    # entire testing set for each correct prediction.
+                    #
+                    # A prediction is correct if the index of the highest value in the
+                    # prediction output is the same as the index of the highest value in the label for that sample.
+                    #
+                    # For example (MNIST):
+                    #   prediction: [0.1, 0.1, 0.05, 0.05, 0.2, 0.4, 0.1, 0.0, 0.0, 0.0]
+                    #   label:      [0, 0, 0, 0, 0, 1, 0, 0, 0, 0]
+                    #
+                    #   This would be a correct prediction- the sixth entry (index 5) in each array holds the highest
+                    #   value
+                    #
+                    # In this case, the targets/labels are stored as scalar index values (e.g. torch.Tensor([1, 4, 5])
+                    # for labels for a one, a four, and a five (in that order)
+                    #
+                    # tensor_X.view_as(other) returns a resulting version of tensor_X with the same size as other.size()
+                    #
+                    # torch.eq() -> element wise equality:
+                    # tensor_X.eq(tensor_Y) returns a tensor of the same size as tensor_X with 0's at every index for which
+                    # the entry at that index in tensor_X does not match the entry at that index in tensor_Y and 1's at every
+                    # index for which tensor_X and tensor_Y contain matching values
+                    #
+                    # .sum() sums every row of the tensor into a tensor holding a single value
+                    #
+                    # .item() gets the scalar value held in the sum tensor
+                    correct += pred.eq(target.view_as(pred)).sum().item()
+
+            # Divide the accumulated test loss across all testing batches for the current task_number by the total number
+            # of testing samples in the task_number's testset (e.g. 10,000 for mnist) to get the average loss for the
+            # entire test set for task_number.
+            test_loss /= test_samples
+
+            # The overall accuracy of the model's predictions on the task indicated by task_number as a percent
+            # value is the count of its accurate predictions divided by the number of predictions it made, all multiplied by 100
+
+            accuracy = 100. * correct / test_samples
+
+            # the same test model may be used for several tasks, so undo the permutation before testing the next one
+            if permutation is not None:
+                model.permute_input_weights(permutation)
+
+            test_accuracies.append(accuracy)
+
+            # For task_number's complete test set (all batches), display the average loss and accuracy
+            print('\nTest set {}: Average loss: {:.4f}, Accuracy: {}/{} ({:.0f}%)\n'.format(
+                task_number + 1, test_loss, correct, test_samples,
+                accuracy))
+
+        if test_accuracies[len(test_accuracies) - 1] < threshold:
+            return -1 # accuracy minimum threshold not met on most recent task
+
+        else:
+            return test_accuracies # accuracy minimum threshold met
+
+    # The number of test samples to evaluate at once. If args.eval_batch_size is 0, this is chosen automatically as the
+    # largest batch size for which the input and the outputs of every layer of the network (the largest model being
+    # tested) fit within args.eval_memory_ceiling MB. This is an overestimate of the memory actually needed, as
+    # under torch.no_grad() the output of a layer is freed once the next layer has used it.
+    def evaluation_batch_size(self, args):
+
+        if args.eval_batch_size > 0:
+            return args.eval_batch_size
+
+        output_sizes = []
+
+        def record_output_size(module, input, output):
+            output_sizes.append(output.numel())
+
+        hooks = [module.register_forward_hook(record_output_size)
+                 for module in self.modules() if len(list(module.children())) == 0]
+
+        sample = torch.zeros((1,) + tuple(self.evaluation_input_shape()), device=self.device)
+
+        was_training = self.training
+
+        self.eval()
+
+        with torch.no_grad():
+            self(sample)
+
+        self.train(was_training)
+
+        for hook in hooks:
+            hook.remove()
+
+        bytes_per_sample = (sample.numel() + sum(output_sizes)) * sample.element_size()
+
+        return max(1, (args.eval_memory_ceiling * 2**20) // bytes_per_sample)
+
+    # shape of a single sample of input to the network, as passed to forward()
+    def evaluation_input_shape(self):
+
+        raise NotImplementedError("evaluation_input_shape() is not implemented in ExpandableModel\n")
+
+    # Iterate over the (data, target) batches of test_loader (a DataLoader, a list of prebatched samples or a cached
+    # test set- see TestSetCache) in batches of batch_size samples, regardless of the size of the batches it provides.
+    # Only the final batch may be smaller than batch_size.
+    @staticmethod
+    def evaluation_batches(test_loader, batch_size):
+
+        data_batches = []
+        target_batches = []
+        buffered = 0
+
+        for data, target in test_loader:
+
+            # batches of exactly the right size are passed through without copying them
+            if buffered == 0 and len(target) == batch_size:
+                yield data, target
+                continue
+
+            data_batches.append(data)
+            target_batches.append(target)
+            buffered += len(target)
+
+            if buffered >= batch_size:
+                data, target = torch.cat(data_batches), torch.cat(target_batches)
+
+                while len(target) >= batch_size:
+                    yield data[:batch_size], target[:batch_size]
+
+                    data, target = data[batch_size:], target[batch_size:]
+
+                data_batches, target_batches, buffered = [data], [target], len(target)
+
+        if buffered > 0:
+            yield torch.cat(data_batches), torch.cat(target_batches)
 
     def update_size_dict(self, task_count):
 
@@ -83,15 +725,31 @@ class ExpandableModel(nn.Module):
 
     def copy_weights_expanding(self, small_model):
 
-        old_weights = []
+        # copy each parameter of the smaller model directly into the matching (upper-left) region of the corresponding
+        # parameter of this model
+        for parameter, old_parameter in zip(self.parameters(), small_model.parameters()):
+            parameter.data[tuple(slice(0, n) for n in old_parameter.shape)] = old_parameter.data
 
-        for parameter in small_model.parameters():
-            old_weights.append(parameter.data.clone())
-            parameter.requires_grad = False
-            parameter.detach()
+    # Take over the per-task state (see transferred_attributes) and weights of model m, which this model is replacing
+    # after an expansion. The task dictionaries and EWC sums are moved rather than copied, and m's parameters are
+    # released as soon as their values have been copied, so expansion never holds two copies of the stored snapshots.
+    #
+    # NOTE: m is unusable after this is called
+    def transfer_from(self, m):
 
-        for param_index, parameter in enumerate(self.parameters()):
-            parameter.data[tuple(slice(0, n) for n in old_weights[param_index].shape)] = old_weights[param_index][...]
+        for attribute in self.transferred_attributes:
+            setattr(self, attribute, getattr(m, attribute))
+            setattr(m, attribute, None)
+
+        self.copy_weights_expanding(m)
+
+        m.release_parameters()
+
+    # free the memory held by the model's parameters (used on models that have been replaced by expanded models)
+    def release_parameters(self):
+
+        for parameter in self.parameters():
+            parameter.data = torch.empty(0, device=parameter.device)
 
     def reset(self, task_count):
         old_weights = self.task_post_training_weights.get(task_count)
@@ -99,6 +757,35 @@ class ExpandableModel(nn.Module):
         for param_index, parameter in enumerate(self.parameters()):
             parameter.data[tuple(slice(0, n) for n in old_weights[param_index].shape)] = old_weights[param_index][...]
 
+    # Store per-task state in the given dtype (e.g. torch.bfloat16 to halve the memory it takes). Only storage is
+    # affected- computations using the stored values are carried out in float32, and the results rounded to dtype
+    # when they are stored.
+    def set_storage_dtype(self, dtype):
+
+        self.storage_dtype = dtype
+
+        for task, weights in self.task_post_training_weights.items():
+            self.task_post_training_weights.update({task: [weight.to(dtype) for weight in weights]})
+
+    # Offer every training batch to replay_buffer (a ReplayBuffer), and add weight times the cross entropy loss on a
+    # batch of its samples of previous tasks to the training loss (0 to keep samples without rehearsing them- e.g. for
+    # GEM, which uses them to constrain its gradients instead)
+    def set_replay_buffer(self, replay_buffer, weight=0):
+
+        self.replay_buffer = replay_buffer
+        self.replay_weight = weight
+
+    # Time the phases of training (each epoch, the penalty, and any model-specific phases such as Fisher estimation)
+    # with phase_timer (a PhaseTimer), under the task it is set to
+    def set_phase_timer(self, phase_timer):
+
+        self.phase_timer = phase_timer
+
+    # Profile the tasks selected by task_profiler (a TaskProfiler- see TaskProfiler.begin())
+    def set_task_profiler(self, task_profiler):
+
+        self.task_profiler = task_profiler
+
     def save_theta_stars(self, task_count):
         # save the theta* ("theta star") values after training - for plotting and comparative loss calculations
         # using the method in model.alternative_ewc_loss()
@@ -108,10 +795,11 @@ class ExpandableModel(nn.Module):
         #   https://arxiv.org/pdf/1612.00796.pdf#section.2
         current_weights = []
 
+        # a single copy of each parameter's values (in the storage dtype) is all that's needed for the snapshot
         for parameter in self.parameters():
-            current_weights.append(deepcopy(parameter.data.clone()))
+            current_weights.append(parameter.data.to(self.storage_dtype, copy=True))
 
-        self.task_post_training_weights.update({task_count: deepcopy(current_weights)})
+        self.task_post_training_weights.update({task_count: current_weights})
 
     # given a dictionary with task numbers as keys and model sizes (size of hidden layer(s) in the model when the model was
     # trained on a given task) as values, generate and return a dictionary correlating task numbers with model.Model
@@ -130,17 +818,18 @@ class ExpandableModel(nn.Module):
         # make a model of each size specified in model_sizes, add them to models list
         for hidden_size in model_sizes:
 
-            # make a model of the type corresponding to the model's direct superclass (CNN or MLP) for testing-
+            # make a model of the type corresponding to the model's architecture (CNN or MLP) for testing-
             # this way we don't need to pass lambda to the constructor, as it's not needed for testing
-            test_model = self.__class__.__bases__[0](
+            test_model = self.architecture()(
                 hidden_size,
                 self.input_size,
                 self.output_size,
                 self.device
             ).to(self.device)
 
-            # needed for restoration of output layer weights during testing
+            # needed for restoration of output layer weights (and permutation of input weights) during testing
             test_model.task_post_training_weights = self.task_post_training_weights
+            test_model.task_input_permutations = self.task_input_permutations
             models.append(test_model)
 
 
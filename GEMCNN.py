@@ -0,0 +1,7 @@
+from CNN import CNN
+from GEMMixin import GEMMixin
+
+
+class GEMCNN(GEMMixin, CNN):
+
+    pass
@@ -0,0 +1,7 @@
+from MLP import MLP
+from GEMMixin import GEMMixin
+
+
+class GEMMLP(GEMMixin, MLP):
+
+    pass
@@ -0,0 +1,64 @@
+import GEMModel
+
+"""
+The GEM (https://arxiv.org/abs/1706.08840) training hooks shared by GEMMLP and GEMCNN (the GEM step itself is
+implemented in GEMModel). As with EWCMixin, the mixin comes before the architecture in their bases, e.g.
+
+    class GEMMLP(GEMMixin, MLP):
+
+so that its hooks override the defaults in ExpandableModel.
+"""
+class GEMMixin:
+
+    log_label = 'GEM'
+
+    def __init__(self, hidden_size, input_size, output_size, device, memory_strength=0.5, gem_mode='gem',
+                 refresh_interval=1, n_memories=256, max_hidden_size=None):
+
+        # (the architecture, MLP or CNN, follows this class in the method resolution order of GEMMLP and GEMCNN)
+        super().__init__(hidden_size, input_size, output_size, device, max_hidden_size)
+
+        # margin of the GEM dual QP
+        self.memory_strength = memory_strength
+
+        # 'gem' or 'agem'- see GEMModel
+        self.gem_mode = gem_mode
+
+        # number of training steps for which the gradients on previous tasks' samples are reused before being
+        # recomputed
+        self.refresh_interval = max(1, refresh_interval)
+
+        # number of samples of each previous task in the replay buffer on which its gradient is computed
+        self.n_memories = n_memories
+
+        # the parameters' gradients are views of a single flat buffer (see GEMModel.flatten_grads())
+        GEMModel.init_grad_buffers(self)
+
+    @classmethod
+    def from_existing_model(cls, m, new_hidden_size):
+
+        model = cls(new_hidden_size, m.input_size, m.output_size, m.device, m.memory_strength, m.gem_mode,
+                    m.refresh_interval, m.n_memories).to(m.device)
+
+        # take over the task dictionaries and replay buffer of m without copying them
+        model.transfer_from(m)
+
+        return model
+
+    def begin_task(self, args, task_number, **kwargs):
+
+        super().begin_task(args, task_number, **kwargs)
+
+        GEMModel.begin_gem_task(self)
+
+    # GEM adds no loss term- the gradients on the samples of previous tasks in the replay buffer (see
+    # set_replay_buffer()) are computed (if needed) before the backward pass on the current batch
+    def penalty(self, task_number):
+
+        GEMModel.before_backward(self, task_number)
+
+        return None
+
+    def transform_gradients(self, task_number):
+
+        GEMModel.project_gradient(self)
@@ -5,211 +5,267 @@
 # LICENSE file in the root directory of this source tree.
 
 import torch
-import torch.nn as nn
-import torch.optim as optim
-from torch.autograd import Variable
+import torch.nn.functional as F
 
-import numpy as np
-import quadprog
+# Gradient Episodic Memory (GEM, https://arxiv.org/abs/1706.08840) for the
+# expandable models (see GEMMixin): the functions at the bottom of
+# this file implement the GEM training step on a model through the hooks of
+# ExpandableModel.train_model().
 
 # Auxiliary functions useful for GEM's inner optimization.
 
-def compute_offsets(task, nc_per_task, is_cifar):
+def grad_offsets(grad_dims):
     """
-        Compute offsets for cifar to determine which
-        outputs to select for a given task.
+        Computes the offset of each parameter's gradient in a flat
+        gradient buffer.
+        grad_dims: list with number of parameters per layers
+        output: list of (begin, end) offsets, one per parameter
     """
-    if is_cifar:
-        offset1 = task * nc_per_task
-        offset2 = (task + 1) * nc_per_task
-    else:
-        offset1 = 0
-        offset2 = nc_per_task
-    return offset1, offset2
+    offsets = []
+    beg = 0
+    for dim in grad_dims:
+        offsets.append((beg, beg + dim))
+        beg += dim
+    return offsets
 
 
-def store_grad(pp, grads, grad_dims, tid):
+def flatten_grads(pp, flat_grad, offsets):
     """
-        This stores parameter gradients of past tasks.
+        Makes the gradient of each parameter a view of its slice of the
+        flat buffer "flat_grad", so that backward() accumulates gradients
+        directly into the buffer. The buffer then holds the whole gradient
+        of the network as a single vector, without any copies.
         pp: parameters
-        grads: gradients
-        grad_dims: list with number of parameters per layers
+        flat_grad: gradient buffer, sum(grad_dims)-vector
+        offsets: (begin, end) offset of each parameter (see grad_offsets)
+    """
+    for param, (beg, en) in zip(pp(), offsets):
+        param.grad = flat_grad[beg: en].view(param.data.size())
+
+
+def store_grad(flat_grad, grads, tid):
+    """
+        This stores parameter gradients of past tasks.
+        flat_grad: gradient buffer holding the parameters' gradients
+        grads: gradients, one row per task
         tid: task id
     """
-    # store the gradients
-    grads[:, tid].fill_(0.0)
-    cnt = 0
-    for param in pp():
-        if param.grad is not None:
-            beg = 0 if cnt == 0 else sum(grad_dims[:cnt])
-            en = sum(grad_dims[:cnt + 1])
-            grads[beg: en, tid].copy_(param.grad.data.view(-1))
-        cnt += 1
+    grads[tid].copy_(flat_grad)
 
 
-def overwrite_grad(pp, newgrad, grad_dims):
+def solve_dual_qp(P, q, margin, v=None, iterations=200):
     """
-        This is used to overwrite the gradients with a new gradient
-        vector, whenever violations occur.
-        pp: parameters
-        newgrad: corrected gradient
-        grad_dims: list storing number of parameters at each layer
+        Solves the box-constrained QP
+            min_v 0.5 * v^T P v + q^T v   subject to v >= margin
+        with accelerated projected gradient descent (FISTA), on the device
+        and in the dtype of P. The constraints only bound each entry of v
+        from below, so the projection is a clamp.
+        A fixed number of iterations is run, so that solving the QP never
+        synchronizes with the device (on the GEM problems of the tests, the
+        solution is reached within 50).
+        input:  P, (t * t) positive semi-definite matrix
+        input:  q, t-vector
+        input:  v, t-vector to start from (e.g. the solution of the
+                previous step), or None to start at the bound
+        output: v, t-vector
     """
-    cnt = 0
-    for param in pp():
-        if param.grad is not None:
-            beg = 0 if cnt == 0 else sum(grad_dims[:cnt])
-            en = sum(grad_dims[:cnt + 1])
-            this_grad = newgrad[beg: en].contiguous().view(
-                param.grad.data.size())
-            param.grad.data.copy_(this_grad)
-        cnt += 1
+    t = P.size(0)
+    if v is None or v.numel() != t:
+        v = torch.zeros(t, dtype=P.dtype, device=P.device) + margin
+    v = v.to(device=P.device, dtype=P.dtype).clamp(min=margin)
 
+    # 1 / L, for L the largest row sum of |P|- an upper bound on the largest
+    # eigenvalue of P, which can be found without an eigendecomposition (if
+    # P is 0, so is q, and v stays where it is)
+    step = 1.0 / torch.clamp(P.abs().sum(1).max(), min=1e-12)
 
-def project2cone2(gradient, memories, margin=0.5):
+    y = v
+    momentum = 1.0
+    for iteration in range(iterations):
+        v_next = torch.clamp(y - step * (torch.mv(P, y) + q), min=margin)
+        momentum_next = (1.0 + (1.0 + 4.0 * momentum * momentum) ** 0.5) / 2.0
+        y = v_next + ((momentum - 1.0) / momentum_next) * (v_next - v)
+        v, momentum = v_next, momentum_next
+    return v
+
+
+def project2cone2(gradient, memories, margin=0.5, dual=None):
     """
         Solves the GEM dual QP described in the paper given a proposed
         gradient "gradient", and a memory of task gradients "memories".
         Overwrites "gradient" with the final projected update.
+        The QP is solved on the device of "memories" (see solve_dual_qp),
+        warm-started from "dual", the solution of a previous call.
         input:  gradient, p-vector
-        input:  memories, (t * p)-vector
-        output: x, p-vector
-    """
-    memories_np = memories.cpu().t().double().numpy()
-    gradient_np = gradient.cpu().contiguous().view(-1).double().numpy()
-    t = memories_np.shape[0]
-    P = np.dot(memories_np, memories_np.transpose())
-    P = 0.5 * (P + P.transpose())
-    q = np.dot(memories_np, gradient_np) * -1
-    G = np.eye(t)
-    h = np.zeros(t) + margin
-    v = quadprog.solve_qp(P, q, G, h)[0]
-    x = np.dot(v, memories_np) + gradient_np
-    gradient.copy_(torch.Tensor(x).view(-1, 1))
-
-
-class Net(nn.Module):
-    def __init__(self,
-                 n_inputs,
-                 n_outputs,
-                 n_tasks,
-                 args):
-        super(Net, self).__init__()
-        nl, nh = args.n_layers, args.n_hiddens
-        self.margin = args.memory_strength
-
-        self.is_cifar = (args.data_file == 'cifar100.pt')
-
-        #if self.is_cifar:
-            #self.net = ResNet18(n_outputs)
-        #else:
-            #self.net = MLP([n_inputs] + [nh] * nl + [n_outputs])
-
-        # TODO define self.net
-
-        self.ce = nn.CrossEntropyLoss()
-        self.n_outputs = n_outputs
-
-        self.opt = optim.SGD(self.parameters(), args.lr)
-
-        self.n_memories = args.n_memories
-        self.gpu = args.cuda
-
-        # allocate episodic memory
-        self.memory_data = torch.FloatTensor(
-            n_tasks, self.n_memories, n_inputs)
-        self.memory_labs = torch.LongTensor(n_tasks, self.n_memories)
-        if args.cuda:
-            self.memory_data = self.memory_data.cuda()
-            self.memory_labs = self.memory_labs.cuda()
-
-        # allocate temporary synaptic memory
-        self.grad_dims = []
-        for param in self.parameters():
-            self.grad_dims.append(param.data.numel())
-        self.grads = torch.Tensor(sum(self.grad_dims), n_tasks)
-        if args.cuda:
-            self.grads = self.grads.cuda()
-
-        # allocate counters
-        self.observed_tasks = []
-        self.old_task = -1
-        self.mem_cnt = 0
-        if self.is_cifar:
-            self.nc_per_task = int(n_outputs / n_tasks)
-        else:
-            self.nc_per_task = n_outputs
-
-    def forward(self, x, t):
-        output = self.net(x)
-        if self.is_cifar:
-            # make sure we predict classes within the current task
-            offset1 = int(t * self.nc_per_task)
-            offset2 = int((t + 1) * self.nc_per_task)
-            if offset1 > 0:
-                output[:, :offset1].data.fill_(-10e10)
-            if offset2 < self.n_outputs:
-                output[:, offset2:self.n_outputs].data.fill_(-10e10)
-        return output
-
-    def observe(self, x, t, y):
-        # update memory
-        if t != self.old_task:
-            self.observed_tasks.append(t)
-            self.old_task = t
-
-        # Update ring buffer storing examples from current task
-        bsz = y.data.size(0)
-        endcnt = min(self.mem_cnt + bsz, self.n_memories)
-        effbsz = endcnt - self.mem_cnt
-        self.memory_data[t, self.mem_cnt: endcnt].copy_(
-            x.data[: effbsz])
-        if bsz == 1:
-            self.memory_labs[t, self.mem_cnt] = y.data[0]
-        else:
-            self.memory_labs[t, self.mem_cnt: endcnt].copy_(
-                y.data[: effbsz])
-        self.mem_cnt += effbsz
-        if self.mem_cnt == self.n_memories:
-            self.mem_cnt = 0
-
-        # compute gradient on previous tasks
-        if len(self.observed_tasks) > 1:
-            for tt in range(len(self.observed_tasks) - 1):
-                self.zero_grad()
-                # fwd/bwd on the examples in the memory
-                past_task = self.observed_tasks[tt]
-
-                offset1, offset2 = compute_offsets(past_task, self.nc_per_task,
-                                                   self.is_cifar)
-                ptloss = self.ce(
-                    self.forward(
-                        Variable(self.memory_data[past_task]),
-                        past_task)[:, offset1: offset2],
-                    Variable(self.memory_labs[past_task] - offset1))
-                ptloss.backward()
-                store_grad(self.parameters, self.grads, self.grad_dims,
-                           past_task)
-
-        # now compute the grad on the current minibatch
-        self.zero_grad()
-
-        offset1, offset2 = compute_offsets(t, self.nc_per_task, self.is_cifar)
-        loss = self.ce(self.forward(x, t)[:, offset1: offset2], y - offset1)
-        loss.backward()
-
-        # check if gradient violates constraints
-        if len(self.observed_tasks) > 1:
-            # copy gradient
-            store_grad(self.parameters, self.grads, self.grad_dims, t)
-            indx = torch.cuda.LongTensor(self.observed_tasks[:-1]) if self.gpu \
-                else torch.LongTensor(self.observed_tasks[:-1])
-            dotp = torch.mm(self.grads[:, t].unsqueeze(0),
-                            self.grads.index_select(1, indx))
-            if (dotp < 0).sum() != 0:
-                project2cone2(self.grads[:, t].unsqueeze(1),
-                              self.grads.index_select(1, indx), self.margin)
-                # copy gradients back
-                overwrite_grad(self.parameters, self.grads[:, t],
-                               self.grad_dims)
-self.opt.step()
\ No newline at end of file
+        input:  memories, (p * t)-matrix
+        input:  dual, t-vector or None
+        output: v, t-vector (the dual solution, to warm-start the next call)
+    """
+    memories_t = memories.t()
+    gradient_vec = gradient.contiguous().view(-1)
+    P = torch.mm(memories_t, memories)
+    P = 0.5 * (P + P.t())
+    q = torch.mv(memories_t, gradient_vec)
+    v = solve_dual_qp(P, q, margin, dual)
+    x = torch.mv(memories, v) + gradient_vec
+    gradient.copy_(x.view(-1, 1))
+    return v
+
+
+# GEM training step, on a model with the following attributes (see GEMMixin):
+#   replay_buffer       - ReplayBuffer holding samples from each task
+#   gem_mode            - 'gem': one constraint per past task, projected with
+#                         the dual QP; 'agem': a single constraint, the
+#                         gradient on the memories of all past tasks together
+#                         (A-GEM, https://arxiv.org/abs/1812.00420), projected
+#                         in closed form
+#   memory_strength     - margin of the dual QP
+#   refresh_interval    - number of steps for which past-task gradients are
+#                         reused before being recomputed
+#   n_memories          - number of samples of each past task (drawn at random
+#                         from those in the replay buffer) on which the
+#                         past-task gradients are computed
+
+def init_grad_buffers(model):
+    """
+        Allocates the flat gradient buffer of the model (see flatten_grads),
+        the buffers holding past-task gradients and the GEM step counters.
+    """
+    model.grad_dims = [param.data.numel() for param in model.parameters()]
+    model.grad_offsets = grad_offsets(model.grad_dims)
+    model.flat_grad = torch.zeros(sum(model.grad_dims), device=model.device)
+
+    # 'gem': one row per past task, allocated once the number of past tasks
+    # is known; 'agem': the reference gradient
+    model.task_grads = None
+    model.ref_grad = torch.zeros(sum(model.grad_dims), device=model.device)
+
+    begin_gem_task(model)
+
+
+def begin_gem_task(model):
+    """
+        Resets the GEM step state before training on a task (or retraining
+        it after an expansion), so that the past-task gradients are
+        recomputed at the first step.
+    """
+    # steps since the past-task gradients were computed, and the number of
+    # past tasks they were computed for (0 if there are none)
+    model.steps_since_refresh = 0
+    model.refreshed_tasks = 0
+
+    # dual solution of the last gradient projection (warm start)
+    model.dual = None
+
+
+def compute_past_task_grads(model, past_tasks):
+    """
+        Computes the gradients of the loss on the memories of the past
+        tasks, from a single forward pass over all of the memories. The
+        memories of each task are a fresh random subset of n_memories of
+        its samples in the replay buffer- however many samples the buffer
+        holds, the cost of the pass is bounded by the number of past tasks.
+        'gem': one gradient per past task, stored in model.task_grads (one
+               backward pass per task through the shared graph)
+        'agem': the gradient of the mean loss over the memories of all past
+                tasks, stored in model.ref_grad (one backward pass)
+        The output layer is re-initialized for each task, so the memories
+        of each past task are classified with the output layer saved after
+        training on it (as when the model is tested on the task- see
+        restore_output_weights()) rather than the current task's, applied
+        to the input of the current output layer. The current output
+        layer's weights and biases (the model's last two parameters) take
+        no part, and the components of these gradients for them are zero-
+        only the shared layers are constrained.
+    """
+    samples = [model.replay_buffer.samples(task, model.n_memories)
+               for task in past_tasks]
+
+    # the input to the output layer, for every memory
+    features = model.output_layer_inputs(
+        torch.cat([data for data, target in samples]))
+
+    ptlosses = []
+    beg = 0
+    for task, (data, target) in zip(past_tasks, samples):
+        weight, bias = model.task_output_weights(task, features.size(1))
+        output = F.linear(features[beg: beg + len(target)], weight, bias)
+        ptlosses.append(F.cross_entropy(output, target))
+        beg += len(target)
+
+    shared = model.grad_offsets[-2][0]
+
+    if model.gem_mode == 'agem':
+        model.flat_grad.zero_()
+        (sum(ptlosses) / len(ptlosses)).backward()
+        model.ref_grad.copy_(model.flat_grad)
+        model.ref_grad[shared:].zero_()
+        return
+
+    if model.task_grads is None or len(model.task_grads) != len(past_tasks):
+        model.task_grads = torch.zeros(len(past_tasks), sum(model.grad_dims),
+                                       device=model.device)
+
+    for tt in range(len(past_tasks)):
+        model.flat_grad.zero_()
+        ptlosses[tt].backward(retain_graph=tt < len(past_tasks) - 1)
+        store_grad(model.flat_grad, model.task_grads, tt)
+
+    model.task_grads[:, shared:].zero_()
+
+
+def before_backward(model, task_number):
+    """
+        Called before the backward pass of each training step on task
+        task_number: recomputes the past-task gradients if they are stale
+        (refresh_interval steps old, or computed before a task was added to
+        the past tasks), and leaves the model's parameter gradients as zeroed
+        views of its flat buffer, for the current batch's gradient.
+    """
+    # the gradients are re-attached to the buffer at every step, as moving
+    # the model to a device or an optimizer's zero_grad(set_to_none=True)
+    # replaces them
+    flatten_grads(model.parameters, model.flat_grad, model.grad_offsets)
+
+    past_tasks = [task for task in model.replay_buffer.tasks()
+                  if task < task_number]
+    if past_tasks and (len(past_tasks) != model.refreshed_tasks or
+                       model.steps_since_refresh >= model.refresh_interval):
+        compute_past_task_grads(model, past_tasks)
+        model.steps_since_refresh = 0
+        model.refreshed_tasks = len(past_tasks)
+    model.steps_since_refresh += 1
+
+    model.flat_grad.zero_()
+
+
+def project_gradient(model):
+    """
+        Called after the backward pass of each training step: projects the
+        gradient of the current batch (in the flat buffer, so directly in
+        the parameters' gradients) so that it does not increase the loss on
+        the past tasks.
+    """
+    if model.refreshed_tasks == 0:
+        return
+
+    if model.gem_mode == 'agem':
+        # g - min(g.g_ref, 0) / (g_ref.g_ref) * g_ref, computed without
+        # synchronizing with the device
+        dotp = torch.dot(model.flat_grad, model.ref_grad)
+        model.flat_grad.sub_(
+            torch.clamp(dotp, max=0) /
+            torch.clamp(torch.dot(model.ref_grad, model.ref_grad), min=1e-12)
+            * model.ref_grad)
+        return
+
+    # the projection is always computed, and only applied if the gradient
+    # increases the loss on a past task, without synchronizing with the
+    # device to decide (the dual solution is kept either way, as the warm
+    # start of the next step)
+    dotp = torch.mv(model.task_grads, model.flat_grad)
+    projected = model.flat_grad.view(-1, 1).clone()
+    model.dual = project2cone2(projected, model.task_grads.t(),
+                               model.memory_strength, model.dual)
+    model.flat_grad.copy_(torch.where((dotp < 0).any(), projected.view(-1),
+                                      model.flat_grad))
@@ -0,0 +1,104 @@
+import time
+import torch
+
+"""
+Accumulates the time spent in each phase of a run (data generation, training epochs, Fisher estimation, testing, ...)
+per task, for the results file (see setup.setup_phase_time_datasets()).
+
+Phases are timed with context manager spans:
+
+    with timer.span('test'):
+        ...
+
+and the time of every span of a phase during a task (including any attempts at the task before an expansion) is summed
+under the task set by set_task().
+
+When the timer is disabled, span() returns a shared span that does nothing, so spans can be left in hot paths (e.g.
+around the penalty of every training step) at the cost of a method call.
+
+On the GPU, the device is synchronized at the start and end of each span (unless the span is created with
+synchronize=False), so that the time of a phase includes the kernels it launched rather than just the time taken to
+launch them. Per-step spans are not synchronized, as this would stall the training pipeline- on the GPU they measure
+host-side time only.
+"""
+class PhaseTimer:
+
+    # the phases recorded in the results files: data generation for each task, each training epoch, the penalty term of
+    # each training step, Fisher estimation, updating the EWC sums, testing, and resetting and expanding the networks
+    # when a task is failed
+    phases = ['data', 'train_epoch', 'penalty', 'estimate_fisher', 'update_ewc_sums', 'test', 'reset', 'expand']
+
+    def __init__(self, enabled=False, device=None):
+
+        self.enabled = enabled
+
+        self.synchronize = enabled and device is not None and device.type == 'cuda'
+
+        # the task whose phases are currently being timed
+        self.task = 0
+
+        # dictionary, format:
+        # {task number : {phase name : total seconds spent in the phase during the task}}
+        self.totals = {}
+
+        self.null_span = NullSpan()
+
+    def set_task(self, task):
+
+        self.task = task
+
+    def span(self, phase, synchronize=True):
+
+        if not self.enabled:
+            return self.null_span
+
+        return Span(self, phase, synchronize and self.synchronize)
+
+    def add(self, phase, seconds):
+
+        phases = self.totals.setdefault(self.task, {})
+
+        phases.update({phase: phases.get(phase, 0.0) + seconds})
+
+    # total seconds spent in phase during task (0 if the phase did not take place)
+    def total(self, task, phase):
+
+        return self.totals.get(task, {}).get(phase, 0.0)
+
+
+class Span:
+
+    def __init__(self, timer, phase, synchronize):
+
+        self.timer = timer
+        self.phase = phase
+        self.synchronize = synchronize
+
+    def __enter__(self):
+
+        if self.synchronize:
+            torch.cuda.synchronize()
+
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if self.synchronize:
+            torch.cuda.synchronize()
+
+        self.timer.add(self.phase, time.perf_counter() - self.start)
+
+        return False
+
+
+class NullSpan:
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        return False
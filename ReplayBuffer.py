@@ -0,0 +1,232 @@
+import tempfile
+import numpy as np
+import torch
+
+"""
+Bounded store of training samples from previous tasks, for rehearsal- shared by GEM models (see GEMModel), which use the
+samples of each past task to constrain their gradients, and EWC models, which can add a rehearsal term to their loss
+(see ExpandableModel.rehearsal_loss()).
+
+The buffer holds at most as many samples as fit in budget bytes, however many tasks are trained. It is allocated in
+full the first time samples are added (once the size of a sample is known), and samples are then written into it in
+place. Which samples are kept depends on the policy:
+
+    - 'ring': the slots are shared equally between the tasks seen so far. Each task's share is a ring buffer of its
+      most recent samples, and when a new task arrives every task's share shrinks by evicting its oldest samples.
+    - 'reservoir': reservoir sampling over every sample offered to the buffer, so that the buffer always holds a
+      uniform random sample of the training data seen so far (from all tasks together).
+
+To keep the buffer small, each sample is stored as uint8 values with a per-sample affine scale. This is close to
+lossless for images, whose pixels are 8-bit values normalized by an affine transform. The samples are kept on the
+device. If mmap_dir is given, they are instead kept in a memory-mapped file in that directory, so the buffer can be
+larger than host memory. Sampled batches are gathered with a single index operation and decoded on the device.
+
+The task and age of the sample in each slot are kept in host memory (16 bytes per slot, not counted in the budget).
+"""
+class ReplayBuffer:
+
+    def __init__(self, budget, device, policy='ring', mmap_dir=None):
+
+        if policy not in ('ring', 'reservoir'):
+            raise ValueError("Invalid replay policy: {} (valid policies: ring, reservoir)\n".format(policy))
+
+        # maximum number of bytes of sample data (the stored values, their scales and their labels)
+        self.budget = budget
+
+        self.device = device
+        self.policy = policy
+        self.mmap_dir = mmap_dir
+
+        # device on which the sample data is stored- the host when it is memory-mapped
+        self.storage_device = torch.device('cpu') if mmap_dir else device
+
+        # number of samples the buffer can hold, and the shape of each sample- known once samples are first added
+        self.capacity = None
+        self.sample_shape = None
+
+        # sample data: uint8 values, the offset and scale recovering each sample's values from them, and labels
+        self.data = None
+        self.offsets = None
+        self.scales = None
+        self.targets = None
+
+        # task of the sample in each slot (-1 if the slot is empty), and the order in which it was added
+        self.slot_tasks = None
+        self.slot_ages = None
+
+        # number of samples offered to the buffer so far
+        self.added = 0
+
+        # tasks seen so far, in order (ring policy)
+        self.seen_tasks = []
+
+    def allocate(self, sample_shape, target_dtype):
+
+        self.sample_shape = tuple(sample_shape)
+
+        sample_bytes = int(np.prod(self.sample_shape)) + 2 * 4 + torch.tensor([], dtype=target_dtype).element_size()
+
+        self.capacity = self.budget // sample_bytes
+
+        if self.capacity == 0:
+            raise ValueError("a replay buffer budget of {} bytes cannot hold a single sample of {} bytes\n".format(
+                self.budget, sample_bytes))
+
+        if self.mmap_dir:
+            # the file is deleted when the buffer is garbage collected
+            self.mmap_file = tempfile.NamedTemporaryFile(dir=self.mmap_dir, suffix='.replay')
+
+            self.data = torch.from_numpy(np.memmap(self.mmap_file, dtype=np.uint8, mode='w+',
+                                                   shape=(self.capacity,) + self.sample_shape))
+        else:
+            self.data = torch.empty((self.capacity,) + self.sample_shape, dtype=torch.uint8, device=self.storage_device)
+
+        self.offsets = torch.zeros(self.capacity, device=self.storage_device)
+        self.scales = torch.zeros(self.capacity, device=self.storage_device)
+        self.targets = torch.zeros(self.capacity, dtype=target_dtype, device=self.storage_device)
+
+        self.slot_tasks = torch.full((self.capacity,), -1, dtype=torch.long)
+        self.slot_ages = torch.zeros(self.capacity, dtype=torch.long)
+
+    # offer a batch of (prepared- see ExpandableModel.prepare_batch()) training samples from task to the buffer
+    def add(self, task, data, target):
+
+        if self.data is None:
+            self.allocate(data.size()[1:], target.dtype)
+
+        if self.policy == 'ring':
+            slots, kept = self.ring_slots(task, len(target))
+        else:
+            slots, kept = self.reservoir_slots(len(target))
+
+        if len(slots) > 0:
+            values, offsets, scales = self.encode(data.detach()[kept.to(data.device)])
+
+            storage_slots = slots.to(self.storage_device)
+
+            self.data.index_copy_(0, storage_slots, values.to(self.storage_device))
+            self.offsets.index_copy_(0, storage_slots, offsets.to(self.storage_device))
+            self.scales.index_copy_(0, storage_slots, scales.to(self.storage_device))
+            self.targets.index_copy_(0, storage_slots, target[kept.to(target.device)].to(self.storage_device))
+
+            self.slot_tasks[slots] = task
+            self.slot_ages[slots] = self.added + kept
+
+        self.added += len(target)
+
+    # Slots for the newest samples of a batch of n from task, and the indices (in the batch) of the samples to be
+    # written to them: free slots while the task has fewer samples than its share, then the task's oldest samples
+    def ring_slots(self, task, n):
+
+        if task not in self.seen_tasks:
+            self.seen_tasks.append(task)
+
+            # make room for the new task's share by evicting the oldest samples of the other tasks
+            for other_task in self.seen_tasks[:-1]:
+                self.evict_oldest(other_task, self.task_share())
+
+        share = self.task_share()
+
+        n_kept = min(n, share)
+
+        own_slots = torch.nonzero(self.slot_tasks == task).view(-1)
+
+        # every other task holds at most its share, so there are always enough free slots for this task's share
+        new_slots = torch.nonzero(self.slot_tasks == -1).view(-1)[:max(0, min(n_kept, share - len(own_slots)))]
+
+        reused_slots = own_slots[torch.argsort(self.slot_ages[own_slots])[:n_kept - len(new_slots)]]
+
+        return torch.cat((new_slots, reused_slots)), torch.arange(n - n_kept, n)
+
+    # number of slots for each task in the ring policy
+    def task_share(self):
+
+        return self.capacity // len(self.seen_tasks)
+
+    # free the slots of all but the newest share samples of task
+    def evict_oldest(self, task, share):
+
+        own_slots = torch.nonzero(self.slot_tasks == task).view(-1)
+
+        if len(own_slots) > share:
+            self.slot_tasks[own_slots[torch.argsort(self.slot_ages[own_slots])[:len(own_slots) - share]]] = -1
+
+    # Reservoir sampling of a batch of n samples: the i-th sample offered to the buffer is kept with probability
+    # capacity / i, replacing a sample chosen uniformly at random
+    def reservoir_slots(self, n):
+
+        positions = self.added + torch.arange(n)
+
+        slots = torch.where(positions < self.capacity, positions,
+                            (torch.rand(n) * (positions + 1).float()).long())
+
+        kept = torch.nonzero(slots < self.capacity).view(-1)
+        slots = slots[kept]
+
+        # samples of the batch that drew the same slot- only one of them is written to it
+        winners = torch.full((self.capacity,), -1, dtype=torch.long)
+        winners[slots] = kept
+
+        unique = torch.nonzero(winners[slots] == kept).view(-1)
+
+        return slots[unique], kept[unique]
+
+    # uint8 values, offsets and scales such that each sample is (approximately) offset + values * scale
+    def encode(self, data):
+
+        flattened = data.view(len(data), -1).float()
+
+        offsets = flattened.min(1)[0]
+        scales = torch.clamp((flattened.max(1)[0] - offsets) / 255.0, min=1e-12)
+
+        values = torch.clamp(torch.round((flattened - offsets.view(-1, 1)) / scales.view(-1, 1)), 0, 255)
+
+        return values.to(torch.uint8).view((len(data),) + self.sample_shape), offsets, scales
+
+    # the (data, target) samples in the given slots, decoded on the device
+    def read(self, slots):
+
+        storage_slots = slots.to(self.storage_device)
+
+        values = self.data.index_select(0, storage_slots).to(self.device).view(len(slots), -1)
+        offsets = self.offsets.index_select(0, storage_slots).to(self.device)
+        scales = self.scales.index_select(0, storage_slots).to(self.device)
+
+        data = values.float() * scales.view(-1, 1) + offsets.view(-1, 1)
+
+        return data.view((len(slots),) + self.sample_shape), self.targets.index_select(0, storage_slots).to(self.device)
+
+    # numbers of the tasks with samples in the buffer, in order
+    def tasks(self):
+
+        if self.slot_tasks is None:
+            return []
+
+        return sorted(set(self.slot_tasks[self.slot_tasks >= 0].tolist()))
+
+    # all of the (data, target) samples held for task, or (if n is given and fewer than all of them) n of them drawn at
+    # random without replacement
+    def samples(self, task, n=None):
+
+        slots = torch.nonzero(self.slot_tasks == task).view(-1)
+
+        if n is not None and n < len(slots):
+            slots = slots[torch.randperm(len(slots))[:n]]
+
+        return self.read(slots)
+
+    # a batch of batch_size (data, target, task) samples drawn uniformly (with replacement) from those of the tasks
+    # before before_task- None if there are no such samples. The tasks of the samples are returned in host memory.
+    def sample(self, batch_size, before_task):
+
+        if self.slot_tasks is None:
+            return None
+
+        slots = torch.nonzero((self.slot_tasks >= 0) & (self.slot_tasks < before_task)).view(-1)
+
+        if len(slots) == 0:
+            return None
+
+        slots = slots[torch.randint(len(slots), (batch_size,), dtype=torch.long)]
+
+        return self.read(slots) + (self.slot_tasks[slots],)
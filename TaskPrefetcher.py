@@ -0,0 +1,191 @@
+import queue
+import threading
+import numpy as np
+import torch
+import torch.utils.data as D
+
+"""
+Prepares the data for upcoming tasks on a background thread, so that the data for task N + 1 is ready by the time
+training and testing on task N have finished, rather than being generated between them.
+
+generate_task(task_number, generator, random_state) is called for each task in order. The DataLoaders it returns are
+lazy- every image would still be decoded and transformed (through PIL) as it is read during training- so the prefetcher
+reads the task's training, validation and test data through them in full on the background thread, and hands the
+training loop MaterializedLoaders over the resulting tensors instead (through a bounded queue holding at most depth
+tasks, so the prefetcher never runs more than depth tasks ahead of training).
+
+Data that is exactly representable as 8-bit pixel values (as the output of transforms.ToTensor() on mnist images is)
+is stored as such, and converted back to the same floating point values one batch at a time as it is read, so each
+prefetched mnist task holds about 55MB of host memory rather than 220MB. A dataset shared by several tasks (e.g. the
+unpermuted test set of every task in --permute-in-weights mode) is materialized once and shared by their loaders.
+
+The background thread must not draw from the global RNGs, which are also used by training on the main thread (weight
+initialization, dropout, shuffling), as the interleaving of the two threads would make runs impossible to reproduce.
+Tasks are instead generated using a dedicated torch.Generator and np.random.RandomState seeded with seed, so a given
+seed produces the same sequence of tasks (though not the same sequence as when tasks are generated without a
+prefetcher, from the global RNGs).
+"""
+class TaskPrefetcher:
+
+    def __init__(self, generate_task, tasks, seed, depth=1):
+
+        self.generate_task = generate_task
+        self.tasks = tasks
+
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+
+        self.random_state = np.random.RandomState(seed)
+
+        # dictionary, format:
+        # {id of a dataset read by the last task : (the dataset, the MaterializedDataset it was read into)}
+        # (the dataset is held so that its id is not reused while it is in the dictionary)
+        self.materialized_datasets = {}
+
+        self.queue = queue.Queue(maxsize=depth)
+
+        # set to stop the background thread early (see close())
+        self.stopped = threading.Event()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+
+        for task_number in range(1, self.tasks + 1):
+
+            try:
+                task = self.materialize_task(self.generate_task(task_number, self.generator, self.random_state))
+
+            # hand the exception to the training loop, to be raised there when it asks for this task
+            except Exception as e:
+                task = e
+
+            # wait for space in the queue, checking periodically whether the prefetcher has been closed
+            while not self.stopped.is_set():
+                try:
+                    self.queue.put(task, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+            if self.stopped.is_set() or isinstance(task, Exception):
+                return
+
+    # (train_loader, validation_loader, test_loader, permutation) with each loader replaced by a MaterializedLoader
+    def materialize_task(self, task):
+
+        train_loader, validation_loader, test_loader, permutation = task
+
+        # datasets read by the previous task are reused rather than read again- only this task's are kept for the next
+        previous = self.materialized_datasets
+        self.materialized_datasets = {}
+
+        return (self.materialize(train_loader, previous), self.materialize(validation_loader, previous),
+                self.materialize(test_loader, previous), permutation)
+
+    def materialize(self, loader, previous):
+
+        dataset = loader.dataset
+
+        entry = previous.get(id(dataset), self.materialized_datasets.get(id(dataset)))
+
+        if entry is None:
+            entry = (dataset, MaterializedDataset(dataset))
+
+        self.materialized_datasets.update({id(dataset): entry})
+
+        materialized = entry[1]
+
+        # a RandomSampler shuffles the data
+        shuffle = isinstance(loader.sampler, D.RandomSampler)
+
+        return MaterializedLoader(materialized, loader.batch_size, shuffle)
+
+    # wait for (if necessary) and return the data for the next task
+    def next_task(self):
+
+        task = self.queue.get()
+
+        if isinstance(task, Exception):
+            raise task
+
+        return task
+
+    # stop generating tasks (e.g. when a run ends before all tasks have been trained)
+    def close(self):
+
+        self.stopped.set()
+
+        self.thread.join()
+
+
+# All of the (data, target) samples of a dataset, read in order (passing through any transforms) into two tensors
+class MaterializedDataset:
+
+    # number of samples read from the dataset at a time
+    read_batch_size = 1000
+
+    def __init__(self, dataset):
+
+        data = []
+        target = []
+
+        # read in order- a DataLoader draws a base seed for its workers even then, so from a generator of its own
+        # rather than the global RNG
+        for batch_data, batch_target in D.DataLoader(dataset, batch_size=self.read_batch_size, shuffle=False,
+                                                     generator=torch.Generator()):
+            data.append(batch_data)
+            target.append(batch_target)
+
+        data = torch.cat(data)
+        self.target = torch.cat(target)
+
+        pixels = torch.round(data * 255)
+
+        # stored as 8-bit pixel values only if they convert back to exactly the same data
+        self.quantized = data.is_floating_point() and bool(((pixels >= 0) & (pixels <= 255)).all()) and \
+            torch.equal(pixels.to(torch.uint8).to(data.dtype).div(255), data)
+
+        self.data = pixels.to(torch.uint8) if self.quantized else data
+
+        self.dtype = data.dtype
+
+    def __len__(self):
+
+        return len(self.target)
+
+    # (data, target) of the samples at the given indices
+    def __getitem__(self, indices):
+
+        data = self.data[indices]
+
+        # the same operation as transforms.ToTensor(), so the values are identical to those of the original dataset
+        if self.quantized:
+            data = data.to(self.dtype).div(255)
+
+        return data, self.target[indices]
+
+
+# An iterable over (data, target) batches of a MaterializedDataset, used in place of a DataLoader over the original
+# dataset. If shuffle is True the samples are drawn in a new random order (from the global RNG, as a DataLoader's are)
+# each time the loader is iterated over.
+class MaterializedLoader:
+
+    def __init__(self, dataset, batch_size, shuffle):
+
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    # number of batches
+    def __len__(self):
+
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+
+        order = torch.randperm(len(self.dataset)) if self.shuffle else torch.arange(len(self.dataset))
+
+        for start in range(0, len(self.dataset), self.batch_size):
+            yield self.dataset[order[start:start + self.batch_size]]
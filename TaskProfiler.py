@@ -0,0 +1,153 @@
+import os
+
+"""
+Captures torch.profiler traces of selected tasks (see setup.py --profile-tasks and --profile-after-expansion), covering
+the training steps, Fisher estimation (and any other post-training consolidation) and evaluation of a model on the task.
+
+main.py calls begin() before a selected task is trained and end() once the model has been tested on it. While a task
+is being profiled:
+
+    - training is profiled on a torch.profiler schedule: wait steps are skipped, warmup steps are traced but
+      discarded, and the next active steps are recorded (train_model() calls start_training(), step() after every
+      training step, and stop_training())
+    - phases such as consolidation and testing are each recorded in full, in a capture(phase) span
+
+Each recording is exported to output_dir as a Chrome trace (<label>_task<N>_hidden<H>_<phase>.json, viewable in
+chrome://tracing or Perfetto) and a table of the operators taking the most time (<label>_task<N>_hidden<H>_<phase>.txt).
+The hidden size in the names distinguishes the attempts at a task before and after an expansion.
+
+Outside of profiled tasks every method does nothing, so a model can always hold a TaskProfiler.
+"""
+class TaskProfiler:
+
+    def __init__(self, output_dir=None, label='', device=None, wait=1, warmup=1, active=5, row_limit=50):
+
+        self.output_dir = output_dir
+        self.label = label
+        self.device = device
+
+        # profiler schedule for the training steps
+        self.wait = wait
+        self.warmup = warmup
+        self.active = active
+
+        # number of operators listed in each exported table
+        self.row_limit = row_limit
+
+        # prefix of the names of the files exported for the task being profiled (None if no task is being profiled)
+        self.prefix = None
+
+        # profiler recording the training steps of the task being profiled
+        self.training_profiler = None
+
+    # profile the model's next attempt at task_number, at the given hidden size
+    def begin(self, task_number, hidden_size):
+
+        self.prefix = '{}_task{}_hidden{}'.format(self.label, task_number, hidden_size)
+
+    def end(self):
+
+        self.prefix = None
+
+    def profiling(self):
+
+        return self.prefix is not None
+
+    def new_profiler(self, schedule=None, on_trace_ready=None):
+
+        # imported here so that runs which profile nothing do not depend on torch.profiler (PyTorch >= 1.8.1)
+        import torch.profiler
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+
+        if self.device is not None and self.device.type == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+        return torch.profiler.profile(activities=activities, schedule=schedule, on_trace_ready=on_trace_ready,
+                                      record_shapes=True)
+
+    def start_training(self):
+
+        if not self.profiling():
+            return
+
+        import torch.profiler
+
+        prefix = self.prefix
+
+        self.training_profiler = self.new_profiler(
+            torch.profiler.schedule(wait=self.wait, warmup=self.warmup, active=self.active, repeat=1),
+            lambda profiler: self.export(profiler, prefix + '_train'))
+
+        self.training_profiler.start()
+
+    def step(self):
+
+        if self.training_profiler is not None:
+            self.training_profiler.step()
+
+    def stop_training(self):
+
+        if self.training_profiler is not None:
+            self.training_profiler.stop()
+
+            self.training_profiler = None
+
+    # a context manager recording everything done within it as the given phase of the task being profiled
+    def capture(self, phase):
+
+        if not self.profiling():
+            return NullCapture()
+
+        return Capture(self, phase)
+
+    def export(self, profiler, name):
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        path = os.path.join(self.output_dir, name)
+
+        profiler.export_chrome_trace(path + '.json')
+
+        sort_by = 'self_cuda_time_total' if self.device is not None and self.device.type == 'cuda' \
+            else 'self_cpu_time_total'
+
+        with open(path + '.txt', 'w') as table:
+            table.write(profiler.key_averages().table(sort_by=sort_by, row_limit=self.row_limit))
+
+        print('|-----[PROFILE WRITTEN TO {}.json]-----|'.format(path))
+
+
+class Capture:
+
+    def __init__(self, task_profiler, phase):
+
+        self.task_profiler = task_profiler
+        self.name = task_profiler.prefix + '_' + phase
+
+    def __enter__(self):
+
+        self.profiler = self.task_profiler.new_profiler()
+        self.profiler.__enter__()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.profiler.__exit__(exc_type, exc_value, traceback)
+
+        if exc_type is None:
+            self.task_profiler.export(self.profiler, self.name)
+
+        return False
+
+
+class NullCapture:
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        return False
@@ -0,0 +1,136 @@
+import torch
+
+"""
+Holds the test data for every task seen so far on the device, so that evaluating a model on all previous tasks does not
+have to decode and transform every test image (through PIL, via a DataLoader) again for each task, each time the
+model is tested.
+
+The test set of each task is read from its DataLoader ONCE, when the task is added to the cache. Permuted mnist tasks
+differ from the first (unpermuted) task only by a permutation of the pixels in each image, so the cache stores one
+shared base tensor of unpermuted test data and, for each task:
+
+    - a materialized copy of the base data with the task's permutation applied, if it fits within the memory budget
+    - otherwise, just the permutation, which is then applied to each batch on the device as it is read
+
+Tasks whose test data is not a permutation of the base data (e.g. incremental CIFAR 100 tasks) are materialized if they
+fit within the budget, and otherwise fall back to their original DataLoader.
+
+Batches are contiguous slices of the cached tensors, in a fixed order (the order in which samples are drawn from the
+test data has no effect on the test loss or accuracy).
+
+NOTE: the shuffling test DataLoaders draw from the global RNG each time they are iterated over, and the cached test sets
+do not. The random numbers drawn by training after the first test (shuffling, Fisher sampling, weight initialization)
+are therefore different from those of a run with the same seed without the cache, so its results (e.g. the accuracies
+and Fisher totals from the second task on) differ as well- although each is still reproducible.
+"""
+class TestSetCache:
+
+    def __init__(self, device, batch_size, budget=0):
+
+        self.device = device
+
+        # number of samples in each batch returned when iterating over a cached test set
+        self.batch_size = batch_size
+
+        # maximum number of bytes of materialized (per-task) test data to be held on the device- the base data is
+        # always stored, as every permuted task depends on it
+        self.budget = budget
+
+        self.used = 0
+
+        # unpermuted test data shared by the permuted tasks, and the dataset it was read from
+        self.base_data = None
+        self.base_target = None
+        self.base_dataset = None
+
+    # Cache the test data of a new task, returning the iterable over its test batches to be used in place of
+    # test_loader. permutation is the permutation (as a LongTensor p such that each permuted image is x[p]) that has
+    # been applied to the task's data, or None if its data has not been permuted.
+    def add_task(self, test_loader, permutation=None):
+
+        dataset = getattr(test_loader, 'dataset', None)
+
+        # the first (unpermuted) task provides the base data- in permutation-in-weights mode (see setup.py
+        # --permute-in-weights) every task's test loader is over this same dataset, so it is only ever read once
+        if self.base_data is None and permutation is None:
+            self.base_data, self.base_target = [tensor.to(self.device) for tensor in self.materialize(test_loader)]
+            self.base_dataset = dataset
+
+            self.used += self.size_of(self.base_data, self.base_target)
+
+            return CachedTestSet(self.base_data, self.base_target, self.batch_size)
+
+        if permutation is None and dataset is not None and dataset is self.base_dataset:
+            return CachedTestSet(self.base_data, self.base_target, self.batch_size)
+
+        if permutation is not None and self.base_data is not None:
+
+            permutation = permutation.to(self.device)
+
+            if self.fits(self.size_of(self.base_data)):
+                data = self.base_data[:, permutation].contiguous()
+
+                self.used += self.size_of(data)
+
+                return CachedTestSet(data, self.base_target, self.batch_size)
+
+            return CachedTestSet(self.base_data, self.base_target, self.batch_size, permutation)
+
+        # a task that is not a permutation of the base data- materialize its test data only if it will fit
+        data, target = self.materialize(test_loader)
+
+        if not self.fits(self.size_of(data, target)):
+            return test_loader
+
+        self.used += self.size_of(data, target)
+
+        return CachedTestSet(data.to(self.device), target.to(self.device), self.batch_size)
+
+    # read all of the test data for a task from its loader (any iterable over (data, target) batches) into host memory
+    def materialize(self, test_loader):
+
+        data = []
+        target = []
+
+        for batch_data, batch_target in test_loader:
+            data.append(batch_data)
+            target.append(batch_target)
+
+        return torch.cat(data), torch.cat(target)
+
+    def fits(self, size):
+
+        return self.used + size <= self.budget
+
+    @staticmethod
+    def size_of(*tensors):
+
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+# An iterable over contiguous batches of test data held on the device. If a permutation is given, it is applied to
+# the (flattened) pixels of each batch as it is read.
+class CachedTestSet:
+
+    def __init__(self, data, target, batch_size, permutation=None):
+
+        self.data = data
+        self.target = target
+        self.batch_size = batch_size
+        self.permutation = permutation
+
+    # number of batches
+    def __len__(self):
+
+        return (len(self.data) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+
+        for start in range(0, len(self.data), self.batch_size):
+
+            data = self.data[start:start + self.batch_size]
+
+            if self.permutation is not None:
+                data = data[:, self.permutation]
+
+            yield data, self.target[start:start + self.batch_size]
@@ -0,0 +1,165 @@
+import torch
+
+"""
+Keeps track of the training loss (and any penalty term added to it, such as the EWC loss on previous tasks) on the
+device the model is trained on, so that the training loop never has to wait for the device to report a loss value back
+to the host (as calling loss.item() every iteration would).
+
+Every check_interval training iterations, the monitored values for that window of iterations are copied to the host
+asynchronously. The values are only read once that copy has completed, so logging and the divergence check always
+report the most recent COMPLETED window of training iterations rather than blocking until the current one is done.
+
+A window is flagged if any of its iterations produced a NaN or infinite loss or penalty, or a loss greater than the
+divergence threshold. The network is considered to have diverged once patience consecutive completed windows have
+been flagged (a sustained blow-up, rather than a single spike in the loss that training recovers from).
+"""
+class TrainingMonitor:
+
+    def __init__(self, device, threshold=1000, check_interval=10, patience=1):
+
+        self.device = device
+
+        # a loss greater than this (or any NaN or infinite loss or penalty) is considered to be a divergence
+        self.threshold = threshold
+
+        # number of training iterations between each copy of the monitored values from the device to the host
+        self.check_interval = check_interval
+
+        # number of consecutive flagged windows required before the network is considered to have diverged
+        self.patience = patience
+
+        # CUDA events are used to check whether a copy to the host has completed without blocking
+        self.use_events = device.type == 'cuda'
+
+        # sums of the losses and penalties over the current window of training iterations (stay on the device)
+        self.running_loss = torch.zeros((), device=device)
+        self.running_penalty = torch.zeros((), device=device)
+        self.window_steps = 0
+
+        # iteration counter kept on the device, so that the first flagged iteration in a window can be recorded there
+        self.device_step = torch.zeros((), device=device)
+
+        # set (on the device) if any training iteration in the current window produced a diverged loss or penalty, along
+        # with the number of the first such iteration
+        self.window_flag = torch.zeros((), dtype=torch.bool, device=device)
+        self.window_first_flagged_step = torch.zeros((), device=device)
+
+        # host-side destination of the asynchronous copies:
+        # [window flag, first flagged iteration, mean loss over the window, mean penalty over the window, iteration]
+        # (pinned memory is required for the copy to actually be asynchronous)
+        self.host_snapshot = torch.zeros(5, pin_memory=self.use_events)
+        self.snapshot_event = None
+        self.pending = False
+
+        self.steps = 0
+
+        # values below are only ever updated from COMPLETED copies to the host
+        self.diverged = False
+        self.diverged_step = None
+        self.latest_loss = None
+        self.consecutive_flagged_windows = 0
+
+        # first flagged iteration of the current run of consecutive flagged windows
+        self.flagged_run_start = None
+
+        # list of [iteration, mean loss, mean penalty] entries, one per completed window of training iterations
+        self.trajectory = []
+
+    # record the loss (and penalty, if any) of a single training iteration- no host synchronization takes place here
+    def step(self, loss, penalty=None):
+
+        loss = loss.detach()
+
+        self.running_loss += loss
+
+        self.device_step += 1
+
+        flagged = ~torch.isfinite(loss) | (loss > self.threshold)
+
+        if penalty is not None:
+            penalty = penalty.detach()
+
+            self.running_penalty += penalty
+
+            flagged |= ~torch.isfinite(penalty)
+
+        # remember the first flagged iteration in this window
+        self.window_first_flagged_step = torch.where(flagged & ~self.window_flag, self.device_step,
+                                                     self.window_first_flagged_step)
+
+        self.window_flag |= flagged
+
+        self.steps += 1
+        self.window_steps += 1
+
+        if self.steps % self.check_interval == 0:
+            self.collect()
+
+            # if the previous copy to the host has not completed yet, keep accumulating into the current window rather
+            # than overwriting values that have not been read
+            if not self.pending:
+                self.snapshot()
+
+    # start an asynchronous copy of the values monitored over the current window to the host
+    def snapshot(self):
+
+        values = torch.stack((
+            self.window_flag.float(),
+            self.window_first_flagged_step,
+            self.running_loss / self.window_steps,
+            self.running_penalty / self.window_steps,
+            self.device_step
+        ))
+
+        self.host_snapshot.copy_(values, non_blocking=True)
+
+        if self.use_events:
+            self.snapshot_event = torch.cuda.Event()
+            self.snapshot_event.record()
+
+        self.running_loss.zero_()
+        self.running_penalty.zero_()
+        self.window_flag.zero_()
+        self.window_steps = 0
+        self.pending = True
+
+    # read the values from the last copy to the host IF it has completed (or wait for it to complete if block is True)
+    def collect(self, block=False):
+
+        if not self.pending:
+            return
+
+        if self.use_events:
+            if block:
+                self.snapshot_event.synchronize()
+            elif not self.snapshot_event.query():
+                return
+
+        flag, first_flagged_step, loss, penalty, step = self.host_snapshot.tolist()
+
+        self.pending = False
+        self.latest_loss = loss
+
+        self.trajectory.append([step, loss, penalty])
+
+        if flag:
+            if self.consecutive_flagged_windows == 0:
+                self.flagged_run_start = int(first_flagged_step)
+
+            self.consecutive_flagged_windows += 1
+
+            if self.consecutive_flagged_windows >= self.patience and not self.diverged:
+                self.diverged = True
+                self.diverged_step = self.flagged_run_start
+        else:
+            self.consecutive_flagged_windows = 0
+
+    # flush any iterations not yet copied to the host and wait for the final values- used once training has stopped
+    def finish(self):
+
+        self.collect(block=True)
+
+        if self.window_steps > 0:
+            self.snapshot()
+
+            self.collect(block=True)
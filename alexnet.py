@@ -1,6 +1,7 @@
 import torch.nn as nn
 import torch.nn
 import torch.utils.model_zoo as model_zoo
+from network_utils import ElasticConv2d, ElasticLinear
 
 __all__ = ['AlexNet', 'alexnet']
 
@@ -12,7 +13,7 @@ model_urls = {
 
 class AlexNet(nn.Module):
 
-    def __init__(self, filters=8, num_classes=100):
+    def __init__(self, filters=8, num_classes=100, max_filters=None):
         """
         Constructor for AlexNet architecture of varying sizes (For use with CIFAR).
         
@@ -27,60 +28,118 @@ class AlexNet(nn.Module):
         
         num_classes (int): width of the output layer (predictions)- number of classes in 
                             classification problem
+
+        max_filters (int, optional): if given, every layer is allocated at the size it would have with
+                            max_filters filters, and only the part of it corresponding to filters is used
+                            (see set_filters())- allows the network to grow without being rebuilt
         """
 
         
         print(torch.randint(1, 10000, (1,), device=torch.device('cpu')))
         print(torch.randint(1, 10000, (1,), device=torch.device('cuda'))) 
 
-        CLASSIFICATION_STARTING_WIDTH = 256
-        CLASSIFICATION_SCALE_FACTOR = 256 
-        
-        FILTERS_START = 8
-        FILTER_EXPANSION = 8 # TODO replace this with a pass-through of args.scale_factor
-
         super(AlexNet, self).__init__()
         
 
         self.filters = filters
-       
-        
-        # scale dense layers' widths by CLASSIFICATION_SCALE_FACTOR each time filters expands
-        # NOTE: now we're just adding, not multiplying by, CLASSIFICATION SCALE FACTOR
-        classification_width = \
-            (CLASSIFICATION_SCALE_FACTOR * ((filters - FILTERS_START) // FILTER_EXPANSION)) + CLASSIFICATION_STARTING_WIDTH 
-        
+        self.num_classes = num_classes
+        self.max_filters = max_filters
+
+        elastic = max_filters is not None
+
+        # (in, out) sizes of each convolutional and linear layer, in order, at the current and maximum sizes
+        sizes = self.layer_sizes(filters, num_classes)
+        max_sizes = self.layer_sizes(max_filters if elastic else filters, num_classes)
+
+        def conv(layer_index, **kwargs):
+            (in_channels, out_channels), (max_in_channels, max_out_channels) = sizes[layer_index], max_sizes[layer_index]
+
+            if elastic:
+                return ElasticConv2d(in_channels, out_channels, max_in_channels, max_out_channels, **kwargs)
+
+            return nn.Conv2d(in_channels=in_channels, out_channels=out_channels, **kwargs)
+
+        def linear(layer_index):
+            (in_features, out_features), (max_in_features, max_out_features) = sizes[layer_index], max_sizes[layer_index]
+
+            if elastic:
+                return ElasticLinear(in_features, out_features, max_in_features, max_out_features)
+
+            return nn.Linear(in_features=in_features, out_features=out_features)
 
-        
         # TODO remove this - this is to prevent filters from expanding but maintain the 
         # expansion of the classification width correctly 
         # filters = FILTERS_START
 
         self.features = nn.Sequential(
-            nn.Conv2d(in_channels=3, out_channels=filters, kernel_size=11, stride=4, padding=5),
+            conv(0, kernel_size=11, stride=4, padding=5),
             nn.ReLU(inplace=True),
             nn.MaxPool2d(kernel_size=2, stride=2),
-            nn.Conv2d(in_channels=filters, out_channels=filters*3, kernel_size=5, padding=2),
+            conv(1, kernel_size=5, padding=2),
             nn.ReLU(inplace=True),
             nn.MaxPool2d(kernel_size=2, stride=2),
-            nn.Conv2d(in_channels=filters*3, out_channels=filters*6, kernel_size=3, padding=1),
+            conv(2, kernel_size=3, padding=1),
             nn.ReLU(inplace=True),
-            nn.Conv2d(in_channels=filters*6, out_channels=filters*4, kernel_size=3, padding=1),
+            conv(3, kernel_size=3, padding=1),
             nn.ReLU(inplace=True),
-            nn.Conv2d(in_channels=filters*4, out_channels=filters*4, kernel_size=3, padding=1),
+            conv(4, kernel_size=3, padding=1),
             nn.ReLU(inplace=True),
             nn.MaxPool2d(kernel_size=2, stride=1),
         )
         self.classifier = nn.Sequential(
             nn.Dropout(),
-            nn.Linear(in_features=filters*4, out_features=classification_width),
+            linear(5),
             nn.ReLU(inplace=True),
             nn.Dropout(),
-            nn.Linear(in_features=classification_width, out_features=classification_width),
+            linear(6),
             nn.ReLU(inplace=True),
-            nn.Linear(in_features=classification_width, out_features=num_classes),
+            linear(7),
         )
 
+    @staticmethod
+    def classification_width(filters):
+
+        CLASSIFICATION_STARTING_WIDTH = 256
+        CLASSIFICATION_SCALE_FACTOR = 256 
+        
+        FILTERS_START = 8
+        FILTER_EXPANSION = 8 # TODO replace this with a pass-through of args.scale_factor
+
+        # scale dense layers' widths by CLASSIFICATION_SCALE_FACTOR each time filters expands
+        # NOTE: now we're just adding, not multiplying by, CLASSIFICATION SCALE FACTOR
+        return (CLASSIFICATION_SCALE_FACTOR * ((filters - FILTERS_START) // FILTER_EXPANSION)) + CLASSIFICATION_STARTING_WIDTH
+
+    # (in, out) sizes of the five convolutional layers followed by the three linear layers for the given number of filters
+    @staticmethod
+    def layer_sizes(filters, num_classes):
+
+        classification_width = AlexNet.classification_width(filters)
+
+        return [
+            (3, filters),
+            (filters, filters*3),
+            (filters*3, filters*6),
+            (filters*6, filters*4),
+            (filters*4, filters*4),
+            (filters*4, classification_width),
+            (classification_width, classification_width),
+            (classification_width, num_classes),
+        ]
+
+    # grow an AlexNet built with max_filters to use the given number of filters (and the corresponding layer sizes)
+    # without reallocating any of its parameters
+    def set_filters(self, filters):
+
+        if self.max_filters is None:
+            raise ValueError("set_filters() requires an AlexNet built with max_filters\n")
+
+        layers = [module for module in self.modules() if isinstance(module, (ElasticConv2d, ElasticLinear))]
+
+        for layer, (in_size, out_size) in zip(layers, self.layer_sizes(filters, self.num_classes)):
+            layer.grow(in_size, out_size)
+
+        self.filters = filters
+
     def forward(self, x):
         x = self.features(x)
         x = x.view(x.size(0), -1)
@@ -0,0 +1,301 @@
+import argparse
+import json
+import platform
+import statistics
+import time
+from argparse import Namespace
+import torch
+import torch.utils.data as D
+import utils
+from EWCMLP import EWCMLP
+from EWCCNN import EWCCNN
+
+"""
+Micro-benchmarks of the hot paths of the EWC pipeline, on synthetic data (no datasets are downloaded) on the CPU.
+
+Each benchmark is run for every combination of the given hidden sizes, task counts and validation set sizes, on a model
+holding the per-task state (EWC sums, post-training weights, size dictionary) it would have after training on that many
+tasks. The median and minimum time over --repeats runs of each are written to a JSON file, which can be given as the
+--baseline of a later run to print the change relative to it.
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --output after.json
+
+benchmark_baseline.json holds the results of a run with the default arguments (on a single CPU core, see its metadata)-
+timings are only comparable with runs on the same machine, so it is a reference for the shape of the results and the
+relative cost of each path rather than a target to compare against elsewhere.
+"""
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the continual learning hot paths')
+
+    parser.add_argument('--hidden-sizes', nargs='+', type=int, default=[20, 100], metavar='HS',
+                        help='hidden sizes of the benchmarked MLPs (default 20 100)')
+
+    parser.add_argument('--tasks', nargs='+', type=int, default=[2, 10], metavar='T',
+                        help='numbers of previous tasks held in the benchmarked models\' state (default 2 10)')
+
+    parser.add_argument('--validation-sizes', nargs='+', type=int, default=[200], metavar='VDS',
+                        help='numbers of validation samples used to estimate the Fisher (default 200)')
+
+    parser.add_argument('--test-size', type=int, default=2000, metavar='TS',
+                        help='number of synthetic test samples per task (default 2000)')
+
+    parser.add_argument('--repeats', type=int, default=5, metavar='R',
+                        help='number of timed runs of each benchmark (default 5)')
+
+    parser.add_argument('--threads', type=int, default=1, metavar='TH',
+                        help='number of CPU threads used by torch (default 1, for stable timings)')
+
+    parser.add_argument('--cnn', action='store_true', default=False,
+                        help='also benchmark EWCCNN testing and EWC loss (slow on the CPU)')
+
+    parser.add_argument('--seed', type=int, default=0, metavar='S',
+                        help='random seed for the synthetic data and models (default 0)')
+
+    parser.add_argument('--output', type=str, default='benchmark_results.json', metavar='OUTPUT',
+                        help='JSON file to which the results are written (default benchmark_results.json)')
+
+    parser.add_argument('--baseline', type=str, default='', metavar='BASELINE',
+                        help='JSON results of an earlier run to compare against')
+
+    return parser.parse_args()
+
+
+# the experiment arguments read by the benchmarked code, as setup.parse_arguments() would set them for a custom
+# mnist experiment
+def experiment_args(hidden_size, validation_size, test_size):
+
+    return Namespace(batch_size=100, test_batch_size=1000, eval_batch_size=0, eval_memory_ceiling=256,
+                     validation_dataset_size=validation_size, train_dataset_size=validation_size,
+                     adaptive_fisher=False, fisher_batch_size=50, fisher_tolerance=0.01, fisher_chunk_size=25,
+                     fisher_min_samples=50, fisher_max_samples=0, hidden_size=hidden_size, input_size=784,
+                     output_size=10, scale_factor=2, lam=15, perm=100, test_size=test_size)
+
+
+# DataLoader over n random samples of the given shape with random labels
+def synthetic_loader(n, sample_shape, batch_size, output_size=10):
+
+    dataset = D.TensorDataset(torch.rand((n,) + tuple(sample_shape)), torch.randint(output_size, (n,), dtype=torch.long))
+
+    return D.DataLoader(dataset, batch_size=batch_size, shuffle=False)
+
+
+# a model (built by build_model) holding the per-task state it would have after being trained on tasks tasks
+def model_after_tasks(build_model, tasks, validation_loader, args):
+
+    model = build_model()
+
+    for task in range(1, tasks + 1):
+
+        # stand-in for training- the weights change between tasks, so the EWC sums are not trivially structured
+        with torch.no_grad():
+            for parameter in model.parameters():
+                parameter.add_(0.01 * torch.randn(parameter.size()))
+
+        model.update_size_dict(task)
+        model.save_theta_stars(task)
+        model.consolidate(args, task, validation_loader=validation_loader)
+
+    return model
+
+
+# Run fn (given the value returned by setup()- untimed) repeats times, returning the median and minimum time of fn
+def time_runs(fn, repeats, setup=lambda: None):
+
+    times = []
+
+    for repeat in range(repeats):
+        state = setup()
+
+        start = time.perf_counter()
+        fn(state)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times), min(times)
+
+
+def run_benchmarks(benchmark_args):
+
+    results = []
+
+    def record(name, config, timings):
+
+        median, minimum = timings
+
+        results.append(dict(config, benchmark=name, median_s=median, min_s=minimum, repeats=benchmark_args.repeats))
+
+        print('{:<30} {:<45} median {:.6f}s  min {:.6f}s'.format(
+            name, ', '.join('{}={}'.format(k, v) for k, v in sorted(config.items())), median, minimum))
+
+    for hidden_size in benchmark_args.hidden_sizes:
+        for validation_size in benchmark_args.validation_sizes:
+
+            args = experiment_args(hidden_size, validation_size, benchmark_args.test_size)
+
+            validation_loader = synthetic_loader(validation_size, (784,), validation_size)
+
+            def build_mlp(size=hidden_size):
+                return EWCMLP(size, 784, 10, torch.device('cpu'), lam=args.lam)
+
+            # work done once per task, independent of the number of previous tasks
+            config = {'model': 'EWCMLP', 'hidden_size': hidden_size, 'validation_size': validation_size}
+
+            model = model_after_tasks(build_mlp, 1, validation_loader, args)
+
+            record('estimate_fisher', config, time_runs(
+                lambda state: model.estimate_fisher(validation_loader, args), benchmark_args.repeats))
+
+            record('update_ewc_sums', config, time_runs(
+                lambda state: model.update_ewc_sums(), benchmark_args.repeats))
+
+            for tasks in benchmark_args.tasks:
+
+                config = {'model': 'EWCMLP', 'hidden_size': hidden_size, 'validation_size': validation_size,
+                          'tasks': tasks}
+
+                model = model_after_tasks(build_mlp, tasks, validation_loader, args)
+
+                def penalty_step(state):
+                    model.zero_grad()
+                    model.ewc_loss_prev_tasks(tasks + 1).backward()
+
+                record('ewc_loss_prev_tasks', config, time_runs(penalty_step, benchmark_args.repeats))
+
+                test_loaders = [synthetic_loader(args.test_size, (784,), args.test_batch_size) for task in range(tasks)]
+
+                record('test', config, time_runs(
+                    lambda state: model.test(test_loaders, 0, args), benchmark_args.repeats))
+
+                # expanding consumes the model, so each run expands a model of its own
+                def expandable_model():
+                    return model_after_tasks(build_mlp, tasks, validation_loader, args)
+
+                def transferred_model():
+                    small_model = expandable_model()
+                    large_model = build_mlp(hidden_size * args.scale_factor)
+                    large_model.transfer_from(small_model)
+                    return large_model
+
+                record('expand_ewc_sums', config, time_runs(
+                    lambda state: state.expand_ewc_sums(), benchmark_args.repeats, transferred_model))
+
+                record('utils.expand', config, time_runs(
+                    lambda state: utils.expand([state], args), benchmark_args.repeats, expandable_model))
+
+
+    # generation of a permuted mnist task (and one pass over its data), from synthetic base datasets standing in
+    # for MNIST- generate_permuted_mnist_task() and generate_cifar_tasks() read their datasets through
+    # torchvision, which downloads them, so they are not benchmarked
+    args = experiment_args(benchmark_args.hidden_sizes[0], benchmark_args.validation_sizes[0], benchmark_args.test_size)
+    args.train_dataset_size = 10 * args.test_size - args.validation_dataset_size
+
+    utils.mnist_base_datasets.update({
+        'train': D.TensorDataset(torch.rand(10 * args.test_size, 784, 1),
+                                 torch.randint(10, (10 * args.test_size,), dtype=torch.long)),
+        'test': D.TensorDataset(torch.rand(args.test_size, 784, 1),
+                                torch.randint(10, (args.test_size,), dtype=torch.long))
+    })
+
+    def generate_and_load_task(state):
+        for loader in utils.generate_new_mnist_permutation_task(args, {}, first_task=False)[:3]:
+            for data, target in loader:
+                pass
+
+    record('mnist_permutation_task', {'train_size': args.train_dataset_size, 'test_size': args.test_size},
+           time_runs(generate_and_load_task, benchmark_args.repeats))
+
+    utils.mnist_base_datasets.clear()
+
+    if benchmark_args.cnn:
+
+        hidden_size = min(benchmark_args.hidden_sizes)
+        validation_size = min(benchmark_args.validation_sizes)
+
+        args = experiment_args(hidden_size, validation_size, benchmark_args.test_size)
+        args.input_size, args.output_size = 1024, 100
+
+        validation_loader = synthetic_loader(validation_size, (3, 32, 32), validation_size, 100)
+
+        def build_cnn():
+            return EWCCNN(hidden_size, 1024, 100, torch.device('cpu'), lam=args.lam)
+
+        for tasks in benchmark_args.tasks:
+
+            config = {'model': 'EWCCNN', 'hidden_size': hidden_size, 'validation_size': validation_size, 'tasks': tasks}
+
+            model = model_after_tasks(build_cnn, tasks, validation_loader, args)
+
+            def penalty_step(state):
+                model.zero_grad()
+                model.ewc_loss_prev_tasks(tasks + 1).backward()
+
+            record('ewc_loss_prev_tasks', config, time_runs(penalty_step, benchmark_args.repeats))
+
+            test_loaders = [synthetic_loader(args.test_size, (3, 32, 32), args.test_batch_size, 100)
+                            for task in range(tasks)]
+
+            record('test', config, time_runs(lambda state: model.test(test_loaders, 0, args), benchmark_args.repeats))
+
+    return results
+
+
+# identifies the same benchmark and configuration across runs
+def result_key(result):
+
+    return tuple(sorted((k, v) for k, v in result.items() if k not in ('median_s', 'min_s', 'repeats')))
+
+
+def compare(results, baseline_results):
+
+    baseline = {result_key(result): result for result in baseline_results}
+
+    print('\nCHANGE RELATIVE TO BASELINE (median time, < 1 is faster):\n')
+
+    for result in results:
+        old = baseline.get(result_key(result))
+
+        if old is None or old['median_s'] == 0:
+            continue
+
+        print('{:<30} {:<60} {:.3f}x'.format(
+            result['benchmark'],
+            ', '.join('{}={}'.format(k, v) for k, v in result_key(result) if k != 'benchmark'),
+            result['median_s'] / old['median_s']))
+
+
+def main():
+
+    benchmark_args = parse_arguments()
+
+    torch.manual_seed(benchmark_args.seed)
+    torch.set_num_threads(benchmark_args.threads)
+
+    results = run_benchmarks(benchmark_args)
+
+    output = {
+        'metadata': {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'threads': benchmark_args.threads,
+            'seed': benchmark_args.seed
+        },
+        'results': results
+    }
+
+    with open(benchmark_args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+
+    print('\nresults written to {}'.format(benchmark_args.output))
+
+    if benchmark_args.baseline:
+        with open(benchmark_args.baseline) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+import math
+import torch
+import torch.nn.functional as F
+from ExpandableModel import ExpandableModel
+
+
+# Fisher strategies- each computes, for a chunk of n samples (data and labels already prepared for the model), the sum
+# over the chunk of the squared log likelihood gradient terms whose average over all samples is the estimated Fisher
+# diagonal (as a list of tensors in the same order as model.parameters()).
+#
+# 'sampled' (the default, as in estimate_fisher()): the gradient of the log likelihood of a class sampled from the
+# network's output distribution, squared, for each sample. This is the exact Fisher diagonal in expectation.
+#   cost: one forward pass over the chunk and n backward passes (one per sample)
+def sampled_fisher_terms(model, data, target, args):
+
+    softmax_activations = F.softmax(model(data), dim=-1)
+
+    class_indices = torch.multinomial(softmax_activations, 1)
+
+    return per_sample_squared_gradients(model, torch.log(softmax_activations.gather(1, class_indices)).view(-1))
+
+
+# 'empirical': as 'sampled', but using the log likelihood of each sample's true label (the "empirical Fisher").
+#   cost: one forward pass over the chunk and n backward passes (one per sample)
+def empirical_fisher_terms(model, data, target, args):
+
+    log_softmax_activations = F.log_softmax(model(data), dim=-1)
+
+    return per_sample_squared_gradients(model, log_softmax_activations.gather(1, target.view(-1, 1)).view(-1))
+
+
+# 'minibatch': the gradient of the SUMMED log likelihood of the true labels over each mini-batch of
+# args.fisher_batch_size samples, squared. Near a minimum of the loss the per-sample gradients have (close to) zero
+# mean, so the expected square of their sum over b samples is b times the Fisher diagonal- the squared sum therefore
+# stands in for the b per-sample terms of its mini-batch. This ignores the (non-zero) mean of the gradients and the
+# covariance between samples, trading accuracy for speed.
+#   cost: one forward pass over the chunk and ceil(n / args.fisher_batch_size) backward passes
+def minibatch_fisher_terms(model, data, target, args):
+
+    log_softmax_activations = F.log_softmax(model(data), dim=-1)
+
+    log_likelihoods = log_softmax_activations.gather(1, target.view(-1, 1)).view(-1)
+
+    batch_log_likelihoods = [torch.sum(log_likelihoods[start:start + args.fisher_batch_size])
+                             for start in range(0, len(log_likelihoods), args.fisher_batch_size)]
+
+    return per_sample_squared_gradients(model, batch_log_likelihoods)
+
+
+FISHER_STRATEGIES = {
+    'sampled': sampled_fisher_terms,
+    'empirical': empirical_fisher_terms,
+    'minibatch': minibatch_fisher_terms
+}
+
+
+# sum of the squared gradients of each of the given log likelihoods with respect to the model's parameters
+def per_sample_squared_gradients(model, log_likelihoods):
+
+    fisher_terms = [torch.zeros(tuple(parameter.size())).to(model.device) for parameter in model.parameters()]
+
+    for loglikelihood in log_likelihoods:
+
+        loglikelihood_grads = torch.autograd.grad(loglikelihood, model.parameters(), retain_graph=True)
+
+        for fisher_term, gradient in zip(fisher_terms, loglikelihood_grads):
+            fisher_term.add_(torch.pow(gradient, 2.0))
+
+    return fisher_terms
+
+
+# Estimate the diagonal of the Fisher Information Matrix of model (as a list of tensors of the same dimensions and in
+# the same order as model.parameters()) from the data in validation_loader, using the given strategy (see above).
+#
+# If args.adaptive_fisher is set, only as many samples are used as are needed for the estimate to converge: samples
+# are processed in chunks of args.fisher_chunk_size, and after each chunk the relative change in the running estimate,
+# sum(|F_new - F_old|) / sum(|F_new|), is computed- estimation stops once it is below args.fisher_tolerance, as long
+# as at least args.fisher_min_samples samples have been used. No more than args.fisher_max_samples samples are used
+# (0 for no limit other than the size of the validation data). Otherwise, all of the validation data is used.
+#
+# Returns the estimated Fisher diagonals and the number of samples used to estimate them.
+def estimate_fisher_diagonals(model, validation_loader, args, strategy='sampled'):
+
+    fisher_terms = FISHER_STRATEGIES.get(strategy)
+
+    if fisher_terms is None:
+        raise ValueError("Invalid Fisher strategy: {} (valid strategies: {})\n".format(
+            strategy, ", ".join(FISHER_STRATEGIES.keys())))
+
+    adaptive = args.adaptive_fisher
+
+    max_samples = args.fisher_max_samples if adaptive and args.fisher_max_samples > 0 else math.inf
+
+    chunks = ExpandableModel.evaluation_batches(validation_loader, args.fisher_chunk_size) if adaptive \
+        else validation_loader
+
+    fisher_sums = [torch.zeros(tuple(parameter.size())).to(model.device) for parameter in model.parameters()]
+
+    previous_estimate = None
+
+    sample_count = 0
+
+    for data, target in chunks:
+
+        if max_samples < math.inf:
+            data, target = data[:max_samples - sample_count], target[:max_samples - sample_count]
+
+        data, target = model.prepare_batch(data, target)
+
+        for fisher_sum, fisher_term in zip(fisher_sums, fisher_terms(model, data, target, args)):
+            fisher_sum.add_(fisher_term)
+
+        sample_count += len(target)
+
+        if sample_count >= max_samples:
+            break
+
+        if not adaptive:
+            continue
+
+        estimate = [fisher_sum / sample_count for fisher_sum in fisher_sums]
+
+        if previous_estimate is not None and sample_count >= args.fisher_min_samples:
+
+            change = sum(torch.sum(torch.abs(new - old)) for new, old in zip(estimate, previous_estimate))
+            total = sum(torch.sum(torch.abs(new)) for new in estimate)
+
+            if change.item() <= args.fisher_tolerance * total.item():
+                break
+
+        previous_estimate = estimate
+
+    if sample_count == 0:
+        raise ValueError("no validation data available for Fisher estimation\n")
+
+    return [fisher_sum / sample_count for fisher_sum in fisher_sums], sample_count
+
+
+# K-FAC (Kronecker-factored approximate curvature, see https://arxiv.org/abs/1503.05671) approximation of the Fisher for
+# the linear layers returned by model.kfac_layers(). For a layer with weights W (out x in) and biases b, the Fisher of
+# [W b] is approximated by the Kronecker product A (x) G of
+#
+#   A = E[a a^T]     ((in + 1) x (in + 1)), where a is the layer's input with a 1 appended (for the bias)
+#   G = E[g g^T]     (out x out), where g is the gradient of the log likelihood with respect to the layer's output
+#
+# which, unlike the Fisher diagonal, captures correlations between the weights of the layer. The two factors take
+# (in + 1)^2 + out^2 values per task, and the K-FAC layers need no EWC sums (3 * in * out values)- which is smaller
+# overall depends on the shapes of the layers and the number of tasks.
+#
+# As in sampled_fisher_terms(), log likelihoods are those of classes sampled from the network's output distribution.
+# Because each sample's log likelihood only depends on its own layer outputs, the per-sample gradients g for a whole
+# batch come from a single backward pass of the batch's summed log likelihood.
+#
+# Returns a list with one (A, G) pair per layer in model.kfac_layers(), at the (active) sizes of the layers.
+def estimate_kfac_factors(model, validation_loader):
+
+    layers = model.kfac_layers()
+
+    layer_inputs = {}
+    layer_output_grads = {}
+
+    def record_input_and_output_grad(module, input, output):
+        layer_inputs.update({module: input[0].detach()})
+        output.register_hook(lambda grad: layer_output_grads.update({module: grad.detach()}))
+
+    hooks = [layer.register_forward_hook(record_input_and_output_grad) for layer in layers]
+
+    input_factors = [0] * len(layers)
+    output_grad_factors = [0] * len(layers)
+
+    sample_count = 0
+
+    for data, target in validation_loader:
+
+        data, target = model.prepare_batch(data, target)
+
+        softmax_activations = F.softmax(model(data), dim=-1)
+
+        class_indices = torch.multinomial(softmax_activations, 1)
+
+        loglikelihood = torch.sum(torch.log(softmax_activations.gather(1, class_indices)))
+
+        # only needed to trigger the hooks recording the gradients of the layers' outputs
+        torch.autograd.grad(loglikelihood, [layer.weight for layer in layers])
+
+        for layer_index, layer in enumerate(layers):
+
+            inputs = layer_inputs.get(layer)
+            inputs = torch.cat((inputs, torch.ones(len(inputs), 1, device=inputs.device)), 1)
+
+            output_grads = layer_output_grads.get(layer)
+
+            input_factors[layer_index] += torch.mm(inputs.t(), inputs)
+            output_grad_factors[layer_index] += torch.mm(output_grads.t(), output_grads)
+
+        sample_count += len(target)
+
+    for hook in hooks:
+        hook.remove()
+
+    if sample_count == 0:
+        raise ValueError("no validation data available for Fisher estimation\n")
+
+    return [(input_factor / sample_count, output_grad_factor / sample_count)
+            for input_factor, output_grad_factor in zip(input_factors, output_grad_factors)]
+
+
+# indices (in model.parameters()) of the weights and biases of the layers in model.kfac_layers()
+def kfac_parameter_indices(model):
+
+    kfac_parameters = set()
+
+    for layer in model.kfac_layers():
+        kfac_parameters.update({id(layer.weight), id(layer.bias)})
+
+    return {index for index, parameter in enumerate(model.parameters()) if id(parameter) in kfac_parameters}
+
+
+# The EWC loss on previous tasks (before multiplication by lambda / 2) for the layers in model.kfac_layers(), given
+# {task number: K-FAC factors estimated after training on the task} and the post-training weights for each task.
+#
+# For each previous task and layer, with D = [W - W_task, b - b_task], this is the factored quadratic form
+#   vec(D)^T (A (x) G) vec(D) = sum((G D A) * D)
+#
+# Expansion: the factors are kept at the size of the layer when the task was trained, and applied to the corresponding
+# (upper-left) block of the layer's current weights- exactly what growing the factors by padding them with zeros would
+# give (weights added by an expansion are unconstrained by earlier tasks), without storing the padding.
+def kfac_loss_prev_tasks(model, task_kfac_factors, task_post_training_weights, task_number):
+
+    parameter_indices = {id(parameter): index for index, parameter in enumerate(model.parameters())}
+
+    loss_prev_tasks = 0
+
+    for task, factors in task_kfac_factors.items():
+
+        # the factors for the task being trained may remain from before an expansion- they are re-estimated once
+        # training on the task has finished
+        if task >= task_number:
+            continue
+
+        old_weights = task_post_training_weights.get(task)
+
+        for layer, (input_factor, output_grad_factor) in zip(model.kfac_layers(), factors):
+
+            out_size, in_size = len(output_grad_factor), len(input_factor) - 1
+
+            # (in the same column order as the current weights, which are permuted while training on a task in
+            # permutation-in-weights mode, along with the input factors- see EWCMLP.permute_input_weights())
+            old_weight = model.align_stored_weights(layer.weight, old_weights[parameter_indices.get(id(layer.weight))])
+            old_bias = old_weights[parameter_indices.get(id(layer.bias))]
+
+            difference = torch.cat((
+                layer.weight[:out_size, :in_size] - old_weight[:out_size, :in_size],
+                (layer.bias[:out_size] - old_bias[:out_size]).view(-1, 1)
+            ), 1)
+
+            loss_prev_tasks += torch.sum(torch.mm(torch.mm(output_grad_factor, difference), input_factor) * difference)
+
+    return loss_prev_tasks
+
+
+# Sparse EWC penalty (see setup.py --sparse-fisher-fraction and --sparse-fisher-threshold). The Fisher mass of a trained
+# network is typically concentrated in a small fraction of its weights, so the penalty can be restricted to the weights
+# that matter: those whose accumulated Fisher (sum_Fx) is greater than threshold, or among the top fraction of
+# accumulated Fisher values over all of the given parameters (0 to disable either criterion). Weights with no Fisher
+# information are never kept.
+#
+# The dense sums are left as they are (they go on accumulating the Fisher of later tasks, which may make other weights
+# important), and the weights to keep are re-selected from them each time they are updated.
+#
+# Returns {parameter index: (parameter shape, flat indices of the kept weights, sum_Fx at the kept weights, sum_Fx_Wx at
+# the kept weights, total of sum_Fx_Wx_sq over the kept weights)} for each index in parameter_indices.
+def sparsify_ewc_sums(sum_Fx, sum_Fx_Wx, sum_Fx_Wx_sq, parameter_indices, fraction=0, threshold=0):
+
+    parameter_indices = sorted(parameter_indices)
+
+    importances = [sum_Fx[parameter_index].float().reshape(-1) for parameter_index in parameter_indices]
+
+    cutoff = math.inf
+
+    if fraction > 0 and importances:
+        all_importances = torch.cat(importances)
+
+        k = min(len(all_importances), max(1, int(math.ceil(fraction * len(all_importances)))))
+
+        cutoff = torch.topk(all_importances, k, sorted=False)[0].min().item()
+
+    threshold = threshold if threshold > 0 else math.inf
+
+    sparse_ewc_sums = {}
+
+    for parameter_index, importance in zip(parameter_indices, importances):
+
+        kept = torch.nonzero((importance > 0) & ((importance >= cutoff) | (importance > threshold))).view(-1)
+
+        sparse_ewc_sums.update({parameter_index: (
+            tuple(sum_Fx[parameter_index].size()),
+            kept,
+            sum_Fx[parameter_index].reshape(-1)[kept],
+            sum_Fx_Wx[parameter_index].reshape(-1)[kept],
+            torch.sum(sum_Fx_Wx_sq[parameter_index].reshape(-1)[kept], dtype=torch.float32)
+        )})
+
+    return sparse_ewc_sums
+
+
+# The EWC loss on previous tasks (before multiplication by lambda / 2) for a parameter, over only the weights kept by
+# sparsify_ewc_sums()- both the penalty and its gradient (zero for every other weight) take time proportional to the
+# number of kept weights rather than to the size of the parameter.
+def sparse_ewc_loss(parameter, sparse_sums):
+
+    shape, kept, Fx, Fx_Wx, Fx_Wx_sq = sparse_sums
+
+    weights = parameter.view(-1).index_select(0, kept)
+
+    return torch.sum(torch.pow(weights, 2.0) * Fx) - 2 * torch.sum(weights * Fx_Wx) + Fx_Wx_sq
+
+
+# Map flat indices into a tensor of old_shape to the flat indices of the same elements in new_shape, where the tensor
+# has been expanded by padding each dimension at the end (as in expand_ewc_sums())
+def remap_flat_indices(indices, old_shape, new_shape):
+
+    remapped = torch.zeros_like(indices)
+
+    remaining = indices
+    stride = 1
+
+    for dimension in reversed(range(len(old_shape))):
+
+        remapped += (remaining % old_shape[dimension]) * stride
+
+        remaining = remaining // old_shape[dimension]
+        stride *= new_shape[dimension]
+
+    return remapped
+
+
+# remap the kept weights of sparse EWC sums (see sparsify_ewc_sums()) to the parameters of an expanded model- the
+# weights added by the expansion have no Fisher information, so the same weights are kept
+def expand_sparse_ewc_sums(sparse_ewc_sums, model):
+
+    parameters = list(model.parameters())
+
+    for parameter_index, (shape, kept, Fx, Fx_Wx, Fx_Wx_sq) in sparse_ewc_sums.items():
+
+        new_shape = tuple(parameters[parameter_index].size())
+
+        if new_shape != shape:
+            sparse_ewc_sums.update({parameter_index: (
+                new_shape, remap_flat_indices(kept, shape, new_shape), Fx, Fx_Wx, Fx_Wx_sq)})
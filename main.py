@@ -1,5 +1,6 @@
 import torch
 import utils
+import memory_utils
 import setup
 from EWCCNN import EWCCNN
 from EWCMLP import EWCMLP
@@ -9,7 +10,14 @@ import numpy as np
 import scipy as sp
 import h5py
 import random
+import os
 from Continuum import Continuum
+from TestSetCache import TestSetCache
+from TaskPrefetcher import TaskPrefetcher
+from AsyncEvaluator import AsyncEvaluator
+from ConcurrentTrainer import ConcurrentTrainer
+from PhaseTimer import PhaseTimer
+from TaskProfiler import TaskProfiler
 # import matplotlib
 # matplotlib.use('Agg')
 import matplotlib.pyplot as plt
@@ -82,6 +90,22 @@ def main():
 
     files, expansions, avg_acc, task_acc, h5file = setup.setup_h5_file(args, models)
 
+    # time spent in each phase of the run per task (--time-phases)- phases of the run as a whole (data generation and
+    # expansion) are timed by run_timer, and those of each model (training, testing, resetting) by the model's own timer
+    run_timer = PhaseTimer(args.time_phases, device)
+
+    for model in models:
+        model.set_phase_timer(PhaseTimer(args.time_phases, device))
+
+    # each model's profiles are named after its results file
+    for model, f in zip(models, files):
+        model.set_task_profiler(TaskProfiler(args.profile_dir, os.path.splitext(os.path.basename(f.filename))[0], device,
+                                             args.profile_wait, args.profile_warmup, args.profile_active))
+
+    phase_times = setup.setup_phase_time_datasets(args, files)
+
+    memory = setup.setup_memory_datasets(args, files)
+
     # metrics for measuring network strain- saved to h5 dataset later
 
     ### ALL OF THESE ARE EVALUATED BASED ON THE RUNNING SUMS OF THE FISHER INFO ###
@@ -95,27 +119,171 @@ def main():
     ewc_pen = [0, 0] # ewc penalty (loss on previous tasks only) is 0 for task 1 and 0 (filler)
 
     if args.dataset == "cifar":
-        train_loaders, validation_loaders, test_loaders = utils.generate_cifar_tasks(args, kwargs)
+        run_timer.set_task(1)
+
+        # the data for every task is generated up front- counted as data generation for the first task
+        with run_timer.span('data'):
+            train_loaders, validation_loaders, test_loaders = utils.generate_cifar_tasks(args, kwargs)
+
+    # permutation of the current task's input to be folded into the networks' weights (--permute-in-weights only)
+    input_permutation = None
+
+    # permutation applied to the current task's data (permuted mnist only)- None if the task's data is not permuted
+    data_permutation = None
+
+    # generates the data for a (permuted mnist) task, from the given sources of random numbers
+    def generate_mnist_task(task_number, generator, random_state):
+
+        generate = utils.generate_new_mnist_permutation_task if args.permute_in_weights \
+            else utils.generate_permuted_mnist_task
+
+        return generate(args, kwargs, task_number == 1, generator, random_state)
+
+    task_prefetcher = TaskPrefetcher(generate_mnist_task, args.tasks, args.seed) \
+        if args.prefetch_tasks and args.dataset != "cifar" else None
+
+    # tests models whose results are not needed to decide whether to expand them in the background (--async-eval)
+    async_evaluator = AsyncEvaluator(device) if args.async_eval else None
+
+    # write the test results of a model evaluated in the background (on all tasks up to and including task) to the
+    # results file
+    def record_async_results(results):
+
+        for (model_num, task), test_results in results:
+            task_acc[model_num][:len(test_results)] = np.array(test_results)[...]
+            avg_acc[model_num][task] = sum(test_results) / task
+
+    # write the time spent in each phase during every task so far to the results files (--time-phases)
+    def record_phase_times():
+
+        for model_num, model in enumerate(models):
+            for phase, phase_time in phase_times[model_num].items():
+                phase_time[...] = np.array([run_timer.total(task, phase) + model.phase_timer.total(task, phase)
+                                            for task in range(args.tasks + 1)])
+
+    # measure the memory held by each model (and the test set cache) after an attempt at a task, writing it to the
+    # results files (--record-memory) and/or printing it (--print-memory)
+    def record_memory(task):
+
+        if not (args.record_memory or args.print_memory):
+            return
+
+        for model_num, model in enumerate(models):
+
+            report = memory_utils.memory_report(model, test_set_cache)
+
+            for category, category_bytes in memory[model_num].items():
+                category_bytes[task] = report.get(category)
+
+            if args.print_memory:
+                memory_utils.print_memory_report(model, task, report)
+
+    # minimum accuracy model must reach on the latest task for the network not to be expanded
+    def accuracy_threshold(model):
+
+        return 0 if isinstance(model, (VanillaMLP, VanillaCNN)) else args.accuracy_threshold
+
+    # models with an accuracy threshold of 0 are tested in the background with --async-eval
+    def tested_in_background(model):
+
+        return async_evaluator is not None and accuracy_threshold(model) == 0
+
+    # the keyword arguments passed to model.train_model() and model.finish_task() for the current task
+    def task_args(model):
+
+        train_args = {'validation_loader': validation_loader,
+                      'fisher_total': fisher_total,
+                      'post_training_loss': post_training_loss,
+                      'fisher_average': fisher_average,
+                      'fisher_st_dev': fisher_st_dev,
+                      'fisher_max': fisher_max,
+                      'fisher_information': fisher_information,
+                      'h5file': h5file,
+                      'ewc_pen': ewc_pen
+                    } \
+        if isinstance(model, (EWCMLP, EWCCNN)) else {}
+
+        # every model marks the run as failed if its training diverges (see ExpandableModel.record_failure())
+        train_args.update({'input_permutation': input_permutation, 'failure': failure})
+
+        return train_args
+
+    # Train model on the current task, then test it on ALL tasks trained thus far (including the current task) unless
+    # it is to be tested in the background. Returns the test results (see ExpandableModel.test()), or None if the model
+    # was not tested.
+    #
+    # If defer is set, consolidating the task and recording its metrics (or the failure of the model) is left to
+    # model.finish_task()- see ExpandableModel.train_model().
+    def train_and_test(model, defer=False):
+
+        # for each desired epoch, train the model on the latest task
+        model.train_model(args, train_loader, task_count, defer=defer, **task_args(model))
+
+        if model.training_monitor.diverged or tested_in_background(model):
+            return None
+
+        with model.phase_timer.span('test'), model.task_profiler.capture('test'):
+            return model.test(prev_test_loaders, accuracy_threshold(model), args)
+
+    # trains the models on each task at the same time (--concurrent-nets)
+    concurrent_trainer = ConcurrentTrainer(device, len(models)) if args.concurrent_nets else None
+
+    test_set_cache = TestSetCache(device, args.test_batch_size, args.test_cache_budget * 2**20) \
+        if args.cache_test_sets else None
 
     while task_count < (args.tasks + 1) :
 
         torch.cuda.empty_cache() # free any available gpu memory
 
-        if not retrain_task:
+        run_timer.set_task(task_count)
+
+        for model in models:
+            model.phase_timer.set_task(task_count)
 
-            if args.dataset == "cifar":
-                train_loader = train_loaders[task_count - 1]
-                validation_loader = validation_loaders[task_count - 1]
-                test_loader = test_loaders[task_count - 1]
+            # --profile-tasks, or the retraining of a task after an expansion (--profile-after-expansion)
+            if task_count in args.profile_tasks or (retrain_task and args.profile_after_expansion):
+                model.task_profiler.begin(task_count, model.hidden_size)
 
-                # todo remove- just for testing CNNs
-                #train_loader, test_loader = utils.generate_1_cifar10_task(args)
+        if async_evaluator is not None:
+            record_async_results(async_evaluator.completed())
+
+        if not retrain_task:
 
-            else:# todo add this to the arg parser
-                # get the DataLoaders for the training, validation, and testing data
-                train_loader, validation_loader, test_loader = utils.generate_new_mnist_task(args, kwargs,
-                    first_task=(task_count == 1)
-                )
+            # time spent preparing (or waiting for the background preparation of) the task's data
+            with run_timer.span('data'):
+
+                if args.dataset == "cifar":
+                    train_loader = train_loaders[task_count - 1]
+                    validation_loader = validation_loaders[task_count - 1]
+                    test_loader = test_loaders[task_count - 1]
+
+                    # todo remove- just for testing CNNs
+                    #train_loader, test_loader = utils.generate_1_cifar10_task(args)
+
+                elif task_prefetcher is not None:
+                    # the data for this task has been prepared in the background while the previous task was trained
+                    train_loader, validation_loader, test_loader, permutation = task_prefetcher.next_task()
+
+                    if args.permute_in_weights:
+                        input_permutation = permutation
+                    else:
+                        data_permutation = permutation
+
+                elif args.permute_in_weights:
+                    # get the DataLoaders for the (unpermuted) training, validation, and testing data, along with the
+                    # permutation defining the task- it is applied to the networks' weights rather than to the data
+                    train_loader, validation_loader, test_loader, input_permutation = \
+                        utils.generate_new_mnist_permutation_task(args, kwargs, first_task=(task_count == 1))
+
+                else:# todo add this to the arg parser
+                    # get the DataLoaders for the training, validation, and testing data, and the permutation applied to
+                    # the data for this task
+                    train_loader, validation_loader, test_loader, data_permutation = \
+                        utils.generate_permuted_mnist_task(args, kwargs, first_task=(task_count == 1))
+
+                # read the task's test data onto the device once, rather than re-loading it every time a model is tested
+                if test_set_cache is not None:
+                    test_loader = test_set_cache.add_task(test_loader, data_permutation)
     
             # add the new test_loader for this task to the list of testing dataset DataLoaders for later re-use
             # to evaluate how well the models retain accuracy on old tasks after learning new ones
@@ -135,45 +303,65 @@ def main():
 
         retrain_task = False
 
+        # numbers of the models being tested on this task in the background
+        background_tests = set()
+
+        # With --concurrent-nets, every model is trained and tested on the task at once, and the results are then
+        # handled in the order of the models, as they would have been had the models been trained one after another.
+        # Each model's consolidation of the task and recording of its metrics (which append to the metric lists shared
+        # by the models) is deferred until then, so that it is done in the same order as in a sequential run- and not
+        # at all for the models after one which must be expanded, as these would not yet have been trained.
+        concurrent_results = concurrent_trainer.run(lambda model: train_and_test(model, defer=True), models) \
+            if concurrent_trainer is not None else None
+
         for model_num, model in enumerate(models):
-            train_args = {'validation_loader': validation_loader,
-                          'failure': failure,
-                          'fisher_total': fisher_total,
-                          'post_training_loss': post_training_loss,
-                          'fisher_average': fisher_average,
-                          'fisher_st_dev': fisher_st_dev,
-                          'fisher_max': fisher_max,
-                          'fisher_information': fisher_information,
-                          'h5file': h5file,
-                          'ewc_pen': ewc_pen
-                        } \
-            if isinstance(model, (EWCMLP, EWCCNN)) else {}
-
-            # for each desired epoch, train the model on the latest task
-            model.train_model(args, train_loader, task_count, **train_args)
-
-            threshold = 0 if isinstance(model, (VanillaMLP, VanillaCNN)) else args.accuracy_threshold
-
-            # test the model on ALL tasks trained thus far (including current task)
-            test_results = model.test(prev_test_loaders, threshold, args)
+
+            if concurrent_results is not None:
+                test_results = concurrent_results[model_num]
+
+                model.finish_task(args, task_count, deferred=True, **task_args(model))
+
+            else:
+                test_results = train_and_test(model)
+
+            # the network failed (training diverged) on this task- metrics have been saved, so end the run
+            if failure[0] != 0:
+                break
+
+            # the test results only need to be written to the results file, so go on training without waiting for them
+            if tested_in_background(model):
+                # only the time taken to hand the model over is counted- the test itself runs in the background
+                with model.phase_timer.span('test'):
+                    async_evaluator.submit(model, prev_test_loaders, args, (model_num, task_count))
+                background_tests.add(model_num)
+                continue
 
             if test_results == -1:
-                print(len(ewc_pen))
                 if len(ewc_pen) > 2:
                     del ewc_pen[-1] # if expanding, we want to rewrite this or it will be inaccurate
-                print(len(ewc_pen))
                 retrain_task = True
                 break
 
             else:
                 task_acc[model_num][:len(test_results)] = np.array(test_results)[...]
 
+        for model in models:
+            model.task_profiler.end()
+
+        record_memory(task_count)
+
+        if failure[0] != 0:
+            print("|-----[NETWORK FAILED ON TASK {}- ENDING RUN]-----|\n".format(failure[0]))
+            break
+
         if retrain_task:
 
             for model in models:
-                model.reset(task_count - 1)
+                with model.phase_timer.span('reset'):
+                    model.reset(task_count - 1)
 
-            models = utils.expand(models, args)
+            with run_timer.span('expand'):
+                models = utils.expand(models, args)
 
             for model_num in range(len(models)):
                 expansions[model_num][task_count] += 1
@@ -182,15 +370,37 @@ def main():
 
         else:
             for model_num in range(len(models)):
+
+                # average accuracies of models being tested in the background are recorded with their test results
+                if model_num in background_tests:
+                    continue
+
                 avg_acc[model_num][task_count] = sum(task_acc[model_num]) / task_count
 
             # increment the number of the current task before re-entering while loop
             task_count += 1
 
+        record_phase_times()
+
         for f in files:
             f.flush()
 
 
+    if task_prefetcher is not None:
+        task_prefetcher.close()
+
+    # wait for any tests still running in the background, and record their results
+    if async_evaluator is not None:
+        record_async_results(async_evaluator.completed(block=True))
+
+        async_evaluator.close()
+
+    if concurrent_trainer is not None:
+        concurrent_trainer.close()
+
+    # includes the phases of a task on which the run ended early
+    record_phase_times()
+
     for f in files:
 
         print("|-----[", f.filename, "]-----|", '\n')
@@ -0,0 +1,82 @@
+import os
+import resource
+import torch
+
+
+# Memory accounting for the per-task state that accumulates over a run (see setup.py --record-memory and
+# --print-memory). Each category is the number of bytes held, after training on a task, by:
+#
+#   parameters            - the network's parameters (at its current, possibly expanded, size)
+#   ewc_sums              - the running EWC sums (sum_Fx, sum_Fx_Wx, sum_Fx_Wx_sq) and their sparse versions
+#   fisher_diags          - the stored Fisher diagonals (and K-FAC factors) of every task, and those of the latest task
+#   post_training_weights - the snapshots of the network's weights after training on each task
+#   replay_buffer         - the samples held in the model's replay buffer (on the device, or in a memory-mapped file)
+#   test_cache            - the test data of previous tasks held in the TestSetCache (shared by all of the models)
+#   process_rss           - the resident set size of the Python process (host memory)
+#   device_allocated      - the memory allocated by tensors on the GPU (0 on the CPU)
+#   device_peak           - the maximum memory allocated by tensors on the GPU so far in the run (0 on the CPU)
+memory_categories = ['parameters', 'ewc_sums', 'fisher_diags', 'post_training_weights', 'replay_buffer', 'test_cache',
+                     'process_rss', 'device_allocated', 'device_peak']
+
+
+# total bytes of the tensors in value, which may be a tensor or any nesting of dictionaries, lists and tuples of them
+# (other values, such as the shapes stored with sparse EWC sums, hold no tensor data and count as 0)
+def tensor_bytes(value):
+
+    if torch.is_tensor(value):
+        return value.numel() * value.element_size()
+
+    if isinstance(value, dict):
+        return sum(tensor_bytes(v) for v in value.values())
+
+    if isinstance(value, (list, tuple)):
+        return sum(tensor_bytes(v) for v in value)
+
+    return 0
+
+
+def replay_buffer_bytes(replay_buffer):
+
+    if replay_buffer is None or replay_buffer.data is None:
+        return 0
+
+    return tensor_bytes([replay_buffer.data, replay_buffer.offsets, replay_buffer.scales, replay_buffer.targets])
+
+
+# resident set size of the process in bytes- read from /proc where available, otherwise the peak resident set size
+# reported by getrusage() (in KB on Linux)
+def process_rss():
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# {category: bytes} for model (and the shared test_set_cache, which may be None), see memory_categories
+def memory_report(model, test_set_cache=None):
+
+    on_gpu = model.device.type == 'cuda'
+
+    return {
+        'parameters': tensor_bytes(list(model.parameters())),
+        'ewc_sums': tensor_bytes([getattr(model, name, None) for name in
+                                  ['sum_Fx', 'sum_Fx_Wx', 'sum_Fx_Wx_sq', 'sparse_ewc_sums']]),
+        'fisher_diags': tensor_bytes([getattr(model, name, None) for name in
+                                      ['task_fisher_diags', 'task_kfac_factors', 'list_of_fisher_diags']]),
+        'post_training_weights': tensor_bytes(model.task_post_training_weights),
+        'replay_buffer': replay_buffer_bytes(model.replay_buffer),
+        'test_cache': test_set_cache.used if test_set_cache is not None else 0,
+        'process_rss': process_rss(),
+        'device_allocated': torch.cuda.memory_allocated(model.device) if on_gpu else 0,
+        'device_peak': torch.cuda.max_memory_allocated(model.device) if on_gpu else 0
+    }
+
+
+def print_memory_report(model, task_number, report):
+
+    print('{} Task: {} MEMORY (MB): {}'.format(
+        model.log_label, task_number,
+        ', '.join('{} {:.2f}'.format(category, report.get(category) / 2**20) for category in memory_categories)))
@@ -1,6 +1,7 @@
 import math
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.nn.functional import relu, avg_pool2d
 
 
@@ -70,4 +71,114 @@ class ResNet(nn.Module):
 
 
 def ResNet18(nclasses, nf=20):
-    return ResNet(BasicBlock, [2, 2, 2, 2], nclasses, nf)
\ No newline at end of file
+    return ResNet(BasicBlock, [2, 2, 2, 2], nclasses, nf)
+
+
+# initialize (uniformly in [-bound, bound]) the entries of weight that become active when the active region of the weight
+# grows from [:old_out, :old_in] to [:out_features, :in_features] (in the first two dimensions)
+def init_grown_region(weight, old_out, old_in, out_features, in_features, bound):
+
+    with torch.no_grad():
+        # newly active output rows (across all active inputs)...
+        weight[old_out:out_features, :in_features].uniform_(-bound, bound)
+
+        # ...and newly active input columns of the previously active output rows
+        weight[:old_out, old_in:in_features].uniform_(-bound, bound)
+
+
+# nn.Linear allocated at its maximum size, of which only the first in_active inputs and out_active outputs are used.
+# Growing the layer only moves these boundaries (and initializes the newly active weights)- nothing is reallocated.
+#
+# If xavier is True, active weights are initialized in the same manner as ExpandableModel.init_weights_xavier(),
+# otherwise in the same manner as the default initialization of nn.Linear.
+class ElasticLinear(nn.Linear):
+
+    def __init__(self, in_features, out_features, max_in_features, max_out_features, bias=True, xavier=False):
+
+        super(ElasticLinear, self).__init__(max_in_features, max_out_features, bias)
+
+        self.xavier = xavier
+
+        self.in_active = 0
+        self.out_active = 0
+
+        self.grow(in_features, out_features)
+
+    def forward(self, x):
+
+        bias = None if self.bias is None else self.bias[:self.out_active]
+
+        return F.linear(x, self.weight[:self.out_active, :self.in_active], bias)
+
+    def grow(self, in_features, out_features):
+
+        if in_features > self.in_features or out_features > self.out_features:
+            raise ValueError("cannot grow ElasticLinear to ({}, {}) beyond its maximum size ({}, {})\n".format(
+                in_features, out_features, self.in_features, self.out_features))
+
+        old_in, old_out = self.in_active, self.out_active
+
+        self.in_active, self.out_active = in_features, out_features
+
+        if self.xavier:
+            bound = math.sqrt(6.0 / (in_features + out_features))
+        else:
+            bound = 1.0 / math.sqrt(in_features)
+
+        init_grown_region(self.weight, old_out, old_in, out_features, in_features, bound)
+
+        if self.bias is not None:
+            with torch.no_grad():
+                if self.xavier:
+                    self.bias[old_out:out_features].fill_(0.1)
+                else:
+                    self.bias[old_out:out_features].uniform_(-bound, bound)
+
+    # re-initialize all active weights as in ExpandableModel.init_weights_xavier() (used for output layers)
+    def xavier_init_active(self):
+
+        bound = math.sqrt(6.0 / (self.in_active + self.out_active))
+
+        with torch.no_grad():
+            self.weight[:self.out_active, :self.in_active].uniform_(-bound, bound)
+
+            if self.bias is not None:
+                self.bias[:self.out_active].fill_(0.1)
+
+
+# nn.Conv2d allocated with its maximum number of input and output channels, of which only the first in_active input
+# channels and out_active filters are used (see ElasticLinear). Newly active weights are initialized in the same manner
+# as the default initialization of nn.Conv2d.
+class ElasticConv2d(nn.Conv2d):
+
+    def __init__(self, in_channels, out_channels, max_in_channels, max_out_channels, kernel_size, stride=1, padding=0):
+
+        super(ElasticConv2d, self).__init__(max_in_channels, max_out_channels, kernel_size, stride=stride,
+                                            padding=padding)
+
+        self.in_active = 0
+        self.out_active = 0
+
+        self.grow(in_channels, out_channels)
+
+    def forward(self, x):
+
+        return F.conv2d(x, self.weight[:self.out_active, :self.in_active], self.bias[:self.out_active], self.stride,
+                        self.padding, self.dilation, self.groups)
+
+    def grow(self, in_channels, out_channels):
+
+        if in_channels > self.in_channels or out_channels > self.out_channels:
+            raise ValueError("cannot grow ElasticConv2d to ({}, {}) beyond its maximum size ({}, {})\n".format(
+                in_channels, out_channels, self.in_channels, self.out_channels))
+
+        old_in, old_out = self.in_active, self.out_active
+
+        self.in_active, self.out_active = in_channels, out_channels
+
+        bound = 1.0 / math.sqrt(in_channels * self.kernel_size[0] * self.kernel_size[1])
+
+        init_grown_region(self.weight, old_out, old_in, out_channels, in_channels, bound)
+
+        with torch.no_grad():
+            self.bias[old_out:out_channels].uniform_(-bound, bound)
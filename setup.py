@@ -7,6 +7,11 @@ from VanillaMLP import VanillaMLP
 from VanillaCNN import VanillaCNN
 from EWCMLP import EWCMLP
 from EWCCNN import EWCCNN
+from GEMMLP import GEMMLP
+from GEMCNN import GEMCNN
+from ReplayBuffer import ReplayBuffer
+from PhaseTimer import PhaseTimer
+import memory_utils
 import h5py
 from pathlib import Path
 import subprocess
@@ -30,6 +35,13 @@ def parse_arguments():
     parser.add_argument('--test-batch-size', type=int, default=1000, metavar='TBS',
                         help='input batch size for testing')
 
+    # number of test samples evaluated at once when testing, independent of the batch size of the test data loaders
+    parser.add_argument('--eval-batch-size', type=int, default=0, metavar='EBS',
+                        help='batch size for evaluation on test data (default 0, chosen automatically)')
+
+    parser.add_argument('--eval-memory-ceiling', type=int, default=256, metavar='EMC',
+                        help='MB of device memory a batch may use when choosing the evaluation batch size (default 256)')
+
     parser.add_argument('--epochs', type=int, default=1, metavar='E',
                         help='number of epochs to train')
 
@@ -54,6 +66,16 @@ def parse_arguments():
     parser.add_argument('--log-interval', type=int, default=10, metavar='N',
                         help='how many batches to wait before logging training status (default 10)')
 
+    # training loss above which (or NaN/infinite training loss) the network is considered to have failed on a task
+    parser.add_argument('--divergence-threshold', type=float, default=1000, metavar='DT',
+                        help='training loss above which training is considered to have diverged (default 1000)')
+
+    parser.add_argument('--divergence-check-interval', type=int, default=10, metavar='DCI',
+                        help='how many batches between asynchronous divergence checks of the training loss (default 10)')
+
+    parser.add_argument('--divergence-patience', type=int, default=1, metavar='DP',
+                        help='number of consecutive failed divergence checks before training on a task is stopped (default 1)')
+
     # [train dataset size] = [full MNIST train set (60,000)] - [validation set size]
     parser.add_argument('--train-dataset-size', type=int, default=59800, metavar='TDS',
                         help='number of images in the training dataset')
@@ -61,10 +83,88 @@ def parse_arguments():
     parser.add_argument('--validation-dataset-size', type=int, default=200, metavar='VDS',
                         help='number of images in the validation dataset')
 
+    # if set, the Fisher diagonals are estimated from validation samples in chunks until the estimate converges, rather
+    # than from the whole validation dataset (which is the most that can be used- increase --validation-dataset-size
+    # to allow more samples)
+    parser.add_argument('--adaptive-fisher', action='store_true', default=False,
+                        help='estimate the Fisher diagonals from as many validation samples as needed to converge')
+
+    # approximation used to estimate the Fisher (see fisher_utils)- either one strategy for all EWC models, or
+    # one per entry in --nets (e.g. --nets EWCMLP EWCMLP --fisher-strategy sampled minibatch to compare two strategies)
+    parser.add_argument('--fisher-strategy', nargs='+', type=str, default=['sampled'], metavar='FS',
+                        help='Fisher estimation strategy per net: sampled, empirical, minibatch or kfac (default sampled)')
+
+    parser.add_argument('--fisher-batch-size', type=int, default=50, metavar='FBS',
+                        help='mini-batch size for the minibatch Fisher strategy (default 50)')
+
+    # if either is set, the EWC penalty only covers the weights with the largest accumulated Fisher values (those above the
+    # threshold, or in the top fraction over the whole network), so its cost scales with the number of important weights
+    parser.add_argument('--sparse-fisher-fraction', type=float, default=0, metavar='SFF',
+                        help='fraction of weights (by accumulated Fisher) kept in the EWC penalty (default 0, disabled)')
+
+    parser.add_argument('--sparse-fisher-threshold', type=float, default=0, metavar='SFT',
+                        help='accumulated Fisher value above which weights are kept in the EWC penalty (default 0, disabled)')
+
+    # GEM models (--nets GEMMLP/GEMCNN) keep training samples of each task in a replay buffer, and project each gradient
+    # so that it does not increase the loss on those of previous tasks (see GEMModel)
+    parser.add_argument('--gem-memory-strength', type=float, default=0.5, metavar='GMS',
+                        help='margin of the GEM gradient projection (default 0.5)')
+
+    parser.add_argument('--gem-mode', type=str, default='gem', choices=['gem', 'agem'], metavar='GMODE',
+                        help='gem: one constraint per previous task; agem: one constraint on all of them (default gem)')
+
+    parser.add_argument('--gem-refresh-interval', type=int, default=1, metavar='GRI',
+                        help='training steps between recomputations of the gradients on previous tasks (default 1)')
+
+    # the gradient on each previous task is computed from a random subset of its samples in the replay buffer, so its
+    # cost does not grow with the replay budget
+    parser.add_argument('--gem-memories', type=int, default=256, metavar='GM',
+                        help='samples of each previous task used to compute its gradient in GEM models (default 256)')
+
+    # replay buffer (see ReplayBuffer) used by GEM models and, if --replay-weight is set, for rehearsal by EWC models- its
+    # size is bounded by the budget however many tasks are trained
+    parser.add_argument('--replay-budget', type=int, default=16, metavar='RB',
+                        help='MB of stored samples in the replay buffer of each model (default 16)')
+
+    parser.add_argument('--replay-policy', type=str, default='ring', choices=['ring', 'reservoir'], metavar='RP',
+                        help='ring: equal share of recent samples per task; reservoir: uniform over all (default ring)')
+
+    parser.add_argument('--replay-mmap-dir', type=str, default='', metavar='RMD',
+                        help='keep replay buffers in memory-mapped files in this directory (default: on the device)')
+
+    parser.add_argument('--replay-weight', type=float, default=0, metavar='RW',
+                        help='weight of the rehearsal loss on replayed samples for EWC models (default 0, disabled)')
+
+    # dtype for the stored per-task state (post-training weights and Fisher diagonals)- bfloat16 halves its memory with
+    # the same range as float32, while float16 may flush very small Fisher values to zero. The running EWC sums are
+    # always kept in float32.
+    parser.add_argument('--storage-dtype', type=str, default='float32', choices=['float32', 'bfloat16', 'float16'],
+                        metavar='SD',
+                        help='dtype for the stored per-task weights and Fisher diagonals: float32, bfloat16 or '
+                             'float16 (default float32)- the running EWC sums read by the penalty always stay '
+                             'float32, so only the memory held by the per-task snapshots is reduced')
+
+    parser.add_argument('--fisher-tolerance', type=float, default=0.01, metavar='FT',
+                        help='relative change in the Fisher estimate per chunk below which it has converged (default 0.01)')
+
+    parser.add_argument('--fisher-chunk-size', type=int, default=25, metavar='FCS',
+                        help='number of samples added to the Fisher estimate between convergence checks (default 25)')
+
+    parser.add_argument('--fisher-min-samples', type=int, default=50, metavar='FMIN',
+                        help='minimum number of samples used for an adaptive Fisher estimate (default 50)')
+
+    parser.add_argument('--fisher-max-samples', type=int, default=0, metavar='FMAX',
+                        help='maximum number of samples used for an adaptive Fisher estimate (default 0, no limit)')
+
     # size of hidden layer in MLP in neurons OR initial number of filters in conv network
     parser.add_argument('--hidden-size', type=int, default=20, metavar='HS',
                         help='# neurons in each hidden layer of MLP OR # filters in conv resnet')
 
+    # if set, models are allocated at this hidden size (or number of filters) up front and only the part corresponding to
+    # the current hidden size is used, so that expansion up to this size does not rebuild the model
+    parser.add_argument('--max-hidden-size', type=int, default=0, metavar='MHS',
+                        help='elastic capacity: maximum hidden size/# filters to preallocate (default 0, disabled)')
+
     # 28 x 28 pixels = 784 pixels per MNIST image, 32 x 32 = 1024 for CIFAR 10
     parser.add_argument('--input-size', type=int, default=784, metavar='IS',
                         help='size of each input data sampe to the network (default 784 (28 * 28))')
@@ -105,6 +205,67 @@ def parse_arguments():
     parser.add_argument('--perm', type=int, default=100, metavar='PERM',
                         help='percent permutation to be applied to mnist images')
 
+    # if set, each task's test data is read once and kept on the device for all later evaluations (see TestSetCache)- the
+    # cached test sets are read in order rather than shuffled, so testing no longer draws from the global RNG and the
+    # training of later tasks differs from that of a run with the same seed without this flag
+    parser.add_argument('--cache-test-sets', action='store_true', default=False,
+                        help='keep the test data of previous tasks on the device rather than re-loading it for each test')
+
+    parser.add_argument('--test-cache-budget', type=int, default=1024, metavar='TCB',
+                        help='MB of device memory for materialized per-task test data when caching test sets (default 1024)')
+
+    # if set, the data for each permuted mnist task is generated and read into memory (see TaskPrefetcher) on a background
+    # thread while the previous task trains (from dedicated RNGs seeded with --seed, so the sequence of tasks differs from that generated without this flag)
+    parser.add_argument('--prefetch-tasks', action='store_true', default=False,
+                        help='prepare the next task\'s data in the background while the current task trains (mnist only)')
+
+    # if set, models with an accuracy threshold of 0 (never expanded) are tested in the background while training continues
+    parser.add_argument('--async-eval', action='store_true', default=False,
+                        help='test models that are not expanded based on accuracy in the background (see AsyncEvaluator)')
+
+    # if set, the images of every permuted mnist task are left unpermuted and the task's permutation is applied to the
+    # columns of the first layer's weights instead (equivalent, but avoids permuting every sample as it is loaded)
+    parser.add_argument('--permute-in-weights', action='store_true', default=False,
+                        help='apply mnist task permutations to the first layer weights of MLPs rather than to the data')
+
+    # if set, the time spent in each phase of the run (see PhaseTimer.phases) is accumulated per task and written to the
+    # results files alongside the accuracies
+    parser.add_argument('--time-phases', action='store_true', default=False,
+                        help='record the time spent generating data, training, estimating the Fisher, testing, etc. per task')
+
+    # if set, the memory held by each model's parameters and per-task state (see memory_utils.memory_categories), the
+    # test set cache and the process is measured after every task and written to the results files
+    parser.add_argument('--record-memory', action='store_true', default=False,
+                        help='record the memory held by parameters, EWC state, weight snapshots, etc. after each task')
+
+    parser.add_argument('--print-memory', action='store_true', default=False,
+                        help='print the memory held by parameters, EWC state, weight snapshots, etc. after each task')
+
+    # tasks on which training, consolidation (e.g. Fisher estimation) and testing are profiled with torch.profiler (see
+    # TaskProfiler)- the traces are written to --profile-dir
+    parser.add_argument('--profile-tasks', nargs='+', type=int, default=[], metavar='PT',
+                        help='numbers of the tasks to profile with torch.profiler (default none)')
+
+    parser.add_argument('--profile-after-expansion', action='store_true', default=False,
+                        help='profile the retraining of each task on which the networks were expanded')
+
+    parser.add_argument('--profile-wait', type=int, default=1, metavar='PW',
+                        help='training steps skipped before profiling starts on a profiled task (default 1)')
+
+    parser.add_argument('--profile-warmup', type=int, default=1, metavar='PWU',
+                        help='training steps traced but discarded before recording on a profiled task (default 1)')
+
+    parser.add_argument('--profile-active', type=int, default=5, metavar='PA',
+                        help='training steps recorded on a profiled task (default 5)')
+
+    parser.add_argument('--profile-dir', type=str, default='final/profiles', metavar='PD',
+                        help='directory to which profiler traces and operator tables are written (default final/profiles)')
+
+    # if set, the models in --nets are trained, consolidated and tested on each task at the same time, each on a worker
+    # thread of its own (see ConcurrentTrainer), rather than one after another
+    parser.add_argument('--concurrent-nets', action='store_true', default=False,
+                        help='train the models in --nets concurrently rather than one after another')
+
     args = parser.parse_args()
 
     if args.experiment == 'mnist':
@@ -137,10 +298,10 @@ def parse_arguments():
         args_dict = vars(args)
 
         for k in args_dict.keys():
-            if k != 'nets':
-                print("{:_<30}{:_>30}".format(k, args_dict.get(k)))
+            if not isinstance(args_dict.get(k), list):
+                print("{:_<30}{:_>30}".format(k, str(args_dict.get(k))))
             else:
-                print("{:_<30}{:_>30}".format(k, ", ".join(args_dict.get(k))))
+                print("{:_<30}{:_>30}".format(k, ", ".join(map(str, args_dict.get(k)))))
 
     elif args.experiment == 'cifar':
 
@@ -178,10 +339,10 @@ def parse_arguments():
         args_dict = vars(args)
 
         for k in args_dict.keys():
-            if k != 'nets':
-                print("{:_<30}{:_>30}".format(k, args_dict.get(k)))
+            if not isinstance(args_dict.get(k), list):
+                print("{:_<30}{:_>30}".format(k, str(args_dict.get(k))))
             else:
-                print("{:_<30}{:_>30}".format(k, ", ".join(args_dict.get(k))))
+                print("{:_<30}{:_>30}".format(k, ", ".join(map(str, args_dict.get(k)))))
 
     elif args.experiment == 'custom':
 
@@ -198,15 +359,36 @@ def parse_arguments():
         args_dict = vars(args)
 
         for k in args_dict.keys():
-            if k != 'nets':
-                print("{:_<30}{:_>30}".format(k, args_dict.get(k)))
+            if not isinstance(args_dict.get(k), list):
+                print("{:_<30}{:_>30}".format(k, str(args_dict.get(k))))
             else:
-                print("{:_<30}{:_>30}".format(k, ", ".join(args_dict.get(k))))
+                print("{:_<30}{:_>30}".format(k, ", ".join(map(str, args_dict.get(k)))))
 
     else:
 
         raise ValueError("Invalid experiment type selected: {}!\n".format(args.experiment))
 
+    if args.permute_in_weights and (args.dataset != 'mnist' or any('CNN' in net for net in args.nets)):
+        raise ValueError("--permute-in-weights is only supported for MLPs trained on mnist!\n")
+
+    # the replay buffer holds the data fed to the network, which is the same (unpermuted) data for every task when the
+    # permutations are folded into the weights
+    if args.permute_in_weights and (args.replay_weight > 0 or any(net.startswith('GEM') for net in args.nets)):
+        raise ValueError("--permute-in-weights is not supported for GEM models or with --replay-weight!\n")
+
+    if not 0 <= args.sparse_fisher_fraction <= 1:
+        raise ValueError("--sparse-fisher-fraction must be between 0 and 1!\n")
+
+    if any(not 1 <= task <= args.tasks for task in args.profile_tasks):
+        raise ValueError("--profile-tasks must be between 1 and the number of tasks ({})!\n".format(args.tasks))
+
+    # torch.profiler records the whole process, so the models' profiles would include each other's work
+    if args.concurrent_nets and (args.profile_tasks or args.profile_after_expansion):
+        raise ValueError("--concurrent-nets cannot be used when profiling tasks!\n")
+
+    if args.profile_wait < 0 or args.profile_warmup < 0 or args.profile_active < 1:
+        raise ValueError("--profile-wait and --profile-warmup must be at least 0, and --profile-active at least 1!\n")
+
     return args
 
 def seed_rngs(args):
@@ -248,7 +430,12 @@ def build_models(args, device):
 
     models = []
 
-    for net in args.nets:
+    if len(args.fisher_strategy) not in (1, len(args.nets)):
+        raise ValueError("--fisher-strategy must be given once, or once per net in --nets\n")
+
+    for net_index, net in enumerate(args.nets):
+
+        fisher_strategy = args.fisher_strategy[net_index if len(args.fisher_strategy) > 1 else 0]
 
         if net == "VanillaMLP":
 
@@ -257,6 +444,7 @@ def build_models(args, device):
                 args.input_size,
                 args.output_size,
                 device,
+                max_hidden_size=args.max_hidden_size or None
             ).to(device))
 
         elif net == "VanillaCNN":
@@ -266,6 +454,7 @@ def build_models(args, device):
                 args.input_size,
                 args.output_size,
                 device,
+                max_hidden_size=args.max_hidden_size or None
             ).to(device))
 
         elif net == "EWCMLP":
@@ -276,7 +465,11 @@ def build_models(args, device):
                     args.input_size,
                     args.output_size,
                     device,
-                    lam=args.lam  # the lambda (fisher multiplier) value to be used in the EWC loss formula
+                    lam=args.lam,  # the lambda (fisher multiplier) value to be used in the EWC loss formula
+                    max_hidden_size=args.max_hidden_size or None,
+                    fisher_strategy=fisher_strategy,
+                    sparse_fisher_fraction=args.sparse_fisher_fraction,
+                    sparse_fisher_threshold=args.sparse_fisher_threshold
                 ).to(device))
 
         elif net == "EWCCNN":
@@ -287,12 +480,40 @@ def build_models(args, device):
                     args.input_size,
                     args.output_size,
                     device,
-                    lam=args.lam  # the lambda (fisher multiplier) value to be used in the EWC loss formula
+                    lam=args.lam,  # the lambda (fisher multiplier) value to be used in the EWC loss formula
+                    max_hidden_size=args.max_hidden_size or None,
+                    fisher_strategy=fisher_strategy,
+                    sparse_fisher_fraction=args.sparse_fisher_fraction,
+                    sparse_fisher_threshold=args.sparse_fisher_threshold
+                ).to(device))
+
+        elif net == "GEMMLP" or net == "GEMCNN":
+
+            models.append(
+                (GEMMLP if net == "GEMMLP" else GEMCNN)(
+                    args.hidden_size,
+                    args.input_size,
+                    args.output_size,
+                    device,
+                    memory_strength=args.gem_memory_strength,
+                    gem_mode=args.gem_mode,
+                    refresh_interval=args.gem_refresh_interval,
+                    n_memories=args.gem_memories,
+                    max_hidden_size=args.max_hidden_size or None
                 ).to(device))
 
         else:
             raise TypeError("Invalid Neural Network Type Specified: {}\n".format(net))
 
+        models[-1].set_storage_dtype(getattr(torch, args.storage_dtype))
+
+        # GEM models always keep samples of previous tasks (to constrain their gradients)- EWC models only if they are
+        # to rehearse them
+        if net.startswith('GEM') or (net.startswith('EWC') and args.replay_weight > 0):
+            models[-1].set_replay_buffer(
+                ReplayBuffer(args.replay_budget * 2**20, device, args.replay_policy, args.replay_mmap_dir or None),
+                args.replay_weight if net.startswith('EWC') else 0)
+
     return models
 
 
@@ -313,6 +534,14 @@ def setup_h5_file(args, models):
         model_type = str(type(model))
         model_type = model_type[model_type.index("'") + 1:model_type.rindex('.')]
         
+        # models using a Fisher strategy other than the default get their own results files, so that strategies can be
+        # compared within the same run
+        if getattr(model, 'fisher_strategy', 'sampled') != 'sampled':
+            model_type += "_" + model.fisher_strategy
+
+        if getattr(model, 'gem_mode', 'gem') != 'gem':
+            model_type += "_" + model.gem_mode
+
         filename = DIR + "/" + model_type + "_" + args.output_file + "_run_{}.h5".format(args.run)
 
         path = Path(filename)
@@ -367,3 +596,55 @@ def setup_h5_file(args, models):
 
     # todo fix the models list style so only one model at a time, and make these lists into single h5 datasets
     return files, expansions_list, avg_acc_list, task_acc_list, f
+
+
+# Create a dataset in each results file for the seconds spent in each phase of the run (see PhaseTimer.phases) during
+# each task- "time_<phase>". Returns a list with a dictionary {phase name: dataset} for each file (empty if
+# args.time_phases is not set).
+def setup_phase_time_datasets(args, files):
+
+    phase_times_list = []
+
+    for f in files:
+
+        phase_times = {}
+
+        if args.time_phases:
+            for phase in PhaseTimer.phases:
+
+                # NOTE: TO FACILITATE PARSING THERE IS A ZERO TACKED ONTO THE FRONT OF THIS LIST
+                # total seconds spent in the phase while learning each task, including any attempts at the task before
+                # the network was expanded
+                phase_time = f.create_dataset("time_" + phase, (args.tasks + 1,), dtype='f')
+                phase_time[...] = np.zeros(len(phase_time))
+                phase_times.update({phase: phase_time})
+
+        phase_times_list.append(phase_times)
+
+    return phase_times_list
+
+
+# Create a dataset in each results file for the bytes held in each memory category (see memory_utils.memory_categories)
+# after each task- "memory_<category>". Returns a list with a dictionary {category: dataset} for each file (empty if
+# args.record_memory is not set).
+def setup_memory_datasets(args, files):
+
+    memory_list = []
+
+    for f in files:
+
+        memory = {}
+
+        if args.record_memory:
+            for category in memory_utils.memory_categories:
+
+                # NOTE: TO FACILITATE PARSING THERE IS A ZERO TACKED ONTO THE FRONT OF THIS LIST
+                # bytes held in the category after the network learned each task (after its final attempt at the
+                # task, if it was expanded)
+                category_bytes = f.create_dataset("memory_" + category, (args.tasks + 1,), dtype='i8')
+                category_bytes[...] = np.zeros(len(category_bytes))
+                memory.update({category: category_bytes})
+
+        memory_list.append(memory)
+
+    return memory_list
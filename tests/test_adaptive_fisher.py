@@ -0,0 +1,91 @@
+from argparse import Namespace
+import pytest
+import torch
+import torch.utils.data as D
+from EWCMLP import EWCMLP
+
+device = torch.device('cpu')
+
+torch.manual_seed(2)
+data, target = torch.rand(60, 784), torch.randint(10, (60,))
+
+
+def model(fisher_strategy):
+
+    torch.manual_seed(0)
+
+    return EWCMLP(10, 784, 10, device, lam=15, fisher_strategy=fisher_strategy)
+
+
+def fisher_args(adaptive_fisher=True, fisher_chunk_size=60, fisher_tolerance=0.0, fisher_min_samples=0,
+                fisher_max_samples=0):
+
+    return Namespace(adaptive_fisher=adaptive_fisher, fisher_chunk_size=fisher_chunk_size,
+                     fisher_tolerance=fisher_tolerance, fisher_min_samples=fisher_min_samples,
+                     fisher_max_samples=fisher_max_samples, fisher_batch_size=10, validation_dataset_size=60)
+
+
+# the estimate from the first samples of the validation data, with a fixed number of samples as without
+# --adaptive-fisher (the validation data in a single batch)
+def fixed_estimate(fisher_strategy, samples=60, seed=1):
+
+    estimating_model = model(fisher_strategy)
+
+    torch.manual_seed(seed)
+
+    estimating_model.estimate_fisher(D.DataLoader(D.TensorDataset(data[:samples], target[:samples]),
+                                                  batch_size=samples), fisher_args(adaptive_fisher=False,
+                                                                                    fisher_chunk_size=samples))
+
+    return estimating_model.list_of_fisher_diags, estimating_model.fisher_sample_count
+
+
+def adaptive_estimate(fisher_strategy, args, seed=1):
+
+    estimating_model = model(fisher_strategy)
+
+    torch.manual_seed(seed)
+
+    # the validation data in the batches of the loader, which the adaptive estimate re-batches into chunks
+    estimating_model.estimate_fisher(D.DataLoader(D.TensorDataset(data, target), batch_size=20), args)
+
+    return estimating_model.list_of_fisher_diags, estimating_model.fisher_sample_count
+
+
+def assert_estimates_equal(estimate, expected):
+
+    assert estimate[1] == expected[1]
+
+    for fisher_diag, expected_fisher_diag in zip(estimate[0], expected[0]):
+        assert torch.allclose(fisher_diag, expected_fisher_diag, rtol=1e-5, atol=1e-8)
+
+
+# with all of the validation data in one chunk, the adaptive estimate draws the same classes from the same seed as the
+# fixed estimate, and so is the same
+def test_single_chunk_matches_fixed_estimate():
+
+    assert_estimates_equal(adaptive_estimate('sampled', fisher_args()), fixed_estimate('sampled'))
+
+
+# a tolerance that is never met uses all of the validation data, in whatever chunks it is read
+@pytest.mark.parametrize('fisher_chunk_size', [1, 7, 25, 1000])
+def test_unconverged_estimate_uses_all_samples(fisher_chunk_size):
+
+    assert_estimates_equal(adaptive_estimate('empirical', fisher_args(fisher_chunk_size=fisher_chunk_size)),
+                           fixed_estimate('empirical'))
+
+
+# a tolerance that is always met stops after the first chunk once the minimum number of samples have been used
+@pytest.mark.parametrize('fisher_min_samples,samples', [(0, 20), (30, 30), (31, 40)])
+def test_converged_estimate_stops_early(fisher_min_samples, samples):
+
+    args = fisher_args(fisher_chunk_size=10, fisher_tolerance=1e9, fisher_min_samples=fisher_min_samples)
+
+    assert_estimates_equal(adaptive_estimate('empirical', args), fixed_estimate('empirical', samples))
+
+
+def test_estimate_limited_to_max_samples():
+
+    args = fisher_args(fisher_chunk_size=10, fisher_max_samples=25)
+
+    assert_estimates_equal(adaptive_estimate('empirical', args), fixed_estimate('empirical', 25))
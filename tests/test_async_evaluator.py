@@ -0,0 +1,93 @@
+from argparse import Namespace
+import threading
+import torch
+import torch.utils.data as D
+from AsyncEvaluator import AsyncEvaluator
+from VanillaMLP import VanillaMLP
+
+args = Namespace(eval_batch_size=20)
+
+device = torch.device('cpu')
+
+
+def trained_model(tasks):
+
+    torch.manual_seed(0)
+
+    model = VanillaMLP(10, 784, 10, device)
+
+    for task in range(1, tasks + 1):
+        with torch.no_grad():
+            for parameter in model.parameters():
+                parameter.add_(0.1 * torch.randn(parameter.size()))
+
+        model.update_size_dict(task)
+        model.save_theta_stars(task)
+        model.task_input_permutations.update({task: torch.randperm(784)})
+
+    return model
+
+
+def shuffled_test_loaders(tasks):
+
+    torch.manual_seed(1)
+
+    return [D.DataLoader(D.TensorDataset(torch.rand(50, 784), torch.randint(10, (50,))), batch_size=20, shuffle=True)
+            for task in range(tasks)]
+
+
+# testing in the background gives the same results as testing on the calling thread, without drawing from the global
+# RNG (which training would otherwise share with the worker thread in a timing-dependent order)
+def test_background_test_matches_test_and_leaves_rng_untouched():
+
+    model = trained_model(2)
+    test_loaders = shuffled_test_loaders(2)
+
+    expected = model.test(test_loaders, 0, args)
+
+    evaluator = AsyncEvaluator(device)
+
+    # (the test models are built, drawing their initial weights, on the calling thread- hold the worker until then)
+    release = threading.Event()
+    evaluator.executor.submit(release.wait)
+
+    evaluator.submit(model, test_loaders, args, 'key')
+
+    rng_state = torch.get_rng_state()
+
+    release.set()
+
+    assert evaluator.completed(block=True) == [('key', expected)]
+    assert torch.equal(torch.get_rng_state(), rng_state)
+
+    evaluator.close()
+
+
+# a test queued behind another uses the per-task state of the model at the time it was submitted
+def test_background_test_uses_state_at_submission():
+
+    model = trained_model(2)
+    test_loaders = shuffled_test_loaders(2)
+
+    expected = model.test(test_loaders, 0, args)
+
+    evaluator = AsyncEvaluator(device)
+
+    # hold the worker until the model's state has changed
+    release = threading.Event()
+    evaluator.executor.submit(release.wait)
+
+    evaluator.submit(model, test_loaders, args, 'key')
+
+    model.permute_task_state(1, torch.randperm(784))
+    model.task_input_permutations.update({2: torch.randperm(784)})
+
+    with torch.no_grad():
+        model.modulelist[4].weight.add_(1)
+    model.save_theta_stars(2)
+
+    release.set()
+
+    assert evaluator.completed(block=True) == [('key', expected)]
+
+    evaluator.close()
@@ -0,0 +1,120 @@
+from argparse import Namespace
+import torch
+import torch.utils.data as D
+from ConcurrentTrainer import ConcurrentTrainer
+from EWCMLP import EWCMLP
+
+args = Namespace(lr=0.1, momentum=0, epochs=2, log_interval=1000, train_dataset_size=40, divergence_threshold=1000,
+                 divergence_check_interval=10, divergence_patience=1, adaptive_fisher=False,
+                 validation_dataset_size=20, eval_batch_size=20, tasks=100)
+
+device = torch.device('cpu')
+
+
+def loader(data, target):
+
+    return D.DataLoader(D.TensorDataset(data, target), batch_size=10, shuffle=False)
+
+
+# the (unpermuted) data of each task, and the permutation folded into the networks' weights for it (see setup.py
+# --permute-in-weights)- the validation data is used for Fisher estimation
+def generate_tasks(tasks):
+
+    torch.manual_seed(0)
+
+    data, target = torch.rand(60, 784), torch.randint(10, (60,))
+
+    return [(loader(data[:40], target[:40]), loader(data[40:], target[40:]), torch.randperm(784))
+            for task in range(tasks)]
+
+
+def generate_models():
+
+    torch.manual_seed(1)
+
+    # the empirical Fisher draws nothing from the global RNG, which the workers (e.g. iterating over DataLoaders) draw
+    # from in a different order than a sequential run
+    models = [EWCMLP(10, 784, 10, device, lam=lam, fisher_strategy='empirical') for lam in [15, 50]]
+
+    for model in models:
+        # the output layer is re-initialized from the global RNG on the worker threads, in whatever order they run
+        model.reinitialize_output_weights = lambda: None
+
+    return models
+
+
+def metrics():
+
+    return {name: [] for name in ['fisher_total', 'post_training_loss', 'fisher_average', 'fisher_st_dev', 'fisher_max',
+                                  'fisher_information', 'ewc_pen']}
+
+
+# Train the models on each task as main() does, either one after another or concurrently. A model failing its test on
+# the final task (with an accuracy threshold no model can reach) ends the task, as it would be retrained after an
+# expansion- the models after it are not trained on the task in a sequential run.
+def run(concurrent):
+
+    tasks = generate_tasks(3)
+    models = generate_models()
+    recorded = metrics()
+    failure = [0]
+
+    test_loaders = []
+
+    concurrent_trainer = ConcurrentTrainer(device, len(models)) if concurrent else None
+
+    for task_count, (train_loader, validation_loader, permutation) in enumerate(tasks, 1):
+
+        test_loaders.append(validation_loader)
+
+        def task_args(model):
+
+            return dict(recorded, validation_loader=validation_loader, input_permutation=permutation, failure=failure)
+
+        def train_and_test(model, defer=False):
+
+            model.train_model(args, train_loader, task_count, defer=defer, **task_args(model))
+
+            return model.test(test_loaders, 101 if task_count == len(tasks) else 0, args)
+
+        concurrent_results = concurrent_trainer.run(lambda model: train_and_test(model, defer=True), models) \
+            if concurrent else None
+
+        for model_num, model in enumerate(models):
+
+            if concurrent:
+                test_results = concurrent_results[model_num]
+
+                model.finish_task(args, task_count, deferred=True, **task_args(model))
+
+            else:
+                test_results = train_and_test(model)
+
+            if test_results == -1:
+                break
+
+    if concurrent:
+        concurrent_trainer.close()
+
+    return models, recorded
+
+
+# a concurrent run must consolidate the tasks and record the metrics of the models in the same order as a sequential
+# run (and not consolidate the final task for the model which was not trained on it in the sequential run). Deferred
+# consolidation is done in the unpermuted frame (see MLP.consolidate_unpermuted()), so the values only agree up to the
+# order in which they are summed.
+def test_concurrent_run_matches_sequential_run():
+
+    sequential_models, sequential_metrics = run(concurrent=False)
+    concurrent_models, concurrent_metrics = run(concurrent=True)
+
+    for name in ['fisher_total', 'post_training_loss', 'fisher_average', 'fisher_st_dev', 'fisher_max', 'ewc_pen']:
+        assert len(concurrent_metrics[name]) == len(sequential_metrics[name])
+        assert torch.allclose(torch.tensor(concurrent_metrics[name]), torch.tensor(sequential_metrics[name]),
+                              rtol=1e-3), name
+
+    for sequential_model, concurrent_model in zip(sequential_models, concurrent_models):
+        assert sequential_model.fisher_sample_counts == concurrent_model.fisher_sample_counts
+
+        for sequential_sum, concurrent_sum in zip(sequential_model.sum_Fx, concurrent_model.sum_Fx):
+            assert torch.allclose(sequential_sum, concurrent_sum, rtol=1e-3, atol=1e-6)
@@ -0,0 +1,90 @@
+from argparse import Namespace
+import h5py
+import numpy as np
+import torch
+import torch.utils.data as D
+from EWCMLP import EWCMLP
+
+
+def task_loader():
+
+    return D.DataLoader(D.TensorDataset(torch.rand(40, 784), torch.randint(10, (40,))), batch_size=10)
+
+
+def train_args(h5file, failure):
+
+    args = {name: [] for name in ['fisher_total', 'post_training_loss', 'fisher_average', 'fisher_st_dev', 'fisher_max',
+                                  'ewc_pen']}
+
+    args.update({'fisher_information': [[0]], 'h5file': h5file, 'failure': failure,
+                 'validation_loader': task_loader()})
+
+    return args
+
+
+def run_args(tasks, divergence_threshold):
+
+    return Namespace(lr=0.1, momentum=0, epochs=1, log_interval=1000, train_dataset_size=40,
+                     divergence_threshold=divergence_threshold, divergence_check_interval=2, divergence_patience=1,
+                     adaptive_fisher=False, validation_dataset_size=40, tasks=tasks)
+
+
+# a network whose loss exceeds the divergence threshold is marked as failed on the task, and the metrics of the tasks
+# before it are saved along with the point at which it diverged and the trajectory leading up to it
+def test_diverged_run_saves_failure(tmp_path):
+
+    torch.manual_seed(0)
+
+    model = EWCMLP(10, 784, 10, torch.device('cpu'), lam=15)
+
+    failure = [0]
+
+    with h5py.File(str(tmp_path / 'metrics.h5'), 'w') as h5file:
+        kwargs = train_args(h5file, failure)
+
+        model.train_model(run_args(10, 1000), task_loader(), 1, **kwargs)
+
+        assert failure[0] == 0
+
+        # every loss is above a threshold of 0
+        model.train_model(run_args(10, 0), task_loader(), 2, **kwargs)
+
+        assert failure[0] == 2
+        assert model.training_monitor.diverged
+
+    with h5py.File(str(tmp_path / 'metrics.h5'), 'r') as h5file:
+        assert h5file['failure'][0] == 2
+        assert h5file['failure_step'][0] == 1
+
+        # one entry per window of 2 iterations checked before training stopped
+        trajectory = h5file['failure_trajectory'][...]
+
+        assert len(trajectory) > 0
+        assert np.array_equal(trajectory[:, 0], 2 * np.arange(1, len(trajectory) + 1))
+        assert (trajectory[:, 1] > 0).all()
+
+        # the placeholder and task 1 only- task 2 was not consolidated
+        assert len(h5file['post_training_loss']) == 1
+        assert len(h5file['fisher_information']) == 2
+        assert np.array_equal(h5file['fisher_information'][0], [0])
+        assert np.allclose(h5file['fisher_information'][1],
+                           np.concatenate([diag.numpy().flatten() for diag in model.sum_Fx]))
+
+
+def test_final_task_saves_metrics(tmp_path):
+
+    torch.manual_seed(0)
+
+    model = EWCMLP(10, 784, 10, torch.device('cpu'), lam=15)
+
+    with h5py.File(str(tmp_path / 'metrics.h5'), 'w') as h5file:
+        kwargs = train_args(h5file, [0])
+
+        for task in [1, 2]:
+            model.train_model(run_args(2, 1000), task_loader(), task, **kwargs)
+
+    with h5py.File(str(tmp_path / 'metrics.h5'), 'r') as h5file:
+        assert h5file['failure'][0] == 0
+        assert len(h5file['fisher_information']) == 3
+        assert len(h5file['fisher_total']) == 2
+        assert len(h5file['ewc_pen']) == 1
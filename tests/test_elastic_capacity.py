@@ -0,0 +1,139 @@
+from argparse import Namespace
+import pytest
+import torch
+import torch.nn as nn
+import torch.utils.data as D
+from EWCMLP import EWCMLP
+from network_utils import ElasticConv2d, ElasticLinear
+
+device = torch.device('cpu')
+
+args = Namespace(adaptive_fisher=False, validation_dataset_size=40, eval_batch_size=0, eval_memory_ceiling=256)
+
+
+def loader():
+
+    return D.DataLoader(D.TensorDataset(torch.rand(40, 784), torch.randint(10, (40,))), batch_size=40)
+
+
+# copy the weights of model into the active part of each parameter of elastic_model
+def copy_into_active(model, elastic_model):
+
+    with torch.no_grad():
+        for parameter, elastic_parameter in zip(model.parameters(), elastic_model.parameters()):
+            elastic_parameter[tuple(slice(0, n) for n in parameter.shape)] = parameter
+
+
+def assert_active_weights_equal(model, elastic_model):
+
+    for parameter, elastic_parameter in zip(model.parameters(), elastic_model.parameters()):
+        assert torch.equal(elastic_parameter[tuple(slice(0, n) for n in parameter.shape)], parameter)
+
+
+# Expanding an elastic capacity model in place must keep the weights and EWC state that rebuilding the model at the
+# new size (from_existing_model()) would- given the same new weights, the two compute the same outputs, penalty and
+# test results.
+def test_expand_in_place_matches_from_existing_model():
+
+    torch.manual_seed(0)
+
+    model = EWCMLP(10, 784, 10, device, lam=15, fisher_strategy='empirical')
+    elastic_model = EWCMLP(10, 784, 10, device, lam=15, fisher_strategy='empirical', max_hidden_size=40)
+
+    copy_into_active(model, elastic_model)
+
+    validation_loader = loader()
+
+    for each in [model, elastic_model]:
+        each.update_size_dict(1)
+        each.save_theta_stars(1)
+        each.consolidate(args, 1, validation_loader=validation_loader)
+
+    assert elastic_model.can_expand_in_place(20)
+    assert not elastic_model.can_expand_in_place(80)
+
+    expanded_model = EWCMLP.from_existing_model(model, 20)
+    elastic_model.expand_in_place(20)
+
+    assert elastic_model.hidden_size == 20
+
+    # the weights trained on task 1 are kept...
+    for task_1_weights, elastic_parameter in zip(expanded_model.task_post_training_weights.get(1),
+                                                 elastic_model.parameters()):
+        assert torch.equal(elastic_parameter[tuple(slice(0, n) for n in task_1_weights.shape)], task_1_weights)
+
+    # ...and, with the newly initialized weights made the same (and the weights moved away from those after task 1, so
+    # that the penalty is not 0), nothing else differs
+    with torch.no_grad():
+        for parameter in expanded_model.parameters():
+            parameter.add_(0.1 * torch.randn(parameter.size()))
+
+    copy_into_active(expanded_model, elastic_model)
+
+    data = torch.rand(30, 784)
+
+    assert torch.allclose(elastic_model(data), expanded_model(data), atol=1e-6)
+    assert torch.allclose(elastic_model.penalty(2), expanded_model.penalty(2), rtol=1e-5)
+
+    test_loaders = [loader()]
+
+    assert elastic_model.test(test_loaders, 0, args) == expanded_model.test(test_loaders, 0, args)
+
+
+def test_elastic_conv2d_matches_conv2d():
+
+    torch.manual_seed(0)
+
+    conv = nn.Conv2d(3, 8, 3, padding=1)
+    elastic_conv = ElasticConv2d(3, 8, 6, 16, 3, padding=1)
+
+    with torch.no_grad():
+        elastic_conv.weight[:8, :3] = conv.weight
+        elastic_conv.bias[:8] = conv.bias
+
+    data = torch.rand(2, 3, 8, 8)
+
+    assert torch.allclose(elastic_conv(data), conv(data), atol=1e-6)
+
+    # growing the layer keeps the active weights, and only the inputs it was grown to are read
+    elastic_conv.grow(6, 16)
+
+    assert torch.equal(elastic_conv.weight[:8, :3], conv.weight)
+    assert elastic_conv(torch.rand(2, 6, 8, 8)).shape == (2, 16, 8, 8)
+
+    with pytest.raises(ValueError):
+        elastic_conv.grow(6, 32)
+
+
+def test_elastic_linear_grows_within_its_maximum_size():
+
+    layer = ElasticLinear(4, 5, 8, 10)
+
+    assert layer(torch.rand(3, 4)).shape == (3, 5)
+
+    layer.grow(8, 10)
+
+    assert layer(torch.rand(3, 8)).shape == (3, 10)
+
+    with pytest.raises(ValueError):
+        layer.grow(16, 10)
+
+
+# AlexNet cannot be built without a GPU (its constructor prints a tensor on the device)
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='AlexNet requires a GPU')
+def test_alexnet_set_filters_matches_larger_alexnet():
+
+    from alexnet import AlexNet
+
+    torch.manual_seed(0)
+
+    alexnet = AlexNet(filters=16).eval()
+    elastic_alexnet = AlexNet(filters=8, max_filters=16).eval()
+
+    elastic_alexnet.set_filters(16)
+
+    copy_into_active(alexnet, elastic_alexnet)
+
+    data = torch.rand(2, 3, 32, 32)
+
+    assert torch.allclose(elastic_alexnet(data), alexnet(data), atol=1e-5)
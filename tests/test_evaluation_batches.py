@@ -0,0 +1,70 @@
+from argparse import Namespace
+import pytest
+import torch
+import torch.utils.data as D
+from ExpandableModel import ExpandableModel
+from VanillaMLP import VanillaMLP
+
+device = torch.device('cpu')
+
+
+def test_loaders():
+
+    torch.manual_seed(1)
+
+    return [D.DataLoader(D.TensorDataset(torch.rand(95, 784), torch.randint(10, (95,))), batch_size=20)
+            for task in range(2)]
+
+
+def trained_model():
+
+    torch.manual_seed(0)
+
+    model = VanillaMLP(10, 784, 10, device)
+
+    for task in [1, 2]:
+        model.update_size_dict(task)
+        model.save_theta_stars(task)
+
+    return model
+
+
+# the evaluation batch size has no effect on the test results- testing in the test loaders' own batches (as before the
+# evaluation batch size was decoupled from them) gives the same results as any other batch size, or the automatic one
+@pytest.mark.parametrize('eval_batch_size', [0, 1, 7, 64, 1000])
+def test_results_independent_of_evaluation_batch_size(eval_batch_size):
+
+    model = trained_model()
+
+    expected = model.test(test_loaders(), 0, Namespace(eval_batch_size=20, eval_memory_ceiling=256))
+
+    assert model.test(test_loaders(), 0, Namespace(eval_batch_size=eval_batch_size, eval_memory_ceiling=256)) == expected
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 20, 64, 1000])
+def test_evaluation_batches_cover_every_sample_once(batch_size):
+
+    data, target = torch.rand(95, 784), torch.arange(95)
+
+    loader = D.DataLoader(D.TensorDataset(data, target), batch_size=20)
+
+    batches = list(ExpandableModel.evaluation_batches(loader, batch_size))
+
+    assert all(len(batch_target) == batch_size for batch_data, batch_target in batches[:-1])
+    assert 0 < len(batches[-1][1]) <= batch_size
+
+    assert torch.equal(torch.cat([batch_data for batch_data, batch_target in batches]), data)
+    assert torch.equal(torch.cat([batch_target for batch_data, batch_target in batches]), target)
+
+
+# the automatic batch size keeps the input and the activations of every layer for a batch within the memory ceiling
+def test_automatic_batch_size_within_memory_ceiling():
+
+    model = trained_model()
+
+    batch_size = model.evaluation_batch_size(Namespace(eval_batch_size=0, eval_memory_ceiling=1))
+
+    # input, the two hidden layers (and their ReLUs) and the output, in float32
+    bytes_per_sample = (784 + 4 * 10 + 10) * 4
+
+    assert batch_size == 2**20 // bytes_per_sample
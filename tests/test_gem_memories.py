@@ -0,0 +1,116 @@
+import torch
+import torch.nn.functional as F
+import GEMModel
+from GEMMLP import GEMMLP
+from ReplayBuffer import ReplayBuffer
+
+
+# the gradients constraining training on a later task are those of the loss on each past task's memories through the
+# output layer saved after training on that task, as the model is tested on it- not through the current output layer
+def test_past_task_gradients_use_each_task_output_layer():
+
+    torch.manual_seed(0)
+
+    model = GEMMLP(10, 784, 10, torch.device('cpu'), gem_mode='agem')
+    model.set_replay_buffer(ReplayBuffer(2**20, torch.device('cpu')))
+
+    data, target = torch.rand(50, 784), torch.randint(10, (50,))
+    model.replay_buffer.add(1, data, target)
+    model.save_theta_stars(1)
+
+    # a new output layer for task 2
+    model.reinitialize_output_weights()
+
+    GEMModel.flatten_grads(model.parameters, model.flat_grad, model.grad_offsets)
+    GEMModel.compute_past_task_grads(model, [1])
+
+    reference = GEMMLP(10, 784, 10, torch.device('cpu'))
+    reference.load_state_dict(model.state_dict())
+    reference.task_post_training_weights = model.task_post_training_weights
+    reference.restore_output_weights(1)
+    reference.zero_grad()
+
+    memories, memory_targets = model.replay_buffer.samples(1)
+    F.cross_entropy(reference(memories), memory_targets).backward()
+
+    for parameter_index, parameter in enumerate(list(reference.parameters())[:-2]):
+        begin, end = model.grad_offsets[parameter_index]
+        assert torch.allclose(model.ref_grad[begin:end], parameter.grad.view(-1), atol=1e-6)
+
+    # the current output layer is not constrained
+    assert (model.ref_grad[model.grad_offsets[-2][0]:] == 0).all()
+
+
+# however many samples of each past task the replay buffer holds, the past-task gradients are computed on n_memories of
+# them
+def test_past_task_gradients_use_n_memories_per_task():
+
+    torch.manual_seed(0)
+
+    model = GEMMLP(10, 784, 10, torch.device('cpu'), n_memories=32)
+    model.set_replay_buffer(ReplayBuffer(2**22, torch.device('cpu')))
+
+    for task in [1, 2]:
+        model.replay_buffer.add(task, torch.rand(500, 784), torch.randint(10, (500,)))
+        model.save_theta_stars(task)
+
+    batch_sizes = []
+    hook = model.register_forward_hook(lambda module, inputs, output: batch_sizes.append(len(inputs[0])))
+
+    GEMModel.flatten_grads(model.parameters, model.flat_grad, model.grad_offsets)
+    GEMModel.compute_past_task_grads(model, [1, 2])
+
+    hook.remove()
+
+    assert batch_sizes == [64]
+
+
+def test_replay_buffer_task_subset():
+
+    torch.manual_seed(0)
+
+    replay_buffer = ReplayBuffer(2**22, torch.device('cpu'))
+
+    # each sample's label is its index, so that the samples drawn can be identified
+    replay_buffer.add(1, torch.rand(300, 784), torch.arange(300))
+    replay_buffer.add(2, torch.rand(300, 784), torch.arange(300, 600))
+
+    data, target = replay_buffer.samples(1, 50)
+
+    assert len(data) == 50
+    assert len(set(target.tolist())) == 50
+    assert (target < 300).all()
+
+    # asking for more samples than the task has returns all of them
+    assert len(replay_buffer.samples(2, 1000)[1]) == len(replay_buffer.samples(2)[1])
+
+
+# the GEM projection is computed on every step without deciding on the host whether it is needed- it must still leave
+# a gradient that satisfies every constraint untouched, and project one that does not
+def test_project_gradient_only_changes_violating_gradients():
+
+    torch.manual_seed(0)
+
+    model = GEMMLP(10, 784, 10, torch.device('cpu'))
+    model.refreshed_tasks = 2
+    model.task_grads = torch.randn(2, sum(model.grad_dims))
+
+    satisfying = model.task_grads.sum(0) + 0.1 * torch.randn(sum(model.grad_dims))
+    assert (torch.mv(model.task_grads, satisfying) >= 0).all()
+
+    model.flat_grad.copy_(satisfying)
+    GEMModel.project_gradient(model)
+
+    assert torch.equal(model.flat_grad, satisfying)
+
+    violating = -model.task_grads[0]
+
+    projected = violating.view(-1, 1).clone()
+    GEMModel.project2cone2(projected, model.task_grads.t(), model.memory_strength)
+
+    model.flat_grad.copy_(violating)
+    GEMModel.project_gradient(model)
+
+    assert torch.allclose(model.flat_grad, projected.view(-1))
+    # (up to float32 rounding, relative to the size of the gradients)
+    assert (torch.mv(model.task_grads, model.flat_grad) >= -1e-5 * torch.dot(violating, violating)).all()
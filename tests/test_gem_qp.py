@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import torch
+from GEMModel import solve_dual_qp, project2cone2
+
+quadprog = pytest.importorskip('quadprog')
+
+
+# the dual solution and projected gradient of the GEM QP, as computed by the original GEM implementation with quadprog
+def quadprog_projection(gradient, memories, margin):
+
+    memories_np = memories.cpu().t().double().numpy()
+    gradient_np = gradient.cpu().contiguous().view(-1).double().numpy()
+    t = memories_np.shape[0]
+    P = np.dot(memories_np, memories_np.transpose())
+    P = 0.5 * (P + P.transpose())
+    q = np.dot(memories_np, gradient_np) * -1
+    G = np.eye(t)
+    h = np.zeros(t) + margin
+    v = quadprog.solve_qp(P, q, G, h)[0]
+    x = np.dot(v, memories_np) + gradient_np
+    return torch.from_numpy(v), torch.from_numpy(x)
+
+
+# a gradient and (p * t) memories of past task gradients, correlated with one another (as the gradients of related
+# tasks are) and with the gradient pointing against some of them, so that some constraints are active
+def random_problem(generator, p, t, correlation):
+
+    shared = torch.randn(p, 1, generator=generator, dtype=torch.float64)
+    memories = correlation * shared + torch.randn(p, t, generator=generator, dtype=torch.float64)
+    gradient = -0.5 * shared + torch.randn(p, 1, generator=generator, dtype=torch.float64)
+    return gradient, memories
+
+
+@pytest.mark.parametrize('p, t, correlation', [(100, 3, 0.0), (500, 10, 0.5), (1000, 20, 1.0)])
+def test_solve_dual_qp_matches_quadprog(p, t, correlation):
+
+    generator = torch.Generator().manual_seed(p + t)
+
+    for trial in range(5):
+        gradient, memories = random_problem(generator, p, t, correlation)
+
+        reference_v, reference_x = quadprog_projection(gradient, memories, 0.5)
+
+        projected = gradient.clone()
+        v = project2cone2(projected, memories, 0.5)
+
+        assert torch.allclose(v, reference_v, rtol=1e-4, atol=1e-4)
+        assert torch.allclose(projected.view(-1), reference_x, rtol=1e-4, atol=1e-4)
+
+        # the projected gradient satisfies the GEM constraints (no increase in the loss on any past task)
+        assert (torch.mv(memories.t(), projected.view(-1)) >= -1e-6).all()
+
+
+def test_solve_dual_qp_warm_start_matches_quadprog():
+
+    generator = torch.Generator().manual_seed(0)
+
+    gradient, memories = random_problem(generator, 500, 10, 0.5)
+
+    dual = project2cone2(gradient.clone(), memories, 0.5)
+
+    # the next step's gradient is close to this one's, so the previous dual solution is a good starting point
+    for step in range(5):
+        gradient = gradient + 0.1 * torch.randn(gradient.size(), generator=generator, dtype=torch.float64)
+
+        reference_v, reference_x = quadprog_projection(gradient, memories, 0.5)
+
+        projected = gradient.clone()
+        dual = project2cone2(projected, memories, 0.5, dual)
+
+        assert torch.allclose(dual, reference_v, rtol=1e-4, atol=1e-4)
+        assert torch.allclose(projected.view(-1), reference_x, rtol=1e-4, atol=1e-4)
+
+    # starting from the solution itself, the solver stays there
+    memories_t = memories.t()
+    P = torch.mm(memories_t, memories)
+    q = torch.mv(memories_t, gradient.view(-1))
+
+    assert torch.allclose(solve_dual_qp(P, q, 0.5, reference_v), reference_v, rtol=1e-5, atol=1e-5)
+
+
+def test_solve_dual_qp_float32():
+
+    generator = torch.Generator().manual_seed(1)
+
+    gradient, memories = random_problem(generator, 500, 10, 0.5)
+
+    reference_v, reference_x = quadprog_projection(gradient, memories, 0.5)
+
+    projected = gradient.float()
+    v = project2cone2(projected, memories.float(), 0.5)
+
+    assert torch.allclose(v.double(), reference_v, rtol=1e-3, atol=1e-3)
+    assert torch.allclose(projected.view(-1).double(), reference_x, rtol=1e-3, atol=1e-3)
@@ -0,0 +1,59 @@
+from argparse import Namespace
+import torch
+import torch.utils.data as D
+from EWCMLP import EWCMLP
+
+
+def consolidated_model(fisher_strategy, sparse_fisher_fraction=0):
+
+    torch.manual_seed(0)
+
+    model = EWCMLP(10, 784, 10, torch.device('cpu'), lam=15, fisher_strategy=fisher_strategy,
+                   sparse_fisher_fraction=sparse_fisher_fraction)
+
+    validation_loader = D.DataLoader(D.TensorDataset(torch.rand(50, 784), torch.randint(10, (50,))), batch_size=50)
+
+    args = Namespace(adaptive_fisher=False, validation_dataset_size=50)
+
+    model.update_size_dict(1)
+    model.save_theta_stars(1)
+    model.consolidate(args, 1, validation_loader=validation_loader)
+
+    # move away from the weights after task 1, so that the penalty is not 0
+    with torch.no_grad():
+        for parameter in model.parameters():
+            parameter.add_(0.1 * torch.randn(parameter.size()))
+
+    return model
+
+
+# folding a permutation into the first layer's weights (see MLP.begin_task()) must not change the EWC penalty, as the
+# penalized network computes the same function of the permuted input
+def check_penalty_unchanged_by_permutation(fisher_strategy, sparse_fisher_fraction=0):
+
+    model = consolidated_model(fisher_strategy, sparse_fisher_fraction)
+
+    unpermuted = model.penalty(2).item()
+
+    permutation = torch.randperm(784)
+    model.permute_input_weights(torch.argsort(permutation))
+
+    permuted = model.penalty(2).item()
+
+    assert abs(permuted - unpermuted) <= 1e-4 * abs(unpermuted)
+    assert unpermuted > 0
+
+
+def test_kfac_penalty_unchanged_by_permutation():
+
+    check_penalty_unchanged_by_permutation('kfac')
+
+
+def test_diagonal_penalty_unchanged_by_permutation():
+
+    check_penalty_unchanged_by_permutation('sampled')
+
+
+def test_sparse_penalty_unchanged_by_permutation():
+
+    check_penalty_unchanged_by_permutation('sampled', sparse_fisher_fraction=0.3)
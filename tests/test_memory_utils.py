@@ -0,0 +1,106 @@
+from argparse import Namespace
+import torch
+import torch.utils.data as D
+from EWCMLP import EWCMLP
+from ReplayBuffer import ReplayBuffer
+from TestSetCache import TestSetCache
+from VanillaMLP import VanillaMLP
+from memory_utils import memory_categories, memory_report, tensor_bytes
+
+device = torch.device('cpu')
+
+args = Namespace(lr=0.1, momentum=0, epochs=1, log_interval=1000, train_dataset_size=40, divergence_threshold=1000,
+                 divergence_check_interval=10, divergence_patience=1, adaptive_fisher=False,
+                 validation_dataset_size=20, tasks=100)
+
+
+def loader(samples):
+
+    return D.DataLoader(D.TensorDataset(torch.rand(samples, 784), torch.randint(10, (samples,))), batch_size=10)
+
+
+# an EWCMLP trained on two tasks, offering its training data to a replay buffer of 10000 bytes- with the memory
+# report taken after each task (as with --record-memory) if record_memory is set
+def train(record_memory):
+
+    torch.manual_seed(0)
+
+    model = EWCMLP(10, 784, 10, device, lam=15)
+
+    model.set_replay_buffer(ReplayBuffer(10000, device))
+
+    metrics = {name: [] for name in ['fisher_total', 'post_training_loss', 'fisher_average', 'fisher_st_dev',
+                                     'fisher_max', 'fisher_information', 'ewc_pen']}
+
+    reports = []
+
+    for task in [1, 2]:
+        model.train_model(args, loader(40), task, validation_loader=loader(20), failure=[0], **metrics)
+
+        if record_memory:
+            reports.append(memory_report(model))
+
+    return model, reports
+
+
+def parameter_bytes(model):
+
+    return sum(parameter.numel() for parameter in model.parameters()) * 4
+
+
+# the report of each category matches the size of the tensors it covers, and taking it does not change training
+def test_memory_report_categories():
+
+    model, reports = train(record_memory=False)
+    reporting_model, reports = train(record_memory=True)
+
+    for parameter, reporting_parameter in zip(model.parameters(), reporting_model.parameters()):
+        assert torch.equal(parameter, reporting_parameter)
+
+    for task, report in enumerate(reports, 1):
+        assert set(report) == set(memory_categories)
+
+        assert report.get('parameters') == parameter_bytes(model)
+
+        # sum_Fx, sum_Fx_Wx and sum_Fx_Wx_sq
+        assert report.get('ewc_sums') == 3 * parameter_bytes(model)
+
+        # the diagonals of each task so far, and those of the latest task
+        assert report.get('fisher_diags') == (task + 1) * parameter_bytes(model)
+
+        assert report.get('post_training_weights') == task * parameter_bytes(model)
+
+        # 12 samples of 784 uint8 values, with a float32 offset and scale and an int64 label each
+        assert report.get('replay_buffer') == 12 * (784 + 4 + 4 + 8)
+
+        assert report.get('test_cache') == 0
+        assert report.get('process_rss') > 0
+        assert report.get('device_allocated') == report.get('device_peak') == 0
+
+
+# a model without EWC state, or a replay buffer which has not yet been offered any samples, holds no memory for them
+def test_memory_report_without_ewc_state():
+
+    torch.manual_seed(0)
+
+    model = VanillaMLP(10, 784, 10, device)
+
+    model.set_replay_buffer(ReplayBuffer(10000, device))
+
+    # the base test data of 10 samples
+    test_set_cache = TestSetCache(device, 10)
+    test_set_cache.add_task(loader(10))
+
+    report = memory_report(model, test_set_cache)
+
+    assert report.get('parameters') == parameter_bytes(model)
+    assert report.get('ewc_sums') == report.get('fisher_diags') == report.get('replay_buffer') == 0
+    assert report.get('post_training_weights') == 0
+    assert report.get('test_cache') == 10 * 784 * 4 + 10 * 8
+
+
+def test_tensor_bytes():
+
+    assert tensor_bytes(torch.zeros(3, 4, dtype=torch.float64)) == 96
+
+    assert tensor_bytes({1: [torch.zeros(2), (torch.zeros(3, dtype=torch.uint8), torch.Size([5]))], 2: None}) == 11
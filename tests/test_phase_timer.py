@@ -0,0 +1,99 @@
+from argparse import Namespace
+import torch
+import torch.utils.data as D
+from EWCMLP import EWCMLP
+from PhaseTimer import PhaseTimer
+
+device = torch.device('cpu')
+
+args = Namespace(lr=0.1, momentum=0, epochs=2, log_interval=1000, train_dataset_size=40, divergence_threshold=1000,
+                 divergence_check_interval=10, divergence_patience=1, adaptive_fisher=False,
+                 validation_dataset_size=20, tasks=100)
+
+
+def loader(samples):
+
+    return D.DataLoader(D.TensorDataset(torch.rand(samples, 784), torch.randint(10, (samples,))), batch_size=10)
+
+
+def train(time_phases):
+
+    torch.manual_seed(0)
+
+    model = EWCMLP(10, 784, 10, device, lam=15)
+
+    phase_timer = PhaseTimer(time_phases, device)
+
+    model.set_phase_timer(phase_timer)
+
+    metrics = {name: [] for name in ['fisher_total', 'post_training_loss', 'fisher_average', 'fisher_st_dev',
+                                     'fisher_max', 'fisher_information', 'ewc_pen']}
+
+    for task in [1, 2]:
+        phase_timer.set_task(task)
+
+        model.train_model(args, loader(40), task, validation_loader=loader(20), failure=[0], **metrics)
+
+    return model, metrics, phase_timer
+
+
+# timing the phases of training does not change what is trained, and records the time of each phase under its task
+def test_timed_training_matches_untimed_training():
+
+    model, metrics, phase_timer = train(time_phases=False)
+    timed_model, timed_metrics, timed_phase_timer = train(time_phases=True)
+
+    for parameter, timed_parameter in zip(model.parameters(), timed_model.parameters()):
+        assert torch.equal(parameter, timed_parameter)
+
+    for sum_Fx, timed_sum_Fx in zip(model.sum_Fx, timed_model.sum_Fx):
+        assert torch.equal(sum_Fx, timed_sum_Fx)
+
+    assert timed_metrics['post_training_loss'] == metrics['post_training_loss']
+
+    assert phase_timer.totals == {}
+
+    for task in [1, 2]:
+        assert set(timed_phase_timer.totals[task]) == {'train_epoch', 'penalty', 'estimate_fisher', 'update_ewc_sums'}
+
+        for phase in PhaseTimer.phases:
+            assert timed_phase_timer.total(task, phase) >= 0
+
+        # the penalty is computed within the epochs
+        assert timed_phase_timer.total(task, 'train_epoch') > timed_phase_timer.total(task, 'penalty') > 0
+
+
+def test_spans_sum_per_task():
+
+    phase_timer = PhaseTimer(enabled=True)
+
+    phase_timer.set_task(1)
+
+    for span in range(3):
+        with phase_timer.span('test'):
+            pass
+
+    phase_timer.add('test', 2.0)
+
+    phase_timer.set_task(2)
+    phase_timer.add('test', 1.0)
+
+    assert 2.0 < phase_timer.total(1, 'test') < 2.1
+    assert phase_timer.total(2, 'test') == 1.0
+    assert phase_timer.total(2, 'reset') == 0.0
+    assert phase_timer.total(3, 'test') == 0.0
+
+
+# a disabled timer records nothing, even when a span raises
+def test_disabled_timer_records_nothing():
+
+    phase_timer = PhaseTimer()
+
+    try:
+        with phase_timer.span('test'):
+            raise ValueError()
+    except ValueError:
+        pass
+
+    assert phase_timer.span('test') is phase_timer.span('reset')
+    assert phase_timer.totals == {}
@@ -0,0 +1,61 @@
+from argparse import Namespace
+import torch
+import torch.nn.functional as F
+from EWCMLP import EWCMLP
+from ReplayBuffer import ReplayBuffer
+
+device = torch.device('cpu')
+
+
+# the rehearsal term classifies each replayed sample with the output layer saved after training on its task, as the
+# model is tested on the task- not with the current task's re-initialized output layer
+def test_rehearsal_uses_each_task_output_layer():
+
+    torch.manual_seed(0)
+
+    model = EWCMLP(10, 784, 10, device, lam=15)
+    model.set_replay_buffer(ReplayBuffer(2**22, device), weight=0.5)
+
+    for task in [1, 2]:
+        model.reinitialize_output_weights()
+        model.replay_buffer.add(task, torch.rand(50, 784), torch.randint(10, (50,)))
+        model.save_theta_stars(task)
+
+    model.reinitialize_output_weights()
+
+    torch.manual_seed(1)
+    loss = model.rehearsal_loss(Namespace(batch_size=40), 3)
+
+    model.zero_grad()
+    loss.backward()
+
+    torch.manual_seed(1)
+    data, target, tasks = model.replay_buffer.sample(40, 3)
+
+    assert set(tasks.tolist()) == {1, 2}
+
+    reference = EWCMLP(10, 784, 10, device, lam=15)
+    reference.load_state_dict(model.state_dict())
+    reference.task_post_training_weights = model.task_post_training_weights
+    reference.zero_grad()
+
+    reference_loss = 0
+
+    # (the output layer is restored in place, so each task's loss is backpropagated before the next is computed)
+    for task in [1, 2]:
+        reference.restore_output_weights(task)
+
+        task_loss = 0.5 * F.cross_entropy(reference(data[tasks == task]), target[tasks == task],
+                                          reduction='sum') / len(target)
+        task_loss.backward()
+
+        reference_loss = reference_loss + task_loss.detach()
+
+    assert torch.allclose(loss, reference_loss)
+
+    for parameter, reference_parameter in list(zip(model.parameters(), reference.parameters()))[:-2]:
+        assert torch.allclose(parameter.grad, reference_parameter.grad, atol=1e-6)
+
+    # the current output layer takes no part
+    for parameter in list(model.parameters())[-2:]:
+        assert parameter.grad is None or (parameter.grad == 0).all()
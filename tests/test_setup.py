@@ -0,0 +1,29 @@
+import sys
+import pytest
+import setup
+
+
+def parse(monkeypatch, *argv):
+
+    monkeypatch.setattr(sys, 'argv', ['main.py'] + list(argv))
+
+    return setup.parse_arguments()
+
+
+# every preset prints all of the arguments, including the list-valued ones (e.g. --fisher-strategy)
+@pytest.mark.parametrize('experiment', ['custom', 'mnist', 'cifar'])
+def test_parse_arguments_with_preset_defaults(monkeypatch, experiment):
+
+    args = parse(monkeypatch, '--experiment', experiment)
+
+    assert args.experiment == experiment
+    assert isinstance(args.fisher_strategy, list)
+
+
+def test_parse_arguments_with_list_arguments(monkeypatch, capsys):
+
+    args = parse(monkeypatch, '--tasks', '10', '--nets', 'EWCMLP', 'VanillaMLP', '--fisher-strategy', 'sampled', 'kfac',
+                 '--profile-tasks', '2', '5')
+
+    assert args.profile_tasks == [2, 5]
+    assert 'sampled, kfac' in capsys.readouterr().out
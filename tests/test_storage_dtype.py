@@ -0,0 +1,56 @@
+from argparse import Namespace
+import torch
+import torch.utils.data as D
+from EWCMLP import EWCMLP
+from memory_utils import memory_report
+
+
+# EWC sums and penalty after tasks tasks of consolidation (with the weights moved between tasks, as training would),
+# storing the per-task state in dtype
+def sums_after_tasks(dtype, tasks):
+
+    torch.manual_seed(0)
+
+    model = EWCMLP(10, 784, 10, torch.device('cpu'), lam=15)
+    model.set_storage_dtype(dtype)
+
+    validation_loader = D.DataLoader(D.TensorDataset(torch.rand(20, 784), torch.randint(10, (20,))), batch_size=20)
+
+    args = Namespace(adaptive_fisher=False, validation_dataset_size=20)
+
+    for task in range(1, tasks + 1):
+
+        with torch.no_grad():
+            for parameter in model.parameters():
+                parameter.add_(0.01 * torch.randn(parameter.size()))
+
+        model.update_size_dict(task)
+        model.save_theta_stars(task)
+        model.consolidate(args, task, validation_loader=validation_loader)
+
+    return model, model.penalty(tasks + 1).item()
+
+
+# storing the per-task state in bfloat16 must not change the running EWC sums (and so the penalty), even over a long run
+def test_bfloat16_storage_does_not_drift_over_100_tasks():
+
+    float32_model, float32_penalty = sums_after_tasks(torch.float32, 100)
+    bfloat16_model, bfloat16_penalty = sums_after_tasks(torch.bfloat16, 100)
+
+    for ewc_sums in ['sum_Fx', 'sum_Fx_Wx', 'sum_Fx_Wx_sq']:
+        for float32_sum, bfloat16_sum in zip(getattr(float32_model, ewc_sums), getattr(bfloat16_model, ewc_sums)):
+            assert bfloat16_sum.dtype == torch.float32
+            assert torch.allclose(bfloat16_sum, float32_sum, rtol=1e-6, atol=0)
+
+    assert abs(bfloat16_penalty - float32_penalty) <= 1e-6 * abs(float32_penalty)
+
+    # only the per-task snapshots are narrowed
+    assert bfloat16_model.task_post_training_weights.get(100)[0].dtype == torch.bfloat16
+    assert bfloat16_model.task_fisher_diags.get(100)[0].dtype == torch.bfloat16
+
+    # which halves the memory they take, while the sums take the same memory as before
+    float32_memory = memory_report(float32_model)
+    bfloat16_memory = memory_report(bfloat16_model)
+
+    assert bfloat16_memory.get('post_training_weights') * 2 == float32_memory.get('post_training_weights')
+    assert bfloat16_memory.get('ewc_sums') == float32_memory.get('ewc_sums')
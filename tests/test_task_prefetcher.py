@@ -0,0 +1,138 @@
+import numpy as np
+import torch
+import torch.utils.data as D
+from TaskPrefetcher import TaskPrefetcher
+
+# 8-bit pixel values, as read from mnist, with each sample's target its index so reordered samples can be matched up
+images = torch.randint(256, (50, 784), generator=torch.Generator().manual_seed(0)).float().div(255)
+labels = torch.arange(50)
+
+# the unpermuted test set shared by every task (as in --permute-in-weights mode)
+test_dataset = D.TensorDataset(images[40:], labels[40:])
+
+
+# a stand-in for utils.generate_permuted_mnist_task(), drawing the permutation from the given RNGs
+def generate_task(task_number, generator, random_state):
+
+    permutation = torch.randperm(784, generator=generator)
+
+    # the split between training and validation data is drawn from the numpy RNG
+    split = torch.from_numpy(random_state.permutation(40))
+
+    train_dataset = D.TensorDataset(images[split[:30]][:, permutation], labels[split[:30]])
+    validation_dataset = D.TensorDataset(images[split[30:]][:, permutation], labels[split[30:]])
+
+    return (D.DataLoader(train_dataset, batch_size=8, shuffle=True),
+            D.DataLoader(validation_dataset, batch_size=4, shuffle=False),
+            D.DataLoader(test_dataset, batch_size=4, shuffle=False), permutation)
+
+
+def read(loader):
+
+    data, target = zip(*loader)
+
+    return torch.cat(data), torch.cat(target)
+
+
+def generated_tasks(tasks, seed):
+
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+
+    random_state = np.random.RandomState(seed)
+
+    return [generate_task(task_number, generator, random_state) for task_number in range(1, tasks + 1)]
+
+
+def prefetched_tasks(tasks, seed):
+
+    task_prefetcher = TaskPrefetcher(generate_task, tasks, seed)
+
+    prefetched = [task_prefetcher.next_task() for task in range(tasks)]
+
+    task_prefetcher.close()
+
+    return prefetched
+
+
+# the prefetched loaders hold the same data, in the same batches, as the loaders of the tasks generated directly from
+# RNGs seeded with the same seed- the training data in a different (random) order each time it is iterated over
+def test_prefetched_tasks_match_generated_tasks():
+
+    for generated, prefetched in zip(generated_tasks(3, seed=5), prefetched_tasks(3, seed=5)):
+
+        assert torch.equal(generated[3], prefetched[3])
+
+        for generated_loader, prefetched_loader in zip(generated[1:3], prefetched[1:3]):
+            assert len(prefetched_loader) == len(generated_loader)
+
+            for (generated_data, generated_target), (prefetched_data, prefetched_target) in \
+                    zip(generated_loader, prefetched_loader):
+                assert torch.equal(prefetched_data, generated_data)
+                assert torch.equal(prefetched_target, generated_target)
+
+        generated_data, generated_target = read(generated[0])
+        prefetched_data, prefetched_target = read(prefetched[0])
+
+        assert len(prefetched[0]) == len(generated[0])
+        assert torch.equal(prefetched_data[prefetched_target.argsort()], generated_data[generated_target.argsort()])
+
+
+def test_seed_determines_tasks():
+
+    first, second, other = prefetched_tasks(2, seed=5), prefetched_tasks(2, seed=5), prefetched_tasks(2, seed=6)
+
+    assert all(torch.equal(a[3], b[3]) for a, b in zip(first, second))
+    assert not torch.equal(first[0][3], other[0][3])
+
+
+# the background thread leaves the global RNGs to the training loop
+def test_global_rngs_untouched():
+
+    torch.manual_seed(0)
+    np.random.seed(0)
+
+    torch_state, numpy_state = torch.get_rng_state(), np.random.get_state()
+
+    task_prefetcher = TaskPrefetcher(generate_task, 3, seed=5)
+
+    for task in range(3):
+        train_loader, validation_loader, test_loader, permutation = task_prefetcher.next_task()
+
+    task_prefetcher.close()
+
+    assert torch.equal(torch.get_rng_state(), torch_state)
+    assert np.array_equal(np.random.get_state()[1], numpy_state[1])
+
+
+# pixel data is stored as 8-bit values, and a dataset shared by consecutive tasks is only read once
+def test_storage():
+
+    first, second = prefetched_tasks(2, seed=5)
+
+    assert first[0].dataset.quantized and first[0].dataset.data.dtype == torch.uint8
+
+    assert second[2].dataset is first[2].dataset
+    assert second[1].dataset is not first[1].dataset
+
+
+def test_exception_raised_in_training_loop():
+
+    def failing_task(task_number, generator, random_state):
+
+        if task_number == 2:
+            raise ValueError('task 2')
+
+        return generate_task(task_number, generator, random_state)
+
+    task_prefetcher = TaskPrefetcher(failing_task, 3, seed=5)
+
+    task_prefetcher.next_task()
+
+    try:
+        task_prefetcher.next_task()
+        assert False
+    except ValueError as e:
+        assert str(e) == 'task 2'
+
+    task_prefetcher.close()
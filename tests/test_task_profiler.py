@@ -0,0 +1,86 @@
+from argparse import Namespace
+import os
+import torch
+import torch.utils.data as D
+from EWCMLP import EWCMLP
+from TaskProfiler import NullCapture, TaskProfiler
+
+device = torch.device('cpu')
+
+# 4 training steps per epoch- 8 in all, enough for the default schedule of 1 wait, 1 warmup and 5 active steps
+args = Namespace(lr=0.1, momentum=0, epochs=2, log_interval=1000, train_dataset_size=40, divergence_threshold=1000,
+                 divergence_check_interval=10, divergence_patience=1, adaptive_fisher=False,
+                 validation_dataset_size=20, tasks=100, eval_batch_size=0, eval_memory_ceiling=256)
+
+
+def loader(samples):
+
+    return D.DataLoader(D.TensorDataset(torch.rand(samples, 784), torch.randint(10, (samples,))), batch_size=10)
+
+
+# train and test an EWCMLP on two tasks as main() does, profiling the second task if profile_dir is given
+def train(profile_dir=None):
+
+    torch.manual_seed(0)
+
+    model = EWCMLP(10, 784, 10, device, lam=15)
+
+    model.set_task_profiler(TaskProfiler(profile_dir, 'model', device))
+
+    metrics = {name: [] for name in ['fisher_total', 'post_training_loss', 'fisher_average', 'fisher_st_dev',
+                                     'fisher_max', 'fisher_information', 'ewc_pen']}
+
+    test_loaders = []
+    test_results = []
+
+    for task in [1, 2]:
+        if profile_dir is not None and task == 2:
+            model.task_profiler.begin(task, model.hidden_size)
+
+        test_loaders.append(loader(20))
+
+        model.train_model(args, loader(40), task, validation_loader=loader(20), failure=[0], **metrics)
+
+        with model.task_profiler.capture('test'):
+            test_results.append(model.test(test_loaders, 0, args))
+
+        model.task_profiler.end()
+
+    return model, metrics, test_results
+
+
+# profiling a task does not change what is trained or the test results, and writes a trace and a table of operators
+# for the training steps, consolidation and testing of the profiled task only
+def test_profiled_training_matches_unprofiled_training(tmp_path):
+
+    model, metrics, test_results = train()
+    profiled_model, profiled_metrics, profiled_test_results = train(str(tmp_path))
+
+    for parameter, profiled_parameter in zip(model.parameters(), profiled_model.parameters()):
+        assert torch.equal(parameter, profiled_parameter)
+
+    for sum_Fx, profiled_sum_Fx in zip(model.sum_Fx, profiled_model.sum_Fx):
+        assert torch.equal(sum_Fx, profiled_sum_Fx)
+
+    assert profiled_metrics['post_training_loss'] == metrics['post_training_loss']
+    assert profiled_test_results == test_results
+
+    assert sorted(os.listdir(str(tmp_path))) == sorted('model_task2_hidden10_{}.{}'.format(phase, extension)
+                                                      for phase in ['train', 'consolidate', 'test']
+                                                      for extension in ['json', 'txt'])
+
+    for name in os.listdir(str(tmp_path)):
+        assert os.path.getsize(str(tmp_path / name)) > 0
+
+
+def test_unprofiled_task_records_nothing():
+
+    task_profiler = TaskProfiler()
+
+    task_profiler.start_training()
+    task_profiler.step()
+    task_profiler.stop_training()
+
+    assert not task_profiler.profiling()
+    assert task_profiler.training_profiler is None
+    assert isinstance(task_profiler.capture('test'), NullCapture)
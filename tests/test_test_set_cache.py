@@ -0,0 +1,48 @@
+from argparse import Namespace
+import pytest
+import torch
+import torch.utils.data as D
+from TestSetCache import TestSetCache
+from VanillaMLP import VanillaMLP
+
+args = Namespace(eval_batch_size=0, eval_memory_ceiling=256)
+
+device = torch.device('cpu')
+
+
+def shuffled_loader(data, target):
+
+    return D.DataLoader(D.TensorDataset(data, target), batch_size=30, shuffle=True)
+
+
+# Testing on cached test sets gives the same results as testing on the tasks' DataLoaders- whether each permuted task
+# is materialized (a budget of 1 MB) or permuted as it is read (no budget).
+@pytest.mark.parametrize('budget', [0, 2**20])
+def test_cached_test_sets_match_loaders(budget):
+
+    torch.manual_seed(0)
+
+    data, target = torch.rand(100, 784), torch.randint(10, (100,))
+    permutations = [None, torch.randperm(784), torch.randperm(784)]
+
+    model = VanillaMLP(10, 784, 10, device)
+
+    for task in range(1, 4):
+        model.update_size_dict(task)
+        model.save_theta_stars(task)
+
+    test_set_cache = TestSetCache(device, 30, budget)
+
+    loaders = []
+    cached = []
+
+    for permutation in permutations:
+        loader = shuffled_loader(data if permutation is None else data[:, permutation], target)
+
+        loaders.append(loader)
+        cached.append(test_set_cache.add_task(loader, permutation))
+
+    assert model.test(cached, 0, args) == model.test(loaders, 0, args)
+
+    # only the base data is held without a budget
+    assert test_set_cache.used == (3 if budget else 1) * TestSetCache.size_of(data) + TestSetCache.size_of(target)
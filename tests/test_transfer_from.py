@@ -0,0 +1,71 @@
+from argparse import Namespace
+import copy
+import torch
+import torch.nn.functional as F
+import torch.utils.data as D
+import utils
+from EWCMLP import EWCMLP
+
+device = torch.device('cpu')
+
+args = Namespace(adaptive_fisher=False, validation_dataset_size=40)
+
+
+def consolidated_model():
+
+    torch.manual_seed(0)
+
+    model = EWCMLP(10, 784, 10, device, lam=15)
+
+    validation_loader = D.DataLoader(D.TensorDataset(torch.rand(40, 784), torch.randint(10, (40,))), batch_size=40)
+
+    for task in [1, 2]:
+        with torch.no_grad():
+            for parameter in model.parameters():
+                parameter.add_(0.1 * torch.randn(parameter.size()))
+
+        model.update_size_dict(task)
+        model.save_theta_stars(task)
+        model.consolidate(args, task, validation_loader=validation_loader)
+
+    return model
+
+
+# An expanded model takes over the per-task state of the model it replaces without copying it. The state must be the
+# same as that of a deep copy of the old model's (as expanded models used to be given), with the EWC sums padded with
+# zeros to the new size and the old weights in the upper-left of the new ones.
+def test_transferred_state_matches_copied_state():
+
+    model = consolidated_model()
+
+    copied = {attribute: copy.deepcopy(getattr(model, attribute)) for attribute in EWCMLP.transferred_attributes}
+    weights = [parameter.data.clone() for parameter in model.parameters()]
+
+    task_post_training_weights = model.task_post_training_weights
+
+    expanded_model = EWCMLP.from_existing_model(model, 20)
+
+    # moved, not copied- and released by the old model
+    assert expanded_model.task_post_training_weights is task_post_training_weights
+    assert model.task_post_training_weights is None
+    assert all(parameter.numel() == 0 for parameter in model.parameters())
+
+    assert expanded_model.size_dictionary == copied.get('size_dictionary')
+    assert expanded_model.fisher_sample_counts == copied.get('fisher_sample_counts')
+
+    for task in [1, 2]:
+        for transferred, expected in zip(expanded_model.task_post_training_weights.get(task),
+                                         copied.get('task_post_training_weights').get(task)):
+            assert torch.equal(transferred, expected)
+
+        for transferred, expected in zip(expanded_model.task_fisher_diags.get(task),
+                                         copied.get('task_fisher_diags').get(task)):
+            assert torch.equal(transferred, expected)
+
+    for ewc_sum in ['sum_Fx', 'sum_Fx_Wx', 'sum_Fx_Wx_sq']:
+        for parameter, transferred, expected in zip(expanded_model.parameters(), getattr(expanded_model, ewc_sum),
+                                                    copied.get(ewc_sum)):
+            assert torch.equal(transferred, F.pad(expected, utils.pad_tuple(expected, parameter)))
+
+    for parameter, old_weights in zip(expanded_model.parameters(), weights):
+        assert torch.equal(parameter.data[tuple(slice(0, n) for n in old_weights.shape)], old_weights)
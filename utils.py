@@ -11,17 +11,27 @@ import subprocess
 import pickle
 
 
-def generate_percent_permutation(percent, length):
+# random_state is the source of random numbers- the global NumPy RNG unless a dedicated np.random.RandomState is given
+def generate_percent_permutation(percent, length, random_state=np.random):
     
     perm_size = int(length * (percent / 100.0))
     
-    indices = np.random.choice(length, size=perm_size, replace=False)
+    indices = random_state.choice(length, size=perm_size, replace=False)
     
     perm = np.arange(len(indices))
-    np.random.shuffle(perm)
+    random_state.shuffle(perm)
 
     return indices, perm
 
+# the permutation applied by apply_permutation(image, indices, perm) as a LongTensor p, such that it is equivalent to
+# image[p]
+def percent_permutation_index(indices, perm, length):
+
+    pixel_permutation = torch.arange(length)
+    pixel_permutation[torch.from_numpy(indices)] = torch.from_numpy(indices[perm])
+
+    return pixel_permutation
+
 def apply_permutation(image, indices, perm):
 
     permute_sample = image[indices]
@@ -35,10 +45,23 @@ def apply_permutation(image, indices, perm):
 
 # generate the DataLoaders corresponding to a permuted mnist task
 def generate_new_mnist_task(args, kwargs, first_task):
+
+    train_loader, validation_loader, test_loader, pixel_permutation = \
+        generate_permuted_mnist_task(args, kwargs, first_task)
+
+    return train_loader, validation_loader, test_loader
+
+
+# generate the DataLoaders corresponding to a permuted mnist task, along with the permutation that has been applied to
+# its data (as a LongTensor p such that each permuted image is x[p]- None for the first task, which is not permuted)
+#
+# generator (torch.Generator) and random_state (np.random.RandomState) are the sources of random numbers used to
+# generate the task- the global RNGs unless dedicated ones are given (see TaskPrefetcher)
+def generate_permuted_mnist_task(args, kwargs, first_task, generator=torch.default_generator, random_state=np.random):
     
     if args.perm == 100: # TODO reset to 100
         # permutation to be applied to all images in the dataset (if this is not the first dataset being generated)
-        pixel_permutation = torch.randperm(args.input_size)
+        pixel_permutation = torch.randperm(args.input_size, generator=generator)
 
         # transforms.Compose() composes several transforms together.
         #
@@ -76,9 +99,10 @@ def generate_new_mnist_task(args, kwargs, first_task):
     else:
         # permute only a specified percentage of the pixels in the image
 
-        indices, perm = generate_percent_permutation(args.perm, args.input_size)
+        indices, perm = generate_percent_permutation(args.perm, args.input_size, random_state)
+
+        pixel_permutation = percent_permutation_index(indices, perm, args.input_size)
 
-        
         transformations = transforms.Compose(
             [
                 transforms.ToTensor(),
@@ -107,7 +131,7 @@ def generate_new_mnist_task(args, kwargs, first_task):
     #                                       If dataset is already downloaded, it is not downloaded again.
     train_data, validation_data = \
         D.dataset.random_split(datasets.MNIST('../data', train=True, transform=transformations, download=True),
-            [args.train_dataset_size, args.validation_dataset_size])
+            [args.train_dataset_size, args.validation_dataset_size], generator=generator)
 
     # Testing dataset.
     # train=False, because we want to draw the data here from <root>/test.pt (as opposed to <root>/training.pt)
@@ -137,7 +161,68 @@ def generate_new_mnist_task(args, kwargs, first_task):
     #   Here, we use test_data rather than train_data, and we use test_batch_size
     test_loader = D.DataLoader(test_data, batch_size=args.test_batch_size, shuffle=True, **kwargs)
 
-    return train_loader, validation_loader, test_loader
+    return train_loader, validation_loader, test_loader, None if first_task else pixel_permutation
+
+
+# the unpermuted MNIST training and testing datasets, loaded once and shared by every task generated by
+# generate_new_mnist_permutation_task()
+mnist_base_datasets = {}
+
+
+# Generate the pixel permutation defining a new permuted mnist task, as a LongTensor p such that the permuted version
+# of a (flattened) image x is x[p]- or None for the first task, which is not permuted.
+#
+# Random numbers are drawn in the same order as in generate_permuted_mnist_task(), so a given seed produces the same
+# sequence of tasks whether the permutations are applied to the data or to the network's weights.
+def generate_mnist_permutation(args, first_task, generator=torch.default_generator, random_state=np.random):
+
+    if args.perm == 100:
+        pixel_permutation = torch.randperm(args.input_size, generator=generator)
+
+    else:
+        # permute only a specified percentage of the pixels in the image (see apply_permutation())
+        indices, perm = generate_percent_permutation(args.perm, args.input_size, random_state)
+
+        pixel_permutation = percent_permutation_index(indices, perm, args.input_size)
+
+    return None if first_task else pixel_permutation
+
+
+# generate the DataLoaders corresponding to a permuted mnist task WITHOUT permuting its data- the permutation is
+# returned along with them, to be folded into the first layer's weights of the network (see MLP.begin_task()). Every
+# task shares the same (unpermuted) datasets, so no per-sample permutation takes place while loading the data.
+#
+# generator and random_state are as in generate_permuted_mnist_task()
+def generate_new_mnist_permutation_task(args, kwargs, first_task, generator=torch.default_generator,
+                                        random_state=np.random):
+
+    pixel_permutation = generate_mnist_permutation(args, first_task, generator, random_state)
+
+    if not mnist_base_datasets:
+
+        transformations = transforms.Compose(
+            [
+                transforms.ToTensor(),
+                transforms.Lambda(lambda x: x.view(-1, 1))
+            ])
+
+        mnist_base_datasets.update({
+            'train': datasets.MNIST('../data', train=True, transform=transformations, download=True),
+            'test': datasets.MNIST('../data', train=False, transform=transformations, download=True)
+        })
+
+    # each task still gets its own random split of the training data into training and validation datasets
+    train_data, validation_data = \
+        D.dataset.random_split(mnist_base_datasets.get('train'), [args.train_dataset_size, args.validation_dataset_size],
+                               generator=generator)
+
+    train_loader = D.DataLoader(train_data, batch_size=args.batch_size, shuffle=True, **kwargs)
+
+    validation_loader = D.DataLoader(validation_data, batch_size=args.validation_dataset_size, shuffle=True, **kwargs)
+
+    test_loader = D.DataLoader(mnist_base_datasets.get('test'), batch_size=args.test_batch_size, shuffle=True, **kwargs)
+
+    return train_loader, validation_loader, test_loader, pixel_permutation
 
 
 # Generate and return a tuple representing the padding size to be used as an argument to torch.nn.functional.pad().
@@ -182,14 +267,22 @@ def expand(models, args):
     expanded_models = []
 
     for model_num, model in enumerate(models):
-        if model.__class__.__bases__[0].__name__ == 'MLP':
-            expanded_models.append(
-                model.__class__.from_existing_model(model, model.hidden_size * args.scale_factor).to(model.device))
-        elif model.__class__.__bases__[0].__name__ == 'CNN':
-            expanded_models.append(
-                model.__class__.from_existing_model(model, model.hidden_size + args.scale_factor).to(model.device))
+        if model.architecture().__name__ == 'MLP':
+            new_hidden_size = model.hidden_size * args.scale_factor
+        elif model.architecture().__name__ == 'CNN':
+            new_hidden_size = model.hidden_size + args.scale_factor
         else:
             print("ERROR- invalid network type detected")
+            continue
+
+        # elastic capacity models with enough preallocated capacity only need to move the boundary of their active
+        # weights- otherwise, build a new, larger model from the existing one
+        if model.can_expand_in_place(new_hidden_size):
+            model.expand_in_place(new_hidden_size)
+            expanded_models.append(model)
+        else:
+            expanded_models.append(
+                model.__class__.from_existing_model(model, new_hidden_size).to(model.device))
 
     for model in expanded_models:
         for parameter in model.parameters():